@@ -0,0 +1,453 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import os_dbnetget
+from os_dbnetget.clients.sync_client import SyncClient, SyncClientPool
+from os_dbnetget.commands.qdb import qdb_key
+from os_qdb_protocal import create_protocal
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qdb_server import add_server_arguments  # noqa: E402
+
+CLIENT_TARGETS = ['sync-client', 'sync-client-pipeline', 'sync-pool',
+                  'sync-pool-many', 'tornado-pool', 'asyncio-pool']
+CLI_TARGETS = ['cli-default', 'cli-mp', 'cli-tornado', 'cli-asyncio', 'cli-m3']
+TARGETS = CLIENT_TARGETS + CLI_TARGETS
+
+BATCH_SIZE = 128
+
+
+def percentile(latencies, p):
+    if not latencies:
+        return None
+    latencies = sorted(latencies)
+    idx = min(len(latencies) - 1, int(len(latencies) * p / 100.0))
+    return latencies[idx] * 1000
+
+
+def bench_urls(count):
+    return ['http://bench.example.com/{}'.format(i) for i in range(count)]
+
+
+def client_kwargs(args):
+    return {'retry_max': 3, 'retry_interval': 0, 'timeout': args.timeout}
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, count=1):
+        with self._lock:
+            self.latencies.extend([latency] * count)
+
+    def error(self, count=1):
+        with self._lock:
+            self.errors += count
+
+
+def chunks(protos, size):
+    for i in range(0, len(protos), size):
+        yield protos[i:i + size]
+
+
+def run_threads(concurrency, func):
+    threads = [threading.Thread(target=func) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def shared_iter(items):
+    lock = threading.Lock()
+    it = iter(items)
+
+    def _next():
+        with lock:
+            return next(it, None)
+    return _next
+
+
+def bench_sync_client(args, protos, recorder):
+    address, port = args.endpoint.rsplit(':', 1)
+    client = SyncClient(address, int(port), **client_kwargs(args))
+    try:
+        if args.target == 'sync-client':
+            for p in protos:
+                start = time.time()
+                try:
+                    client.execute(p)
+                except Exception:
+                    recorder.error()
+                    continue
+                recorder.record(time.time() - start)
+        else:
+            for batch in chunks(protos, BATCH_SIZE):
+                start = time.time()
+                try:
+                    client.execute_pipeline(batch)
+                except Exception:
+                    recorder.error(len(batch))
+                    continue
+                recorder.record(time.time() - start, len(batch))
+    finally:
+        client.close()
+
+
+def bench_sync_pool(args, protos, recorder):
+    pool = SyncClientPool([args.endpoint], max_concurrency=args.concurrency,
+                          **client_kwargs(args))
+
+    if args.target == 'sync-pool':
+        next_proto = shared_iter(protos)
+
+        def _work():
+            while True:
+                p = next_proto()
+                if p is None:
+                    break
+                start = time.time()
+                try:
+                    pool.execute(p)
+                except Exception:
+                    recorder.error()
+                    continue
+                recorder.record(time.time() - start)
+    else:
+        next_batch = shared_iter(list(chunks(protos, BATCH_SIZE * 8)))
+
+        def _work():
+            while True:
+                batch = next_batch()
+                if batch is None:
+                    break
+                start = time.time()
+                try:
+                    for _ in pool.execute_many(batch, BATCH_SIZE):
+                        pass
+                except Exception:
+                    recorder.error(len(batch))
+                    continue
+                recorder.record(time.time() - start, len(batch))
+
+    try:
+        run_threads(args.concurrency, _work)
+    finally:
+        pool.close()
+
+
+def bench_tornado_pool(args, protos, recorder):
+    from tornado import gen
+    from tornado.ioloop import IOLoop
+    from os_dbnetget.clients.tornado_client import TornadoClientPool
+
+    pool = TornadoClientPool([args.endpoint], max_concurrency=args.concurrency,
+                             **client_kwargs(args))
+    next_proto = shared_iter(protos)
+
+    @gen.coroutine
+    def _work():
+        while True:
+            p = next_proto()
+            if p is None:
+                break
+            start = time.time()
+            try:
+                yield pool.execute(p)
+            except Exception:
+                recorder.error()
+                continue
+            recorder.record(time.time() - start)
+
+    @gen.coroutine
+    def _main():
+        try:
+            yield [_work() for _ in range(args.concurrency)]
+        finally:
+            yield pool.close()
+
+    IOLoop.current().run_sync(_main)
+
+
+def bench_asyncio_pool(args, protos, recorder):
+    import asyncio
+    from os_dbnetget.clients.asyncio_client import AsyncioClientPool
+
+    next_proto = shared_iter(protos)
+
+    async def _work(pool):
+        while True:
+            p = next_proto()
+            if p is None:
+                break
+            start = time.time()
+            try:
+                await pool.execute(p)
+            except Exception:
+                recorder.error()
+                continue
+            recorder.record(time.time() - start)
+
+    async def _main():
+        pool = AsyncioClientPool([args.endpoint], max_concurrency=args.concurrency,
+                                 **client_kwargs(args))
+        try:
+            await asyncio.gather(*[_work(pool) for _ in range(args.concurrency)])
+        finally:
+            await pool.close()
+
+    asyncio.get_event_loop().run_until_complete(_main())
+
+
+BENCH_FUNCS = {
+    'sync-client': bench_sync_client,
+    'sync-client-pipeline': bench_sync_client,
+    'sync-pool': bench_sync_pool,
+    'sync-pool-many': bench_sync_pool,
+    'tornado-pool': bench_tornado_pool,
+    'asyncio-pool': bench_asyncio_pool,
+}
+
+
+def run_worker(args):
+    protos = [create_protocal(args.cmd, qdb_key(url))
+              for url in bench_urls(args.requests)]
+    recorder = Recorder()
+    start = time.time()
+    BENCH_FUNCS[args.target](args, protos, recorder)
+    elapsed = time.time() - start
+    sys.stdout.write(json.dumps({
+        'elapsed': elapsed,
+        'errors': recorder.errors,
+        'p50_ms': percentile(recorder.latencies, 50),
+        'p99_ms': percentile(recorder.latencies, 99),
+    }))
+    sys.stdout.flush()
+
+
+def cli_command(args, engine, input_file, progress_file):
+    cmd = [sys.executable, '-m', 'os_dbnetget.cmdline', '-l', 'ERROR',
+           args.cmd, '--engine', engine, '-E', args.endpoint,
+           '-i', input_file, '-o', os.devnull,
+           '--progress-file', progress_file,
+           '--client-retry-max', '3', '--client-retry-interval', '0']
+    if engine in ('tornado', 'asyncio'):
+        cmd.extend(['--concurrency', str(args.concurrency)])
+    elif engine == 'm3':
+        cmd.extend(['--thread-num', str(min(args.concurrency, 100))])
+    elif engine == 'mp':
+        cmd.extend(['--process-num', str(args.processes)])
+    return cmd
+
+
+def worker_command(args, target):
+    return [sys.executable, os.path.abspath(__file__), '--worker',
+            '--target', target, '--endpoint', args.endpoint,
+            '--cmd', args.cmd, '--requests', str(args.requests),
+            '--concurrency', str(args.concurrency),
+            '--timeout', str(args.timeout)]
+
+
+def run_process(cmd):
+    # wait4 gives the rusage of exactly this process tree
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    start = time.time()
+    stdout = proc.stdout.read()
+    proc.stdout.close()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    elapsed = time.time() - start
+    max_rss = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss //= 1024
+    return proc.returncode, stdout, elapsed, max_rss
+
+
+def last_progress(progress_file):
+    # the final progress snapshot is written when the command finishes
+    try:
+        with open(progress_file) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return None
+    if not lines:
+        return None
+    return json.loads(lines[-1])
+
+
+def run_cli(args, target, input_file):
+    fd, progress_file = tempfile.mkstemp(suffix='.jsonl')
+    os.close(fd)
+    try:
+        cmd = cli_command(args, target[len('cli-'):], input_file, progress_file)
+        returncode, _, elapsed, max_rss = run_process(cmd)
+        progress = last_progress(progress_file)
+    finally:
+        os.remove(progress_file)
+    processed = progress['processed'] if progress is not None else 0
+    result = {
+        'returncode': returncode,
+        'elapsed': elapsed,
+        'max_rss_kb': max_rss,
+        'processed': processed,
+        'errors': progress['errors'] if progress is not None else None,
+    }
+    # a crashed engine may still exit 0, it must have processed every line
+    result['failed'] = returncode != 0 or processed != args.requests
+    return result
+
+
+def run_client(args, target):
+    returncode, stdout, elapsed, max_rss = run_process(worker_command(args, target))
+    result = {
+        'returncode': returncode,
+        'elapsed': elapsed,
+        'max_rss_kb': max_rss,
+        'failed': returncode != 0,
+    }
+    if returncode == 0:
+        result.update(json.loads(stdout.decode('utf-8')))
+    return result
+
+
+def run_target(args, target, input_file):
+    result = {
+        'target': target,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'errors': None,
+        'p50_ms': None,
+        'p99_ms': None,
+    }
+    if target in CLI_TARGETS:
+        result.update(run_cli(args, target, input_file))
+    else:
+        result.update(run_client(args, target))
+    elapsed = result['elapsed']
+    result['rps'] = None
+    if not result['failed'] and elapsed > 0:
+        result['rps'] = args.requests / elapsed
+    return result
+
+
+def start_server(args):
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'qdb_server.py')
+    cmd = [sys.executable, server_script, '--port', '0',
+           '--latency', str(args.latency),
+           '--payload-size', str(args.payload_size),
+           '--miss-rate', str(args.miss_rate),
+           '--error-rate', str(args.error_rate),
+           '--disconnect-rate', str(args.disconnect_rate)]
+    if args.seed is not None:
+        cmd.extend(['--seed', str(args.seed)])
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    endpoint = proc.stdout.readline().decode('utf-8').strip()
+    return proc, endpoint
+
+
+def format_ms(value):
+    return '-' if value is None else '{:.3f}'.format(value)
+
+
+def report(results):
+    header = '{:<22}{:>12}{:>10}{:>10}{:>10}{:>12}{:>8}{:>8}'.format(
+        'target', 'req/s', 'p50(ms)', 'p99(ms)', 'errors', 'rss(KB)', 'rc',
+        'status')
+    sys.stderr.write(header + '\n')
+    for r in results:
+        sys.stderr.write('{:<22}{:>12}{:>10}{:>10}{:>10}{:>12}{:>8}{:>8}\n'.format(
+            r['target'],
+            '-' if r['rps'] is None else '{:.1f}'.format(r['rps']),
+            format_ms(r['p50_ms']), format_ms(r['p99_ms']),
+            '-' if r['errors'] is None else r['errors'],
+            r['max_rss_kb'], r['returncode'],
+            'failed' if r['failed'] else 'ok'))
+
+
+def run_bench(args):
+    server = None
+    if args.endpoint is None:
+        server, args.endpoint = start_server(args)
+    fd, input_file = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(bench_urls(args.requests)))
+            f.write('\n')
+        results = [run_target(args, target, input_file)
+                   for target in args.targets]
+    finally:
+        os.remove(input_file)
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report(results)
+    data = {
+        'version': os_dbnetget.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'cmd': args.cmd,
+        'server': {
+            'endpoint': args.endpoint if server is None else None,
+            'latency_ms': args.latency,
+            'payload_size': args.payload_size,
+            'miss_rate': args.miss_rate,
+            'error_rate': args.error_rate,
+            'disconnect_rate': args.disconnect_rate,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    else:
+        json.dump(data, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    failed = [r['target'] for r in results if r['failed']]
+    if failed:
+        sys.stderr.write('Failed targets: {}\n'.format(' '.join(failed)))
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='os-dbnetget benchmarks')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=TARGETS,
+                        help='targets to run (default: all)')
+    parser.add_argument('--cmd', choices=('get', 'test'), default='test',
+                        help='qdb command (default: test)')
+    parser.add_argument('--requests', type=int, default=20000,
+                        help='requests per target (default: 20000)')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='clients/threads/coroutines (default: 10)')
+    parser.add_argument('--processes', type=int, default=2,
+                        help='process num of the mp engine (default: 2)')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='client timeout (default: 10)')
+    parser.add_argument('--endpoint',
+                        help='benchmark an existing server instead of starting one')
+    parser.add_argument('-o', '--output', help='result json file (default: stdout)')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--target', help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args)
+    else:
+        run_bench(args)
+
+
+if __name__ == '__main__':
+    main()
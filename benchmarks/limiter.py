@@ -0,0 +1,63 @@
+import argparse
+import sys
+import timeit
+
+from os_dbnetget.clients.balancing import EndpointSet
+from os_dbnetget.clients.limiter import TokenBucket
+
+# the rate is high enough that no call waits for tokens
+RATE = 1e12
+
+
+class NullClient(object):
+    def __init__(self, address, port):
+        pass
+
+    def close(self):
+        pass
+
+
+def checkout_func(bucket):
+    es = EndpointSet(['localhost:1'], max_concurrency=1)
+    es.states[0].bucket = bucket
+
+    def _checkout():
+        state, client = es.checkout(NullClient)
+        es.checkin(state, client)
+    return _checkout
+
+
+def measure(number):
+    # microseconds per call. a limited request pays one bucket call, reserve
+    # for the global limit and try_acquire at checkout for the endpoint's,
+    # the checkouts with and without a bucket show it in context
+    bucket = TokenBucket(RATE)
+    timings = {}
+    for name, func in (('reserve', bucket.reserve),
+                       ('try_acquire', bucket.try_acquire),
+                       ('checkout', checkout_func(None)),
+                       ('checkout_limited', checkout_func(TokenBucket(RATE)))):
+        timings[name] = min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rate limiter overhead')
+    parser.add_argument('--number', type=int, default=100000,
+                        help='calls per measurement (default: 100000)')
+    parser.add_argument('--max-us', type=float, default=1.0,
+                        help='exit 1 when a bucket call takes longer in '
+                        'microseconds (default: 1.0)')
+    args = parser.parse_args()
+    timings = measure(args.number)
+    for name in sorted(timings):
+        sys.stdout.write('{:<20}{:>10.3f}us\n'.format(name, timings[name]))
+    slow = [name for name in ('reserve', 'try_acquire')
+            if timings[name] > args.max_us]
+    if slow:
+        sys.stderr.write('Over {}us: {}\n'.format(args.max_us, ' '.join(slow)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+import argparse
+import random
+import socket
+import struct
+import sys
+import time
+
+GET = 1
+TEST = 12
+HEADER_SIZE = 1 + 4
+
+
+class BenchHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server = self.server
+        self._random = random.Random(server.seed)
+        self._hit = struct.pack('>ii', 0, server.payload_size) + \
+            b'x' * server.payload_size
+        self._test_hit = struct.pack('>i', 0)
+        self._miss = struct.pack('>i', 1)
+        self._get_error = struct.pack('>i', -1)
+        self._test_error = struct.pack('>ii', -1, 5)
+
+    def response(self, cmd):
+        server = self.server
+        r = self._random.random()
+        if r < server.error_rate:
+            return self._get_error if cmd == GET else self._test_error
+        if r < server.error_rate + server.miss_rate:
+            return self._miss
+        return self._hit if cmd == GET else self._test_hit
+
+    def handle(self):
+        server = self.server
+        buf = b''
+        while True:
+            try:
+                data = self.request.recv(65536)
+            except socket.error:
+                break
+            if not data:
+                break
+            buf += data
+            responses = []
+            offset = 0
+            while len(buf) - offset >= HEADER_SIZE:
+                cmd, key_length = struct.unpack_from('>bi', buf, offset)
+                size = HEADER_SIZE + key_length + 4
+                if len(buf) - offset < size:
+                    break
+                offset += size
+                if self._random.random() < server.disconnect_rate:
+                    return
+                responses.append(self.response(cmd))
+            buf = buf[offset:]
+            if not responses:
+                continue
+            # latency is paid once per received batch, like a server
+            # processing pipelined requests concurrently
+            if server.latency > 0:
+                time.sleep(server.latency)
+            try:
+                self.request.sendall(b''.join(responses))
+            except socket.error:
+                break
+
+
+class BenchServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0, payload_size=128, miss_rate=0,
+                 error_rate=0, disconnect_rate=0, seed=None):
+        socketserver.ThreadingTCPServer.__init__(self, address, BenchHandler)
+        self.latency = latency
+        self.payload_size = payload_size
+        self.miss_rate = miss_rate
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.seed = seed
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0,
+                        help='server latency in ms (default: 0)')
+    parser.add_argument('--payload-size', type=int, default=128,
+                        help='get value size in bytes (default: 128)')
+    parser.add_argument('--miss-rate', type=float, default=0,
+                        help='ratio of not exist responses (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='ratio of error responses (default: 0)')
+    parser.add_argument('--disconnect-rate', type=float, default=0,
+                        help='ratio of requests that close the connection (default: 0)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed')
+
+
+def server_kwargs(args):
+    return {
+        'latency': args.latency / 1000.0,
+        'payload_size': args.payload_size,
+        'miss_rate': args.miss_rate,
+        'error_rate': args.error_rate,
+        'disconnect_rate': args.disconnect_rate,
+        'seed': args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fast fake qdb server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=0,
+                        help='listen port, 0 for a random port (default: 0)')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = BenchServer((args.host, args.port), **server_kwargs(args))
+    sys.stdout.write('{}:{}\n'.format(*server.server_address[:2]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,9 @@ setup(
         'tornado': ['tornado>5.1'],
         'm3': ['os-m3-engine'],
         'rotate': ['os-rotatefile'],
+        'uvloop': ['uvloop'],
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
     },
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
@@ -0,0 +1,588 @@
+import asyncio
+import logging
+import socket
+import time
+from collections import deque
+from itertools import islice
+
+from os_dbnetget.clients.backoff import Backoff
+from os_dbnetget.clients.balancing import EndpointSet
+from os_dbnetget.clients.breaker import probe_protocal
+from os_dbnetget.clients.limiter import create_bucket
+from os_dbnetget.clients.metrics import Metrics
+from os_dbnetget.clients.client import (RETRY_NETWORK_ERRNO, Client, Flight,
+                                       copy_proto, dedup_protos, fill_proto,
+                                       proto_key, warm_up_report)
+from os_dbnetget.exceptions import (ResourceLimit, RetryLimitExceeded,
+                                    Unavailable)
+
+socket.setdefaulttimeout(10)
+
+NETWORK_ERRORS = (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                  ConnectionError)
+
+
+class AsyncioClient(Client):
+    def __init__(self, address, port, **kwargs):
+        super(AsyncioClient, self).__init__(address, port, **kwargs)
+        self._timeout = kwargs.get('timeout', socket.getdefaulttimeout())
+        assert self._timeout > 0, 'timeout must be negative'
+        self._connect_timeout = kwargs.get('connect_timeout', self._timeout)
+        assert self._connect_timeout > 0, 'connect_timeout must be negative'
+        self._recv_timeout = kwargs.get('recv_timeout', self._timeout)
+        assert self._recv_timeout > 0, 'recv_timeout must be negative'
+        self._retry_max = kwargs.get('retry_max', 3)
+        assert 0 <= self._retry_max <= 120, 'retry_max must be [0, 120]'
+        self._retry_interval = kwargs.get('retry_interval', 5)
+        assert self._retry_interval >= 0, 'retry_interval must be non-negative'
+        self._backoff = Backoff(self._retry_interval,
+                                max(self._retry_interval,
+                                    kwargs.get('retry_max_interval', 60)))
+        self._pipeline_depth = kwargs.get('pipeline_depth', 16)
+        assert 1 <= self._pipeline_depth <= 1024, 'pipeline_depth must be [1, 1024]'
+        self._retry_count = -1
+        self._need_reconnect = True
+        self._reader = None
+        self._writer = None
+        self._closed = False
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    async def _reconnect(self):
+        while self._retry_count < self._retry_max:
+            self.__ensure_not_closed()
+            self.__close_stream()
+            try:
+                start = time.time()
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self._address, self._port),
+                    self._connect_timeout)
+                self._metrics.record_connect(time.time() - start)
+                break
+            except (asyncio.TimeoutError, OSError) as e:
+                self._record_error(e)
+                raise_e = False
+                if self._retry_max <= 0:
+                    raise_e = True
+                if not isinstance(e, asyncio.TimeoutError):
+                    if e.args[0] not in RETRY_NETWORK_ERRNO:
+                        raise_e = True
+                else:
+                    e = asyncio.TimeoutError('time out')
+
+                self._logger.debug('Connect error {}:{}, {}'.format(
+                    self._address, self._port, e))
+                if raise_e:
+                    raise e
+
+                self._retry_count += 1
+                if self._retry_count < self._retry_max:
+                    self._metrics.incr('retries')
+                    delay = self._backoff.delay(self._retry_count)
+                    self._logger.debug('Connect retry {}:{} in {:.3f}s, {}/{}'.format(
+                        self._address, self._port, delay,
+                        self._retry_count + 1, self._retry_max))
+                    await asyncio.sleep(delay)
+
+        self.__ensure_not_closed()
+        if self._retry_count >= self._retry_max:
+            raise RetryLimitExceeded(
+                'Exceed retry limit {}/{}'.format(self._retry_count, self._retry_max))
+        self._retry_count = -1
+
+    async def _execute(self, qdb_proto):
+        self.__ensure_not_closed()
+        start = time.time()
+        bytes_out = 0
+        for data in qdb_proto.upstream():
+            self._writer.write(data)
+            bytes_out += len(data)
+        await self._writer.drain()
+        end = time.time()
+        bytes_in, first_byte = await self._recv_response(qdb_proto)
+        self._metrics.record_request(end - start, first_byte - end,
+                                     time.time() - start, bytes_out, bytes_in)
+        return qdb_proto
+
+    async def _execute_pipeline(self, pending, depth):
+        self.__ensure_not_closed()
+        sent = 0
+        sent_at = deque()
+        while pending:
+            limit = min(depth, len(pending))
+            if sent < limit:
+                start = time.time()
+                requests = [b''.join(qdb_proto.upstream())
+                            for qdb_proto in islice(pending, sent, limit)]
+                self._writer.write(b''.join(requests))
+                await self._writer.drain()
+                end = time.time()
+                sent_at.extend([(start, end, len(r)) for r in requests])
+                sent = limit
+            start, end, bytes_out = sent_at.popleft()
+            bytes_in, first_byte = await self._recv_response(pending[0])
+            self._metrics.record_request(end - start, first_byte - end,
+                                         time.time() - start, bytes_out, bytes_in)
+            pending.popleft()
+            sent -= 1
+
+    async def _recv_response(self, qdb_proto):
+        downstream = qdb_proto.downstream()
+        read_size = next(downstream)
+        bytes_in = 0
+        first_byte = None
+        while read_size > 0:
+            data = await asyncio.wait_for(
+                self._reader.readexactly(read_size), self._recv_timeout)
+            if first_byte is None:
+                first_byte = time.time()
+            bytes_in += read_size
+            read_size = downstream.send(data)
+        return bytes_in, first_byte
+
+    async def connect(self):
+        if self._writer is None:
+            await self._reconnect()
+
+    async def execute(self, qdb_proto):
+        if self._writer is None:
+            await self._reconnect()
+        while True:
+            try:
+                return await self._execute(qdb_proto)
+            except NETWORK_ERRORS as e:
+                self._logger.warning('Network error {}:{} {}'.format(
+                    self._address, self._port, e))
+                self._record_error(e)
+                self._metrics.incr('reconnects')
+                await self._reconnect()
+                self._need_reconnect = False
+
+    async def execute_pipeline(self, qdb_protos, depth=None):
+        qdb_protos = list(qdb_protos)
+        await self.execute_pending(deque(qdb_protos), depth)
+        return qdb_protos
+
+    async def execute_pending(self, pending, depth=None):
+        if depth is None:
+            depth = self._pipeline_depth
+        assert depth >= 1, 'depth must be positive'
+        if self._writer is None and pending:
+            await self._reconnect()
+        while pending:
+            try:
+                await self._execute_pipeline(pending, depth)
+            except NETWORK_ERRORS as e:
+                self._logger.warning('Network error {}:{} {}, {} pending'.format(
+                    self._address, self._port, e, len(pending)))
+                self._record_error(e)
+                self._metrics.incr('reconnects')
+                await self._reconnect()
+                self._need_reconnect = False
+
+    def __ensure_not_closed(self):
+        if self._closed:
+            raise Unavailable('Client already closed')
+
+    def _record_error(self, e):
+        self._metrics.incr('timeouts' if isinstance(e, asyncio.TimeoutError) else 'errors')
+
+    def __close_stream(self):
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            finally:
+                self._reader = self._writer = None
+
+    def close(self):
+        self.__close_stream()
+        self._closed = True
+
+
+class AsyncioClientPool(object):
+
+    def __init__(self, endpoints, max_concurrency=1, cache=None, coalesce=False,
+                 router=None, balancer=None, max_qps=None,
+                 max_qps_per_endpoint=None, qps_burst=1.0,
+                 breaker_threshold=3, probe_interval=1.0, hedger=None,
+                 min_concurrency=1, idle_timeout=60, **kwargs):
+        self._endpoints = endpoints
+        if kwargs.get('metrics', None) is None:
+            kwargs['metrics'] = Metrics()
+        self._metrics = kwargs['metrics']
+        self._router = router
+        self._shards = []
+        if router is not None:
+            self._shards = [AsyncioClientPool(shard, max_concurrency,
+                                              balancer=balancer,
+                                              max_qps_per_endpoint=max_qps_per_endpoint,
+                                              qps_burst=qps_burst,
+                                              breaker_threshold=breaker_threshold,
+                                              probe_interval=probe_interval,
+                                              min_concurrency=min_concurrency,
+                                              idle_timeout=idle_timeout, **kwargs)
+                            for shard in router.shards]
+        self._endpoint_set = EndpointSet(
+            endpoints if router is None else (), max_concurrency, balancer,
+            breaker_threshold, probe_interval, kwargs.get('retry_interval', 5),
+            kwargs.get('retry_max_interval', 60), min_concurrency, idle_timeout)
+        self._probe_interval = probe_interval
+        self._prober = None
+        self._bucket = create_bucket(max_qps, qps_burst)
+        for state in self._endpoint_set.states:
+            state.bucket = create_bucket(max_qps_per_endpoint, qps_burst)
+        self._cache = cache
+        self._hedger = hedger
+        self._coalesce = coalesce
+        self._flights = {}
+        self.coalesced = 0
+        self._max_clients = len(self._endpoints) * max_concurrency
+        # pooled clients reconnect without sleeping, the pool backs the
+        # endpoint off and sends requests to the others meanwhile, or waits
+        # for the first one due when every endpoint is backing off
+        self._kwargs = dict(kwargs, retry_interval=0)
+        self._waiters = deque()
+        self._close_lock = asyncio.Lock()
+        self._closed = False
+        self._closing = False
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def stats(self):
+        stats = {
+            'endpoints': self._metrics.stats(),
+            'coalesced': self.coalesced,
+            'queue_wait': self._metrics.queue_wait(),
+            'connections': self.connections(),
+        }
+        if self._cache is not None:
+            stats['cache'] = {
+                'hits': self._cache.hits,
+                'negative_hits': self._cache.negative_hits,
+                'misses': self._cache.misses,
+                'size': len(self._cache),
+                'memory': self._cache.memory,
+            }
+        if self._hedger is not None:
+            stats['hedge'] = self._hedger.stats()
+        return stats
+
+    def _create_client(self, address, port):
+        client = AsyncioClient(address, port, **self._kwargs)
+        self._logger.debug('Create a new client {}'.format(client.endpoint))
+        return client
+
+    def connections(self):
+        return self._endpoint_set.clients_count + \
+            sum([shard.connections() for shard in self._shards])
+
+    def _exhausted(self):
+        return self._endpoint_set.exhausted()
+
+    def _fill(self):
+        clients = [(self, state, client) for state, client
+                   in self._endpoint_set.fill(self._create_client)]
+        for shard in self._shards:
+            clients.extend(shard._fill())
+        return clients
+
+    async def warm_up(self):
+        # connects all the clients concurrently before the first request
+        start = time.time()
+        failed = {}
+        results = await asyncio.gather(
+            *[pool._warm_up_client(state, client, failed)
+              for pool, state, client in self._fill()])
+        return warm_up_report(start, sum(results), failed)
+
+    async def _warm_up_client(self, state, client, failed):
+        try:
+            await client.connect()
+        except Exception as e:
+            failed[state.endpoint] = e
+            self._discard_client(state, client)
+            return False
+        self._endpoint_set.checkin(state, client)
+        self._notify()
+        return True
+
+    def __ensure_not_closing(self):
+        if self._closing:
+            raise Unavailable('Closing')
+
+    def __ensure_not_closed(self):
+        if self._closed:
+            raise Unavailable('Closed')
+
+    async def _wait(self, timeout):
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def _notify(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def execute(self, qdb_proto):
+        if self._cache is not None and self._cache.get(qdb_proto):
+            return qdb_proto
+        if not self._coalesce:
+            return await self._execute_one(qdb_proto)
+
+        key = proto_key(qdb_proto)
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            await flight.waiter.wait()
+            if flight.error is not None:
+                raise flight.error
+            return fill_proto(qdb_proto, flight.value)
+
+        flight = self._flights[key] = Flight(asyncio.Event())
+        try:
+            r = await self._execute_one(qdb_proto)
+            flight.value = r.value
+            return r
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._flights.pop(key, None)
+            flight.waiter.set()
+
+    def _route(self, qdb_proto):
+        if self._router is None:
+            return self
+        return self._shards[self._router.route(qdb_proto.key)]
+
+    def _group_by_route(self, qdb_protos):
+        if self._router is None:
+            return [(self, qdb_protos)]
+        groups = {}
+        for qdb_proto in qdb_protos:
+            groups.setdefault(self._router.route(qdb_proto.key), []).append(qdb_proto)
+        return [(self._shards[idx], protos) for idx, protos in groups.items()]
+
+    async def _throttle(self, bucket, count=1):
+        delay = bucket.reserve(count)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _execute_one(self, qdb_proto):
+        if self._bucket is not None:
+            await self._throttle(self._bucket)
+        pool = self._route(qdb_proto)
+        if self._hedger is None:
+            r = await pool._execute(lambda client: client.execute(qdb_proto))
+        else:
+            r = await self._hedged_execute(pool, qdb_proto)
+        if self._cache is not None:
+            self._cache.set(r)
+        return r
+
+    async def _hedged_execute(self, pool, qdb_proto):
+        hedger = self._hedger
+        protos = [copy_proto(qdb_proto), copy_proto(qdb_proto)]
+        used = []
+        start = time.time()
+        attempts = [asyncio.ensure_future(pool._execute(
+            lambda client: client.execute(protos[0]), used=used))]
+        delay = hedger.delay()
+        if delay is not None:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and used and hedger.acquire():
+                attempts.append(asyncio.ensure_future(
+                    self._send_hedge(pool, protos[1], used[-1])))
+        # the loser is left to finish, its exception is not interesting
+        for attempt in attempts:
+            attempt.add_done_callback(lambda f: f.cancelled() or f.exception())
+        error = None
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for winner, attempt in enumerate(attempts):
+                if attempt not in done:
+                    continue
+                if attempt.exception() is not None:
+                    if error is None:
+                        error = attempt.exception()
+                    continue
+                hedger.record(time.time() - start, winner == 1)
+                return fill_proto(qdb_proto, protos[winner].value)
+        raise error
+
+    async def _send_hedge(self, pool, qdb_proto, exclude):
+        used = []
+        try:
+            if self._bucket is not None:
+                await self._throttle(self._bucket)
+            return await pool._execute(lambda client: client.execute(qdb_proto),
+                                       exclude=exclude, used=used)
+        except Exception:
+            # nothing was sent, the hedge is not counted
+            if not used:
+                self._hedger.refund()
+            raise
+
+    async def execute_many(self, qdb_protos, batch_size=128, callback=None):
+        assert batch_size >= 1, 'batch_size must be positive'
+        qdb_protos = list(qdb_protos)
+        misses = qdb_protos
+        if self._cache is not None:
+            misses = []
+            for p in qdb_protos:
+                if not self._cache.get(p):
+                    misses.append(p)
+                elif callback is not None:
+                    callback(p)
+        duplicates = ()
+        if self._coalesce:
+            misses, duplicates = dedup_protos(misses)
+            self.coalesced += len(duplicates)
+        batches = deque([(pool, protos[i:i + batch_size])
+                         for pool, protos in self._group_by_route(misses)
+                         for i in range(0, len(protos), batch_size)])
+
+        async def _loop_execute():
+            while batches:
+                pool, batch = batches.popleft()
+                if self._bucket is not None:
+                    await self._throttle(self._bucket, len(batch))
+                # a retry on another client resends only the unanswered
+                pending = deque(batch)
+                await pool._execute(lambda client: client.execute_pending(pending),
+                                    len(batch))
+                for r in batch:
+                    if self._cache is not None:
+                        self._cache.set(r)
+                    if callback is not None:
+                        callback(r)
+
+        await asyncio.gather(*[_loop_execute()
+                               for _ in range(0, min(len(batches), self._max_clients))])
+        for first, r in duplicates:
+            fill_proto(r, first.value)
+            if callback is not None:
+                callback(r)
+        return qdb_protos
+
+    async def _execute(self, func, count=1, exclude=None, used=None):
+        wait_start = None
+        while True:
+            if self._closed or self._closing:
+                self.__ensure_not_closed()
+                self.__ensure_not_closing()
+
+            state, client = self._endpoint_set.checkout(self._create_client,
+                                                        exclude, count)
+            if client is None:
+                if exclude is not None:
+                    raise ResourceLimit('No spare client')
+                if wait_start is None:
+                    wait_start = time.time()
+                await self._wait(self._endpoint_set.wait_time(count=count))
+                continue
+            if wait_start is not None:
+                self._metrics.record_queue_wait(time.time() - wait_start)
+                wait_start = None
+            if used is not None:
+                used.append(state)
+
+            start = time.time()
+            try:
+                r = await func(client)
+            except (RetryLimitExceeded, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError, OSError) as e:
+                self._logger.warning(
+                    'Not available, {} {}'.format(client.endpoint, e))
+                self._discard_client(state, client)
+                continue
+
+            except Exception as e:
+                self._logger.error(
+                    'Unexpected error, {} {}'.format(client.endpoint, e))
+                self._discard_client(state, client)
+                continue
+
+            self._endpoint_set.checkin(state, client, time.time() - start, count)
+            self._notify()
+            return r
+
+    def _discard_client(self, state, client):
+        try:
+            if self._endpoint_set.discard(state, client):
+                self._on_eject(state)
+        finally:
+            self._notify()
+
+    def _on_eject(self, state):
+        self._logger.warning('Eject {} after {} failures'.format(
+            state.endpoint, state.breaker.failures))
+        if self._prober is None and not (self._closing or self._closed):
+            self._prober = asyncio.ensure_future(self._loop_probe())
+
+    async def _loop_probe(self):
+        # runs while any endpoint is ejected
+        while not (self._closing or self._closed):
+            await asyncio.sleep(self._probe_interval / 2.0)
+            if not self._endpoint_set.ejected():
+                break
+            states = self._endpoint_set.probe_due()
+            if not states:
+                continue
+            results = await asyncio.gather(*[self._probe(state) for state in states])
+            for state, ok in zip(states, results):
+                self._endpoint_set.on_probe(state, ok)
+                if ok:
+                    self._logger.info('Readmit {}'.format(state.endpoint))
+            while self._waiters:
+                self._notify()
+        self._prober = None
+
+    async def _probe(self, state):
+        kwargs = dict(self._kwargs, retry_max=0, metrics=None)
+        client = AsyncioClient(state.address, state.port, **kwargs)
+        try:
+            await client.execute(probe_protocal())
+            return True
+        except Exception as e:
+            self._logger.debug('Probe error {} {}'.format(state.endpoint, e))
+            return False
+        finally:
+            client.close()
+
+    async def close(self):
+        async with self._close_lock:
+            if self._closed:
+                return
+
+            self._closing = True
+            while self._endpoint_set.clients_count > 0:
+                for state, client in list(self._endpoint_set.pop_idle()):
+                    self._endpoint_set.release(state, client)
+                if self._endpoint_set.clients_count > 0:
+                    await self._wait(0.1)
+            for shard in self._shards:
+                await shard.close()
+            if self._prober is not None:
+                # waits for the cancelled task so it is not left pending
+                prober, self._prober = self._prober, None
+                prober.cancel()
+                try:
+                    await prober
+                except asyncio.CancelledError:
+                    pass
+            self._closed = True
+            self._closing = False
@@ -0,0 +1,18 @@
+import random
+
+
+class Backoff(object):
+    # exponential backoff with equal jitter, the delay of attempt n is
+    # uniform in [d/2, d] where d = min(max_interval, interval * 2 ** n),
+    # so clients failing together do not retry together
+
+    def __init__(self, interval, max_interval=60, random_func=random.random):
+        assert interval >= 0, 'interval must be non-negative'
+        assert max_interval >= interval, 'max_interval must not be less than interval'
+        self._interval = interval
+        self._max_interval = max_interval
+        self._random = random_func
+
+    def delay(self, attempt):
+        d = min(self._max_interval, self._interval * (1 << min(max(attempt, 0), 32)))
+        return d / 2.0 + self._random() * d / 2.0
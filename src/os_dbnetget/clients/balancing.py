@@ -0,0 +1,238 @@
+import random
+import time
+from collections import deque
+
+from os_dbnetget.clients.breaker import CircuitBreaker
+from os_dbnetget.exceptions import ResourceLimit
+from os_dbnetget.utils import split_endpoint
+
+try:
+    _now = time.monotonic
+except AttributeError:
+    _now = time.time
+
+
+class EndpointState(object):
+    def __init__(self, endpoint, max_concurrency, alpha=0.3, breaker=None):
+        self.endpoint = endpoint
+        self.address, self.port = split_endpoint(endpoint)
+        self.candidates = max_concurrency
+        self.clients_count = 0
+        self.idle = deque()
+        # fewest idle clients since the last shrink
+        self.idle_low = 0
+        self.outstanding = 0
+        self.latency = 0.0
+        self.bucket = None
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._alpha = alpha
+
+    def delay(self, count=1, now=None):
+        # how long until the endpoint can take count more requests
+        if now is None:
+            now = _now()
+        delay = self.breaker.retry_at - now
+        if self.bucket is not None:
+            delay = max(delay, self.bucket.delay(count))
+        return max(delay, 0)
+
+    def update_latency(self, latency):
+        if self.latency <= 0:
+            self.latency = latency
+        else:
+            self.latency += self._alpha * (latency - self.latency)
+
+
+class Balancer(object):
+    def choose(self, states):
+        raise NotImplementedError
+
+
+class RandomBalancer(Balancer):
+    def choose(self, states):
+        return random.choice(states)
+
+
+class LeastOutstandingBalancer(Balancer):
+    def choose(self, states):
+        return min(states, key=lambda s: (s.outstanding, s.latency))
+
+
+class PowerOfTwoBalancer(Balancer):
+    def choose(self, states):
+        if len(states) < 2:
+            return states[0]
+        a, b = random.sample(states, 2)
+        if (a.outstanding + 1) * a.latency <= (b.outstanding + 1) * b.latency:
+            return a
+        return b
+
+
+BALANCERS = {
+    'random': RandomBalancer,
+    'least-outstanding': LeastOutstandingBalancer,
+    'p2c': PowerOfTwoBalancer,
+}
+
+
+class EndpointSet(object):
+    def __init__(self, endpoints, max_concurrency=1, balancer=None,
+                 breaker_threshold=3, probe_interval=1.0, retry_interval=0,
+                 retry_max_interval=60, min_concurrency=1, idle_timeout=60):
+        assert 0 <= min_concurrency <= max_concurrency, \
+            'concurrency must be 0 <= min <= max'
+        self._states = [EndpointState(endpoint, max_concurrency,
+                                      breaker=CircuitBreaker(breaker_threshold,
+                                                             probe_interval,
+                                                             retry_interval,
+                                                             retry_max_interval))
+                        for endpoint in endpoints]
+        self._balancer = balancer if balancer is not None else RandomBalancer()
+        self._min_concurrency = min_concurrency
+        self._idle_timeout = idle_timeout
+        self._next_shrink = _now() + idle_timeout if idle_timeout else None
+
+    @property
+    def states(self):
+        return self._states
+
+    @property
+    def clients_count(self):
+        return sum([s.clients_count for s in self._states])
+
+    def exhausted(self):
+        for s in self._states:
+            if s.breaker.allow() and (s.clients_count > 0 or s.candidates > 0):
+                return False
+        return True
+
+    def _live_states(self):
+        # endpoints backing off are skipped, those out of rate limit tokens
+        # when they are chosen
+        return [s for s in self._states
+                if s.breaker.allow() and not s.breaker.backing_off()]
+
+    def wait_time(self, limit=1.0, count=1):
+        # a checkout finding no client waits for a checkin, or until the
+        # first endpoint is due when every live endpoint is backing off or
+        # rate limited
+        now = _now()
+        delays = [s.delay(count, now) for s in self._states if s.breaker.allow()]
+        if not delays or min(delays) <= 0:
+            return limit
+        return min(min(delays), limit)
+
+    def checkout(self, create_client, exclude=None, count=1):
+        # the balancer chooses among the endpoints with an idle client or
+        # room for a new one, a client is created when the chosen one has
+        # none idle. the rate limit tokens of the chosen endpoint are taken
+        states = self._live_states()
+        if exclude is not None:
+            states = [s for s in states if s is not exclude]
+        states = [s for s in states if s.idle or s.candidates > 0]
+        while True:
+            if not states:
+                if self.exhausted():
+                    raise ResourceLimit('No more available client')
+                return None, None
+            state = self._balancer.choose(states)
+            if state.bucket is None or state.bucket.try_acquire(count):
+                break
+            states = [s for s in states if s is not state]
+        if state.idle:
+            client = state.idle.pop()
+            if len(state.idle) < state.idle_low:
+                state.idle_low = len(state.idle)
+        else:
+            client = self._create(state, create_client)
+        state.outstanding += 1
+        return state, client
+
+    def _create(self, state, create_client):
+        client = create_client(state.address, state.port)
+        state.idle_low = 0
+        state.candidates -= 1
+        state.clients_count += 1
+        return client
+
+    def fill(self, create_client):
+        # checks out all the clients the live endpoints can still create
+        clients = []
+        for state in self._states:
+            if not state.breaker.allow():
+                continue
+            while state.candidates > 0:
+                clients.append((state, self._create(state, create_client)))
+                state.outstanding += 1
+        return clients
+
+    def checkin(self, state, client, latency=None, count=1):
+        if latency is not None:
+            state.update_latency(latency / count)
+        if state.breaker.allow():
+            state.breaker.on_success()
+        self.putback(state, client)
+
+    def putback(self, state, client):
+        # returns a client without counting a success
+        state.outstanding -= 1
+        if state.breaker.allow():
+            state.idle.append(client)
+        else:
+            self.release(state, client)
+        self.shrink()
+
+    def shrink(self, now=None):
+        # clients idle through a whole idle_timeout were not needed, close
+        # them down to min_concurrency, the least recently used first
+        if self._next_shrink is None:
+            return 0
+        if now is None:
+            now = _now()
+        if now < self._next_shrink:
+            return 0
+        self._next_shrink = now + self._idle_timeout
+        released = 0
+        for state in self._states:
+            count = min(state.idle_low, len(state.idle),
+                        state.clients_count - self._min_concurrency)
+            for _ in range(count):
+                self.release(state, state.idle.popleft())
+                released += 1
+            state.idle_low = len(state.idle)
+        return released
+
+    def drop(self, state, client):
+        # closes a client without counting a failure
+        state.outstanding -= 1
+        self.release(state, client)
+
+    def discard(self, state, client):
+        # returns True when the failure ejects the endpoint
+        self.drop(state, client)
+        if not state.breaker.on_failure():
+            return False
+        while state.idle:
+            self.release(state, state.idle.pop())
+        return True
+
+    def release(self, state, client):
+        try:
+            client.close()
+        finally:
+            state.clients_count -= 1
+            state.candidates += 1
+
+    def pop_idle(self):
+        for state in self._states:
+            while state.idle:
+                yield state, state.idle.pop()
+
+    def ejected(self):
+        return [s for s in self._states if not s.breaker.allow()]
+
+    def probe_due(self):
+        return [s for s in self._states if s.breaker.probe_due()]
+
+    def on_probe(self, state, ok):
+        state.breaker.on_probe(ok)
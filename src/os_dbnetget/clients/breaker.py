@@ -0,0 +1,79 @@
+import time
+
+from os_qdb_protocal import create_protocal
+
+from os_dbnetget.clients.backoff import Backoff
+
+try:
+    _now = time.monotonic
+except AttributeError:
+    _now = time.time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+PROBE_KEY = b'\x00' * 16
+
+
+def probe_protocal():
+    # any complete response of the test command means the server is up
+    return create_protocal('test', PROBE_KEY)
+
+
+class CircuitBreaker(object):
+    # a failure backs the endpoint off for retry_interval with jittered
+    # exponential growth, consecutive failures open the breaker and an open
+    # endpoint gets no requests until a background probe succeeds in the
+    # half-open state, probes back off from probe_interval the same way
+
+    def __init__(self, threshold=3, probe_interval=1.0, retry_interval=0,
+                 max_interval=60):
+        assert threshold >= 1, 'threshold must be positive'
+        assert probe_interval > 0, 'probe_interval must be positive'
+        self._threshold = threshold
+        self._backoff = Backoff(retry_interval, max(retry_interval, max_interval))
+        self._probe_backoff = Backoff(probe_interval, max(probe_interval, max_interval))
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.retry_at = 0
+
+    def allow(self):
+        return self.state == CLOSED
+
+    def backing_off(self, now=None):
+        return self.retry_at > (_now() if now is None else now)
+
+    def on_success(self):
+        self.failures = 0
+        self.retry_at = 0
+
+    def on_failure(self):
+        if self.state != CLOSED:
+            return False
+        self.failures += 1
+        if self.failures >= self._threshold:
+            self._open()
+            self.trips += 1
+            return True
+        self.retry_at = _now() + self._backoff.delay(self.failures - 1)
+        return False
+
+    def _open(self):
+        self.state = OPEN
+        self.retry_at = _now() + self._probe_backoff.delay(self.failures - self._threshold)
+
+    def probe_due(self):
+        if self.state == OPEN and _now() >= self.retry_at:
+            self.state = HALF_OPEN
+            return True
+        return False
+
+    def on_probe(self, ok):
+        if ok:
+            self.state = CLOSED
+            self.on_success()
+        else:
+            self.failures += 1
+            self._open()
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+from os_dbnetget.clients.client import fill_proto, proto_key
+
+# rough per-entry bookkeeping cost (tuple, dict slot, key object)
+ENTRY_OVERHEAD = 128
+
+
+class ResponseCache(object):
+    def __init__(self, maxsize=100000, ttl=300, negative_ttl=60, max_memory=None):
+        assert maxsize > 0, 'maxsize must be positive'
+        assert ttl > 0, 'ttl must be positive'
+        assert negative_ttl >= 0, 'negative_ttl must be non-negative'
+        assert max_memory is None or max_memory > 0, 'max_memory must be positive'
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._max_memory = max_memory
+        self._data = OrderedDict()
+        self._memory = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @property
+    def memory(self):
+        return self._memory
+
+    def _entry_size(self, key, value):
+        size = ENTRY_OVERHEAD + len(key[1])
+        if isinstance(value, bytes):
+            size += len(value)
+        return size
+
+    def get(self, qdb_proto):
+        key = proto_key(qdb_proto)
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return False
+            expire, value, size = entry
+            if expire < time.time():
+                self._memory -= size
+                self.misses += 1
+                return False
+            self._data[key] = entry
+            if value is False:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+        fill_proto(qdb_proto, value)
+        return True
+
+    def set(self, qdb_proto):
+        value = qdb_proto.value
+        if value is False:
+            # only test confirms a key does not exist, get leaves None
+            # for both a miss and a server error, test for unknown
+            ttl = self._negative_ttl
+        elif value is True or isinstance(value, bytes):
+            ttl = self._ttl
+        else:
+            # None and error codes are never cached
+            return
+        if ttl <= 0:
+            return
+        key = proto_key(qdb_proto)
+        size = self._entry_size(key, value)
+        if self._max_memory is not None and size > self._max_memory:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._memory -= old[2]
+            self._data[key] = (time.time() + ttl, value, size)
+            self._memory += size
+            while len(self._data) > self._maxsize or \
+                    (self._max_memory is not None and self._memory > self._max_memory):
+                _, (_, _, s) = self._data.popitem(last=False)
+                self._memory -= s
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._memory = 0
+
+    def __len__(self):
+        return len(self._data)
@@ -1,4 +1,7 @@
 import errno
+import time
+
+from os_dbnetget.clients.metrics import Metrics
 
 RETRY_NETWORK_ERRNO = set([
     errno.ECONNREFUSED,
@@ -7,18 +10,89 @@ RETRY_NETWORK_ERRNO = set([
     errno.ETIMEDOUT,
 ])
 
+# initial size of the per-connection receive buffer, it grows to the largest
+# read, values are copied out as bytes as the protocol keeps them
+RECV_BUFFER_SIZE = 64 * 1024
+
+
+def proto_key(qdb_proto):
+    return (qdb_proto.cmd, qdb_proto.key)
+
+
+def fill_proto(qdb_proto, value):
+    # answer a protocol without running its downstream, for cached,
+    # coalesced and hedged responses. os_qdb_protocal keeps the parsed
+    # response in the _value slot and exposes it read only as value,
+    # tests/test_main/test_client.py pins that behaviour
+    qdb_proto._value = value
+    return qdb_proto
+
+
+def copy_proto(qdb_proto):
+    return qdb_proto.__class__(qdb_proto.key)
+
+
+def dedup_protos(qdb_protos):
+    firsts = {}
+    unique = []
+    duplicates = []
+    for qdb_proto in qdb_protos:
+        first = firsts.setdefault(proto_key(qdb_proto), qdb_proto)
+        if first is qdb_proto:
+            unique.append(qdb_proto)
+        else:
+            duplicates.append((first, qdb_proto))
+    return unique, duplicates
+
+
+def warm_up_report(start, connected, failed):
+    return {
+        'elapsed': time.time() - start,
+        'connected': connected,
+        'failed': dict([(endpoint, str(e)) for endpoint, e in failed.items()]),
+    }
+
+
+class Flight(object):
+    __slots__ = ('waiter', 'value', 'error')
+
+    def __init__(self, waiter):
+        self.waiter = waiter
+        self.value = None
+        self.error = None
+
 
 class Client(object):
     def __init__(self, address, port, **kwargs):
         self._address = address
         self._port = port
+        metrics = kwargs.get('metrics', None)
+        if metrics is None:
+            metrics = Metrics()
+        if isinstance(address, bytes):
+            address = address.decode('utf-8')
+        self._metrics = metrics.endpoint('{}:{}'.format(address, port))
 
     @property
     def endpoint(self):
         return '{}:{}'.format(self._address, self._port)
 
+    def connect(self):
+        raise NotImplementedError
+
     def execute(self, qdb_proto):
         raise NotImplementedError
 
+    def execute_pipeline(self, qdb_protos, depth=None):
+        raise NotImplementedError
+
+    def execute_pending(self, pending, depth=None):
+        # pipelines a deque of requests, popping each one answered, what is
+        # left after an error was not answered and can be sent elsewhere
+        raise NotImplementedError
+
+    def stats(self):
+        return self._metrics.stats()
+
     def close(self):
         pass
@@ -0,0 +1,196 @@
+import heapq
+import threading
+import time
+from itertools import count
+
+from os_dbnetget.clients.metrics import Histogram
+
+
+class Hedger(object):
+    # a request not finished after `delay` seconds, or after the
+    # `percentile` latency of the last `window` requests when delay is
+    # None, is duplicated to another endpoint. Every request earns `budget`
+    # percent of a hedge, at most `burst` hedges are saved up
+
+    def __init__(self, delay=None, percentile=95, budget=5.0, burst=10,
+                 window=1000):
+        assert delay is None or delay > 0, 'delay must be positive'
+        assert 0 < percentile < 100, 'percentile must be (0, 100)'
+        assert 0 < budget <= 100, 'budget must be (0, 100]'
+        assert burst >= 1, 'burst must be positive'
+        assert window > 0, 'window must be positive'
+        self._delay = delay
+        self._percentile = percentile
+        self._budget = budget / 100.0
+        self._burst = float(burst)
+        self._window = window
+        self._histogram = Histogram()
+        self._observed = None
+        self._tokens = self._burst
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.sent = 0
+        self.won = 0
+
+    def delay(self):
+        if self._delay is not None:
+            return self._delay
+        return self._observed
+
+    def record(self, latency, won=False):
+        with self._lock:
+            self.requests += 1
+            if won:
+                self.won += 1
+            self._tokens = min(self._burst, self._tokens + self._budget)
+            if self._delay is not None:
+                return
+            self._histogram.record(latency)
+            if self._histogram.count >= self._window:
+                self._observed = self._histogram.percentile(self._percentile)
+                self._histogram = Histogram()
+
+    def acquire(self):
+        with self._lock:
+            if self._tokens < 1 - 1e-9:
+                return False
+            self._tokens -= 1
+            self.sent += 1
+            return True
+
+    def refund(self):
+        # an acquired hedge that could not be sent
+        with self._lock:
+            self._tokens = min(self._burst, self._tokens + 1)
+            self.sent -= 1
+
+    def stats(self):
+        return {
+            'delay': self.delay(),
+            'requests': self.requests,
+            'sent': self.sent,
+            'won': self.won,
+        }
+
+
+class Race(object):
+    # runs attempts inline or in threads, the first one succeeding wins and
+    # on_win is called with its index
+
+    def __init__(self, on_win=None):
+        self._cond = threading.Condition()
+        self._on_win = on_win
+        self._running = 0
+        self.winner = None
+        self.value = None
+        self.error = None
+
+    def start(self, index, func):
+        with self._cond:
+            self._running += 1
+        t = threading.Thread(target=self._run, args=(index, func))
+        t.daemon = True
+        t.start()
+
+    def run(self, index, func):
+        with self._cond:
+            self._running += 1
+        self._run(index, func)
+
+    def _run(self, index, func):
+        value = error = None
+        try:
+            value = func()
+        except Exception as e:
+            error = e
+        won = False
+        with self._cond:
+            self._running -= 1
+            if error is None:
+                if self.winner is None:
+                    self.winner = index
+                    self.value = value
+                    won = True
+            elif self.error is None:
+                self.error = error
+            self._cond.notify_all()
+        if won and self._on_win is not None:
+            self._on_win(index)
+
+    def _done(self):
+        return self.winner is not None or self._running <= 0
+
+    def done(self):
+        with self._cond:
+            return self._done()
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._done():
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._done()
+
+
+class Scheduler(object):
+    # calls functions after a delay in one background thread, the functions
+    # must not block. Cancelled calls are dropped when they are due
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._counter = count()
+        self._thread = None
+        self._stopped = False
+
+    def call_later(self, delay, func):
+        entry = [time.time() + delay, next(self._counter), func]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            # the thread only sleeps past a new entry due first
+            if self._heap[0] is entry:
+                self._cond.notify()
+        return entry
+
+    def cancel(self, entry):
+        entry[2] = None
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                remaining = self._heap[0][0] - time.time()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                func = heapq.heappop(self._heap)[2]
+                if func is None:
+                    continue
+                self._cond.release()
+                try:
+                    func()
+                except Exception:
+                    pass
+                finally:
+                    self._cond.acquire()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._heap = []
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
@@ -0,0 +1,155 @@
+import threading
+import time
+
+
+class AIMDLimiter(object):
+    # additive increase by one per round of `limit` good samples,
+    # multiplicative decrease on a timeout or when latency exceeds
+    # `tolerance` times the baseline, at most once per round trip.
+    # samples are keyed by endpoint, each has its own baseline so a slow
+    # endpoint is not taken for a congested fast one
+
+    def __init__(self, initial, min_limit=1, max_limit=200, backoff=0.9,
+                 tolerance=2.0, window=1000):
+        assert 1 <= min_limit <= max_limit, 'limits must be 1 <= min <= max'
+        assert 0 < backoff < 1, 'backoff must be (0, 1)'
+        assert tolerance > 1, 'tolerance must be greater than 1'
+        assert window > 0, 'window must be positive'
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._limit = min(max(initial, min_limit), max_limit)
+        self._backoff = backoff
+        self._tolerance = tolerance
+        self._window = window
+        # key: [baseline, window min, samples]
+        self._baselines = {}
+        self._successes = 0
+        self._last_decrease = 0
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def baseline(self, key=None):
+        b = self._baselines.get(key)
+        return b[0] if b is not None else None
+
+    def _update_baseline(self, latency, key):
+        b = self._baselines.get(key)
+        if b is None:
+            b = self._baselines[key] = [latency, latency, 0]
+        if latency < b[1]:
+            b[1] = latency
+        if latency < b[0]:
+            b[0] = latency
+        b[2] += 1
+        # follow the server when its unloaded latency shifts up
+        if b[2] >= self._window:
+            b[0] = b[1]
+            b[1] = float('inf')
+            b[2] = 0
+        return b[0]
+
+    def _decrease(self):
+        # one round trip of the slowest endpoint lets every request in
+        # flight see the last decrease
+        now = time.time()
+        round_trip = max([b[0] for b in self._baselines.values()] or [0])
+        if now - self._last_decrease < round_trip * self._tolerance:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        limit = max(self._min_limit, int(self._limit * self._backoff))
+        if limit < self._limit:
+            self._limit = limit
+            self.decreases += 1
+
+    def on_sample(self, latency, dropped=False, key=None):
+        if dropped:
+            self._decrease()
+            return
+        baseline = self._update_baseline(latency, key)
+        if latency > baseline * self._tolerance:
+            self._decrease()
+            return
+        self._successes += 1
+        if self._successes >= self._limit:
+            self._successes = 0
+            if self._limit < self._max_limit:
+                self._limit += 1
+                self.increases += 1
+
+
+try:
+    _now = time.monotonic
+except AttributeError:
+    _now = time.time
+
+
+class TokenBucket(object):
+    # reserve() always takes the tokens and returns how long the caller
+    # must wait for them, so waiting works for threads and coroutines
+
+    def __init__(self, rate, burst=None):
+        assert rate > 0, 'rate must be positive'
+        if burst is None:
+            burst = rate
+        self._rate = float(rate)
+        self._burst = max(float(burst), 1.0)
+        self._tokens = self._burst
+        self._last = _now()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    def delay(self, count=1):
+        # how long until count tokens, at most a full bucket, are there,
+        # nothing is taken
+        with self._lock:
+            tokens = self._tokens + (_now() - self._last) * self._rate
+        need = min(count, self._burst) - min(tokens, self._burst)
+        if need <= 0:
+            return 0
+        return need / self._rate
+
+    def try_acquire(self, count=1):
+        # takes count tokens when delay(count) is 0, in one step so two
+        # callers can not both see the tokens there
+        with self._lock:
+            now = _now()
+            tokens = self._tokens + (now - self._last) * self._rate
+            if tokens >= self._burst:
+                tokens = self._burst
+            elif tokens < count:
+                return False
+            self._last = now
+            self._tokens = tokens - count
+        return True
+
+    def reserve(self, count=1):
+        with self._lock:
+            now = _now()
+            tokens = self._tokens + (now - self._last) * self._rate
+            if tokens > self._burst:
+                tokens = self._burst
+            self._last = now
+            tokens -= count
+            self._tokens = tokens
+        if tokens >= 0:
+            return 0
+        return -tokens / self._rate
+
+
+def create_bucket(rate, burst=1.0):
+    # burst is in seconds of rate, None for an unlimited rate
+    if not rate:
+        return None
+    return TokenBucket(rate, rate * burst)
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import threading
+
+# log-linear buckets like HdrHistogram, values are recorded in microseconds
+# and kept with SUB_BUCKET_BITS - 1 bits of precision (< 1.6% error)
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+MAX_VALUE = (1 << 36) - 1
+
+
+def _bucket_index(value):
+    if value < SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + \
+        (value >> shift) - SUB_BUCKET_HALF
+
+
+def _bucket_value(idx):
+    if idx < SUB_BUCKET_COUNT:
+        return idx
+    shift, m = divmod(idx - SUB_BUCKET_COUNT, SUB_BUCKET_HALF)
+    shift += 1
+    # middle of the bucket
+    return ((m + SUB_BUCKET_HALF) << shift) + (1 << (shift - 1))
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self._counts = [0] * (_bucket_index(MAX_VALUE) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1000000), 0), MAX_VALUE)
+        self._counts[_bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for idx, c in enumerate(other._counts):
+            if c:
+                self._counts[idx] += c
+        self.count += other.count
+        self.total += other.total
+        for v in (other.min, other.max):
+            if v is None:
+                continue
+            if self.min is None or v < self.min:
+                self.min = v
+            if self.max is None or v > self.max:
+                self.max = v
+
+    def percentile(self, p):
+        if self.count <= 0:
+            return None
+        target = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for idx, c in enumerate(self._counts):
+            seen += c
+            if seen >= target:
+                return min(max(_bucket_value(idx), self.min), self.max) / 1000000.0
+        return self.max / 1000000.0
+
+    def snapshot(self):
+        if self.count <= 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / 1000000.0 / self.count,
+            'min': self.min / 1000000.0,
+            'max': self.max / 1000000.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+
+class EndpointMetrics(object):
+    HISTOGRAMS = ('connect', 'send', 'ttfb', 'total')
+    COUNTERS = ('requests', 'connects', 'reconnects', 'retries',
+                'timeouts', 'errors', 'bytes_in', 'bytes_out')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._lock = threading.Lock()
+        self._histograms = dict([(name, Histogram()) for name in self.HISTOGRAMS])
+        self._counters = dict([(name, 0) for name in self.COUNTERS])
+
+    def counter(self, name):
+        return self._counters[name]
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def record_connect(self, seconds):
+        with self._lock:
+            self._histograms['connect'].record(seconds)
+            self._counters['connects'] += 1
+
+    def record_request(self, send, ttfb, total, bytes_out, bytes_in):
+        with self._lock:
+            histograms = self._histograms
+            histograms['send'].record(send)
+            histograms['ttfb'].record(ttfb)
+            histograms['total'].record(total)
+            counters = self._counters
+            counters['requests'] += 1
+            counters['bytes_out'] += bytes_out
+            counters['bytes_in'] += bytes_in
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            for name, histogram in self._histograms.items():
+                stats[name] = histogram.snapshot()
+        return stats
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._queue_wait = Histogram()
+
+    def record_queue_wait(self, seconds):
+        with self._lock:
+            self._queue_wait.record(seconds)
+
+    def queue_wait(self):
+        with self._lock:
+            return self._queue_wait.snapshot()
+
+    def endpoint(self, endpoint):
+        metrics = self._endpoints.get(endpoint)
+        if metrics is None:
+            with self._lock:
+                metrics = self._endpoints.setdefault(
+                    endpoint, EndpointMetrics(endpoint))
+        return metrics
+
+    def counter(self, name):
+        return sum([m.counter(name) for m in list(self._endpoints.values())])
+
+    def stats(self):
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+        return dict([(m.endpoint, m.stats()) for m in endpoints])
+
+
+class PrometheusExporter(object):
+    PREFIX = 'os_dbnetget'
+    QUANTILES = (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'), ('0.999', 'p999'))
+
+    def __init__(self, path):
+        self._path = path
+
+    def _format(self, stats):
+        lines = []
+        for name in EndpointMetrics.COUNTERS:
+            metric = '{}_{}_total'.format(self.PREFIX, name)
+            lines.append('# TYPE {} counter'.format(metric))
+            for endpoint, s in sorted(stats.items()):
+                lines.append('{}{{endpoint="{}"}} {}'.format(
+                    metric, endpoint, s[name]))
+        for name in EndpointMetrics.HISTOGRAMS:
+            metric = '{}_{}_seconds'.format(self.PREFIX, name)
+            lines.append('# TYPE {} summary'.format(metric))
+            for endpoint, s in sorted(stats.items()):
+                h = s[name]
+                if h['count'] > 0:
+                    for quantile, key in self.QUANTILES:
+                        lines.append('{}{{endpoint="{}",quantile="{}"}} {}'.format(
+                            metric, endpoint, quantile, h[key]))
+                    lines.append('{}_sum{{endpoint="{}"}} {}'.format(
+                        metric, endpoint, h['mean'] * h['count']))
+                lines.append('{}_count{{endpoint="{}"}} {}'.format(
+                    metric, endpoint, h['count']))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, stats):
+        # write then rename, the node exporter never sees a partial file
+        tmp = '{}.{}.tmp'.format(self._path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self._format(stats))
+        os.rename(tmp, self._path)
+
+
+class MetricsReporter(object):
+
+    def __init__(self, stats_func, interval=None, exporter=None):
+        assert interval is None or interval > 0, 'interval must be positive'
+        self._stats_func = stats_func
+        self._interval = interval
+        self._exporter = exporter
+        self._stop = threading.Event()
+        self._thread = None
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def report(self):
+        try:
+            stats = self._stats_func()
+            if self._exporter is not None:
+                self._exporter.export(stats['endpoints'])
+            else:
+                self._logger.info(json.dumps(stats, sort_keys=True))
+        except Exception as e:
+            self._logger.error('Report metrics error {}'.format(e))
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.report()
+
+    def start(self):
+        if self._interval is None:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.report()
@@ -0,0 +1,65 @@
+import hashlib
+import struct
+from bisect import bisect
+
+
+def key_hash(key):
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return struct.unpack('>Q', hashlib.md5(key).digest()[:8])[0]
+
+
+def shard_label(shard):
+    # the same endpoints hash the same whether they are bytes or str
+    return ','.join([e.decode('utf-8') if isinstance(e, bytes) else e
+                     for e in shard])
+
+
+# a shard is a tuple of endpoints, route() returns the shard index of a key
+class Router(object):
+
+    def __init__(self, shards):
+        shards = tuple([tuple(shard) for shard in shards])
+        assert shards, 'shards must not be empty'
+        assert all(shards), 'shard must not be empty'
+        self._shards = shards
+
+    @property
+    def shards(self):
+        return self._shards
+
+    def route(self, key):
+        raise NotImplementedError
+
+
+class ShardMapRouter(Router):
+
+    def route(self, key):
+        return key_hash(key) % len(self._shards)
+
+
+class ConsistentHashRouter(Router):
+
+    def __init__(self, shards, vnodes=160):
+        super(ConsistentHashRouter, self).__init__(shards)
+        assert vnodes > 0, 'vnodes must be positive'
+        ring = []
+        for idx, shard in enumerate(self._shards):
+            label = shard_label(shard)
+            for i in range(0, vnodes):
+                ring.append((key_hash('{}#{}'.format(label, i)), idx))
+        ring.sort()
+        self._hashes = [h for h, _ in ring]
+        self._ring = [idx for _, idx in ring]
+
+    def route(self, key):
+        pos = bisect(self._hashes, key_hash(key))
+        if pos >= len(self._hashes):
+            pos = 0
+        return self._ring[pos]
+
+
+ROUTERS = {
+    'shard-map': ShardMapRouter,
+    'consistent-hash': ConsistentHashRouter,
+}
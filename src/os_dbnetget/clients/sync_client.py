@@ -1,19 +1,33 @@
 import errno
 import logging
-import random
 import socket
 import sys
 import threading
 import time
-from io import BytesIO
-
-from os_dbnetget.clients.client import RETRY_NETWORK_ERRNO, Client
+from collections import deque
+from functools import partial
+from itertools import islice
+
+from os_dbnetget.clients.backoff import Backoff
+from os_dbnetget.clients.balancing import EndpointSet
+from os_dbnetget.clients.breaker import probe_protocal
+from os_dbnetget.clients.hedging import Race, Scheduler
+from os_dbnetget.clients.limiter import create_bucket
+from os_dbnetget.clients.metrics import Metrics
+from os_dbnetget.clients.client import (RECV_BUFFER_SIZE, RETRY_NETWORK_ERRNO,
+                                       Client, Flight, copy_proto,
+                                       dedup_protos, fill_proto, proto_key,
+                                       warm_up_report)
 from os_dbnetget.exceptions import (ResourceLimit, RetryLimitExceeded,
                                     ServerClosed, Unavailable)
-from os_dbnetget.utils import Queue, split_endpoint
+from os_dbnetget.utils import Queue
 
 socket.setdefaulttimeout(10)
 
+# a batch is split over more connections only in parts of at least this
+# many requests, shorter pipelines gain less than the hand-off costs
+MIN_PIPELINE = 16
+
 
 class SyncClient(Client):
     def __init__(self, address, port, **kwargs):
@@ -24,10 +38,16 @@ class SyncClient(Client):
         assert 0 <= self._retry_max <= 120, 'retry_max must be [0, 120]'
         self._retry_interval = kwargs.get('retry_interval', 5)
         assert self._retry_interval >= 0, 'retry_interval must be non-negative'
+        self._backoff = Backoff(self._retry_interval,
+                                max(self._retry_interval,
+                                    kwargs.get('retry_max_interval', 60)))
+        self._pipeline_depth = kwargs.get('pipeline_depth', 16)
+        assert 1 <= self._pipeline_depth <= 1024, 'pipeline_depth must be [1, 1024]'
         self._logger = logging.getLogger(self.__class__.__name__)
         self._need_reconnect = True
         self._retry_count = -1
         self._socket = None
+        self._buffer = memoryview(bytearray(RECV_BUFFER_SIZE))
         self._closed = False
 
     def _reconnect(self):
@@ -35,10 +55,13 @@ class SyncClient(Client):
             self.__ensure_need_reconnect()
             self.__close_socket()
             try:
+                start = time.time()
                 self._socket = socket.create_connection(
                     (self._address, self._port), timeout=self._timeout)
+                self._metrics.record_connect(time.time() - start)
                 break
             except socket.error as e:
+                self._record_error(e)
                 raise_e = False
                 if self._retry_max <= 0:
                     raise_e = True
@@ -52,10 +75,12 @@ class SyncClient(Client):
                     raise e
                 self._retry_count += 1
                 if self._retry_count < self._retry_max:
-                    self._logger.debug('Connect retry {}:{} in {}s, {}/{}'.format(
-                        self._address, self._port, self._retry_interval,
+                    self._metrics.incr('retries')
+                    delay = self._backoff.delay(self._retry_count)
+                    self._logger.debug('Connect retry {}:{} in {:.3f}s, {}/{}'.format(
+                        self._address, self._port, delay,
                         self._retry_count + 1, self._retry_max))
-                    time.sleep(self._retry_interval)
+                    time.sleep(delay)
 
         self.__ensure_not_closed()
         if self._retry_count >= self._retry_max:
@@ -68,11 +93,18 @@ class SyncClient(Client):
         if self._closed:
             raise Unavailable('Client already closed')
 
+    def _record_error(self, e):
+        self._metrics.incr('timeouts' if isinstance(e, socket.timeout) else 'errors')
+
     def __ensure_need_reconnect(self):
         self.__ensure_not_closed()
         if not self._need_reconnect:
             raise Unavailable('Give up reconnect')
 
+    def connect(self):
+        if self._socket is None:
+            self._reconnect()
+
     def execute(self, qdb_proto):
         if self._socket is None:
             self._reconnect()
@@ -82,32 +114,95 @@ class SyncClient(Client):
             except (socket.timeout, socket.error) as e:
                 self._logger.warning('Network error {}:{} {}'.format(
                     self._address, self._port, e))
+                self._record_error(e)
+                self._metrics.incr('reconnects')
+                self._reconnect()
+                self._need_reconnect = False
+
+    def execute_pipeline(self, qdb_protos, depth=None):
+        qdb_protos = list(qdb_protos)
+        self.execute_pending(deque(qdb_protos), depth)
+        return qdb_protos
+
+    def execute_pending(self, pending, depth=None):
+        if depth is None:
+            depth = self._pipeline_depth
+        assert depth >= 1, 'depth must be positive'
+        if self._socket is None and pending:
+            self._reconnect()
+        while pending:
+            try:
+                self._execute_pipeline(pending, depth)
+            except (socket.timeout, socket.error, ServerClosed) as e:
+                self._logger.warning('Network error {}:{} {}, {} pending'.format(
+                    self._address, self._port, e, len(pending)))
+                self._record_error(e)
+                self._metrics.incr('reconnects')
                 self._reconnect()
                 self._need_reconnect = False
 
+    def _execute_pipeline(self, pending, depth):
+        self.__ensure_not_closed()
+
+        sent = 0
+        sent_at = deque()
+        while pending:
+            limit = min(depth, len(pending))
+            if sent < limit:
+                start = time.time()
+                requests = [b''.join(qdb_proto.upstream())
+                            for qdb_proto in islice(pending, sent, limit)]
+                self._socket.sendall(b''.join(requests))
+                end = time.time()
+                sent_at.extend([(start, end, len(r)) for r in requests])
+                sent = limit
+            start, end, bytes_out = sent_at.popleft()
+            bytes_in, first_byte = self._recv_response(pending[0])
+            self._metrics.record_request(end - start, first_byte - end,
+                                         time.time() - start, bytes_out, bytes_in)
+            pending.popleft()
+            sent -= 1
+
     def _execute(self, qdb_proto):
         self.__ensure_not_closed()
 
+        start = time.time()
+        bytes_out = 0
         for data in qdb_proto.upstream():
             self._socket.sendall(data)
+            bytes_out += len(data)
+        end = time.time()
+        bytes_in, first_byte = self._recv_response(qdb_proto)
+        self._metrics.record_request(end - start, first_byte - end,
+                                     time.time() - start, bytes_out, bytes_in)
+        return qdb_proto
+
+    def _recv_response(self, qdb_proto):
         downstream = qdb_proto.downstream()
         read_size = next(downstream)
+        bytes_in = 0
+        first_byte = None
         while read_size > 0:
             data = self._recvall(self._socket, read_size)
+            if first_byte is None:
+                first_byte = time.time()
+            bytes_in += read_size
             read_size = downstream.send(data)
-        return qdb_proto
+        return bytes_in, first_byte
 
     def _recvall(self, s, size):
-        buffer = BytesIO()
-        left = size
-        while left > 0:
-            data = s.recv(left)
-            if not data:
+        if size > len(self._buffer):
+            self._buffer = memoryview(bytearray(size))
+        self._recv_into(s, self._buffer, size)
+        return self._buffer[:size].tobytes()
+
+    def _recv_into(self, s, buffer, size):
+        received = 0
+        while received < size:
+            n = s.recv_into(buffer[received:size])
+            if not n:
                 raise ServerClosed
-            buffer.write(data)
-            left = size - buffer.tell()
-        buffer.seek(0)
-        return buffer.read()
+            received += n
 
     def __close_socket(self):
         if self._socket is not None:
@@ -116,52 +211,244 @@ class SyncClient(Client):
             finally:
                 self._socket = None
 
+    def abort(self):
+        # called from another thread, the request in flight fails at once
+        # and the client can not be used again
+        self._closed = True
+        s = self._socket
+        if s is not None:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
     def close(self):
         self.__close_socket()
         self._closed = True
 
 
+class Attempt(object):
+    # the client a hedged request is sent on, a cancelled attempt aborts
+    # its client unless the response is already in
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = None
+        self.client = None
+        self.cancelled = False
+
+    def use(self, state, client):
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.state, self.client = state, client
+            return True
+
+    def done(self):
+        # returns True when the client was aborted
+        with self._lock:
+            self.client = None
+            return self.cancelled
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self.client is not None:
+                self.client.abort()
+
+
+class Workers(object):
+    # threads running the parts of a batch beside the calling thread,
+    # started on demand and kept until stopped
+
+    def __init__(self):
+        self._tasks = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = 0
+        self._idle = 0
+        self._stopped = False
+
+    def run(self, funcs):
+        # the first function runs on the calling thread, returns when all
+        # are done and raises the first error
+        done = Queue.Queue()
+        with self._lock:
+            if self._stopped:
+                raise Unavailable('Closed')
+            for _ in range(len(funcs) - 1 - self._idle):
+                t = threading.Thread(target=self._run)
+                t.daemon = True
+                t.start()
+                self._threads += 1
+                self._idle += 1
+            self._idle -= len(funcs) - 1
+        for func in funcs[1:]:
+            self._tasks.put((func, done))
+        errors = []
+        try:
+            funcs[0]()
+        except Exception as e:
+            errors.append(e)
+        for _ in funcs[1:]:
+            e = done.get()
+            if e is not None:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            func, done = task
+            error = None
+            try:
+                func()
+            except Exception as e:
+                error = e
+            with self._lock:
+                self._idle += 1
+            done.put(error)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            for _ in range(self._threads):
+                self._tasks.put(None)
+            self._threads = 0
+
+
 class SyncClientPool(object):
-    def __init__(self, endpoints, max_concurrency=1, **kwargs):
+    def __init__(self, endpoints, max_concurrency=1, cache=None, coalesce=False,
+                 router=None, balancer=None, max_qps=None,
+                 max_qps_per_endpoint=None, qps_burst=1.0,
+                 breaker_threshold=3, probe_interval=1.0, hedger=None,
+                 affinity=64, min_concurrency=1, idle_timeout=60, **kwargs):
+        assert affinity >= 0, 'affinity must be non-negative'
         self._endpoints = endpoints
-        self._candidates = dict.fromkeys(self._endpoints, max_concurrency)
-        self._kwargs = kwargs
-        self._clients = Queue.Queue()
-        self._clients_count = 0
-        self._create_lock = threading.Lock()
+        if kwargs.get('metrics', None) is None:
+            kwargs['metrics'] = Metrics()
+        self._metrics = kwargs['metrics']
+        self._router = router
+        self._shards = []
+        if router is not None:
+            self._shards = [SyncClientPool(shard, max_concurrency,
+                                           balancer=balancer,
+                                           max_qps_per_endpoint=max_qps_per_endpoint,
+                                           qps_burst=qps_burst,
+                                           breaker_threshold=breaker_threshold,
+                                           probe_interval=probe_interval,
+                                           affinity=affinity,
+                                           min_concurrency=min_concurrency,
+                                           idle_timeout=idle_timeout, **kwargs)
+                            for shard in router.shards]
+            endpoints = ()
+        self._endpoint_set = EndpointSet(endpoints, max_concurrency, balancer,
+                                         breaker_threshold, probe_interval,
+                                         kwargs.get('retry_interval', 5),
+                                         kwargs.get('retry_max_interval', 60),
+                                         min_concurrency, idle_timeout)
+        self._probe_interval = probe_interval
+        self._prober = None
+        self._probe_stop = threading.Event()
+        self._bucket = create_bucket(max_qps, qps_burst)
+        for state in self._endpoint_set.states:
+            state.bucket = create_bucket(max_qps_per_endpoint, qps_burst)
+        self._max_clients = len(self._endpoint_set.states) * max_concurrency
+        self._workers = Workers()
+        self._cache = cache
+        self._hedger = hedger
+        self._scheduler = Scheduler() if hedger is not None else None
+        self._coalesce = coalesce
+        self._flights = {}
+        self.coalesced = 0
+        self._coalesced_lock = threading.Lock()
+        # pooled clients reconnect without sleeping, the pool backs the
+        # endpoint off and sends requests to the others meanwhile, or waits
+        # for the first one due when every endpoint is backing off
+        self._kwargs = dict(kwargs, retry_interval=0)
+        self._cond = threading.Condition()
+        # a thread keeps its client for up to `affinity` requests, parked
+        # clients can be taken by threads with none, pops are atomic
+        self._affinity = affinity
+        self._local = threading.local()
+        self._slots = []
+        self._waiters = 0
         self._close_lock = threading.Lock()
         self._closing = False
         self._closed = False
-        self._started = False
         self._logger = logging.getLogger(self.__class__.__name__)
 
-    def _create_client(self):
-        with self._create_lock:
-            self.__ensure_not_closed()
-            self.__ensure_not_closing()
-
-            while len(self._candidates) > 0:
-                if self._clients.qsize() > 0:
-                    return
-                endpoint = random.sample(self._candidates.keys(), 1)[0]
-                if self._candidates[endpoint] <= 0:
-                    self._candidates.pop(endpoint)
-                    continue
-
-                address, port = split_endpoint(endpoint)
-                client = SyncClient(address, port, **self._kwargs)
-                self._candidates[endpoint] -= 1
-                if self._candidates[endpoint] <= 0:
-                    self._candidates.pop(endpoint)
-                self._clients.put(client)
-                self._clients_count += 1
-                self._logger.debug('Create a new client {}'.format(endpoint))
-                return
-
-            raise ResourceLimit('No more available endpoint')
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def stats(self):
+        stats = {
+            'endpoints': self._metrics.stats(),
+            'coalesced': self.coalesced,
+            'queue_wait': self._metrics.queue_wait(),
+            'connections': self.connections(),
+        }
+        if self._cache is not None:
+            stats['cache'] = {
+                'hits': self._cache.hits,
+                'negative_hits': self._cache.negative_hits,
+                'misses': self._cache.misses,
+                'size': len(self._cache),
+                'memory': self._cache.memory,
+            }
+        if self._hedger is not None:
+            stats['hedge'] = self._hedger.stats()
+        return stats
+
+    def _create_client(self, address, port):
+        client = SyncClient(address, port, **self._kwargs)
+        self._logger.debug('Create a new client {}'.format(client.endpoint))
+        return client
+
+    def connections(self):
+        return self._endpoint_set.clients_count + \
+            sum([shard.connections() for shard in self._shards])
 
     def _exhausted(self):
-        return self._clients_count <= 0 and len(self._candidates) <= 0
+        return self._endpoint_set.exhausted()
+
+    def _fill(self):
+        with self._cond:
+            clients = [(self, state, client) for state, client
+                       in self._endpoint_set.fill(self._create_client)]
+        for shard in self._shards:
+            clients.extend(shard._fill())
+        return clients
+
+    def warm_up(self):
+        # connects all the clients in parallel before the first request
+        start = time.time()
+        failed = {}
+        connected = []
+        threads = [threading.Thread(target=pool._warm_up_client,
+                                    args=(state, client, failed, connected))
+                   for pool, state, client in self._fill()]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        return warm_up_report(start, len(connected), failed)
+
+    def _warm_up_client(self, state, client, failed, connected):
+        try:
+            client.connect()
+        except Exception as e:
+            failed[state.endpoint] = e
+            self._discard_client(state, client)
+            return
+        connected.append(client)
+        with self._cond:
+            self._endpoint_set.checkin(state, client)
+            self._cond.notify()
 
     def __ensure_not_closing(self):
         if self._closing:
@@ -171,50 +458,351 @@ class SyncClientPool(object):
         if self._closed:
             raise Unavailable('Closed')
 
-    def __ensure_not_exhuasted(self):
-        if self._exhausted():
-            raise ResourceLimit('No more available client')
-
     def execute(self, qdb_proto):
+        if self._cache is not None and self._cache.get(qdb_proto):
+            return qdb_proto
+        if not self._coalesce:
+            return self._execute_one(qdb_proto)
+
+        key = proto_key(qdb_proto)
+        flight = Flight(threading.Lock())
+        flight.waiter.acquire()
+        leader = self._flights.setdefault(key, flight)
+        if leader is not flight:
+            self._count_coalesced(1)
+            with leader.waiter:
+                pass
+            if leader.error is not None:
+                raise leader.error
+            return fill_proto(qdb_proto, leader.value)
 
+        try:
+            r = self._execute_one(qdb_proto)
+            flight.value = r.value
+            return r
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._flights.pop(key, None)
+            flight.waiter.release()
+
+    def _route(self, qdb_proto):
+        if self._router is None:
+            return self
+        return self._shards[self._router.route(qdb_proto.key)]
+
+    def _group_by_route(self, qdb_protos):
+        if self._router is None:
+            return [(self, qdb_protos)]
+        groups = {}
+        for qdb_proto in qdb_protos:
+            groups.setdefault(self._router.route(qdb_proto.key), []).append(qdb_proto)
+        return [(self._shards[idx], protos) for idx, protos in groups.items()]
+
+    def _throttle(self, bucket, count=1):
+        delay = bucket.reserve(count)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _execute_one(self, qdb_proto):
+        if self._bucket is not None:
+            self._throttle(self._bucket)
+        pool = self._route(qdb_proto)
+        if self._hedger is None:
+            r = pool._execute(lambda client: client.execute(qdb_proto))
+        else:
+            r = self._hedged_execute(pool, qdb_proto)
+        if self._cache is not None:
+            self._cache.set(r)
+        return r
+
+    def _hedged_execute(self, pool, qdb_proto):
+        # the first attempt runs on the calling thread, a hedge thread is
+        # only started when it is late and the budget allows
+        hedger = self._hedger
+        start = time.time()
+        delay = hedger.delay()
+        if delay is None:
+            r = pool._execute(lambda client: client.execute(qdb_proto))
+            hedger.record(time.time() - start)
+            return r
+        protos = [copy_proto(qdb_proto), copy_proto(qdb_proto)]
+        attempts = [Attempt(), Attempt()]
+
+        def on_win(index):
+            # a winning hedge aborts the first attempt to unblock the
+            # caller, a losing hedge is left to finish
+            if index == 1:
+                attempts[0].cancel()
+
+        race = Race(on_win)
+        timer = self._scheduler.call_later(
+            delay, lambda: self._hedge(pool, race, protos[1], attempts))
+        try:
+            race.run(0, lambda: pool._execute(
+                lambda client: client.execute(protos[0]), attempt=attempts[0]))
+        finally:
+            self._scheduler.cancel(timer)
+        race.wait()
+        if race.winner is None:
+            raise race.error
+        hedger.record(time.time() - start, race.winner == 1)
+        return fill_proto(qdb_proto, protos[race.winner].value)
+
+    def _hedge(self, pool, race, qdb_proto, attempts):
+        # runs on the scheduler thread
+        exclude = attempts[0].state
+        if race.done() or exclude is None or not self._hedger.acquire():
+            return
+        race.start(1, lambda: self._send_hedge(pool, qdb_proto, attempts[1], exclude))
+
+    def _send_hedge(self, pool, qdb_proto, attempt, exclude):
+        try:
+            if self._bucket is not None:
+                self._throttle(self._bucket)
+            return pool._execute(lambda client: client.execute(qdb_proto),
+                                 exclude=exclude, attempt=attempt)
+        except Exception:
+            if attempt.state is None:
+                self._hedger.refund()
+            raise
+
+    def _count_coalesced(self, count):
+        # += on an attribute is not atomic across threads
+        with self._coalesced_lock:
+            self.coalesced += count
+
+    def execute_many(self, qdb_protos, batch_size=128):
+        assert batch_size >= 1, 'batch_size must be positive'
+        qdb_protos = iter(qdb_protos)
         while True:
-            self.__ensure_not_closed()
-            self.__ensure_not_closing()
-            self.__ensure_not_exhuasted()
-            if not self._started:
-                try:
-                    self._create_client()
-                except:
+            batch = list(islice(qdb_protos, batch_size))
+            if not batch:
+                break
+            misses = batch
+            if self._cache is not None:
+                misses = [p for p in batch if not self._cache.get(p)]
+            duplicates = ()
+            if self._coalesce:
+                misses, duplicates = dedup_protos(misses)
+                self._count_coalesced(len(duplicates))
+            if misses:
+                if self._bucket is not None:
+                    self._throttle(self._bucket, len(misses))
+                # the parts of every route go out on their own connections
+                # at the same time
+                funcs = [partial(pool._execute_pending, part)
+                         for pool, protos in self._group_by_route(misses)
+                         for part in pool._split(protos)]
+                if len(funcs) > 1:
+                    self._workers.run(funcs)
+                else:
+                    funcs[0]()
+                if self._cache is not None:
+                    for r in misses:
+                        self._cache.set(r)
+            for first, r in duplicates:
+                fill_proto(r, first.value)
+            for r in batch:
+                yield r
+
+    def _split(self, protos):
+        # as many parts as the pool can have connections
+        parts = min(self._max_clients, len(protos) // MIN_PIPELINE) or 1
+        size = -(-len(protos) // parts)
+        return [protos[i:i + size] for i in range(0, len(protos), size)]
+
+    def _execute_pending(self, protos):
+        # a retry on another client resends only the unanswered
+        pending = deque(protos)
+        self._execute(lambda client: client.execute_pending(pending),
+                      len(protos))
+
+    def _execute(self, func, count=1, exclude=None, attempt=None):
+        # short lived hedge attempts do not keep clients
+        slot = None
+        if self._affinity > 0 and exclude is None:
+            slot = self._slot()
+
+        wait_start = None
+        while True:
+            if self._closed or self._closing:
+                self.__ensure_not_closed()
+                self.__ensure_not_closing()
+
+            parked = None
+            if slot is not None:
+                parked = self._unpark(slot, count)
+            if parked is None:
+                checkout_start = time.time()
+                parked = self._checkout(exclude, count)
+                if parked is None:
+                    if wait_start is None:
+                        wait_start = checkout_start
                     continue
-                finally:
-                    self._started = True
-
-            client = None
+            if wait_start is not None:
+                self._metrics.record_queue_wait(time.time() - wait_start)
+                wait_start = None
+            state, client, uses = parked
+            if attempt is not None and not attempt.use(state, client):
+                with self._cond:
+                    self._endpoint_set.putback(state, client)
+                    self._cond.notify()
+                raise Unavailable('Cancelled')
+
+            start = time.time()
             try:
-                client = self._clients.get(timeout=1)
-                r = client.execute(qdb_proto)
-                self._clients.put(client)
+                r = func(client)
+            except Exception as e:
+                if attempt is not None and attempt.done():
+                    self._drop_client(state, client)
+                    raise Unavailable('Cancelled')
+                if isinstance(e, (RetryLimitExceeded, socket.error)):
+                    self._logger.warning(
+                        'Not available, {} {}'.format(client.endpoint, e))
+                else:
+                    self._logger.error(
+                        'Unexpected error, {} {}'.format(client.endpoint, e))
+                self._discard_client(state, client)
+                continue
+
+            if attempt is not None and attempt.done():
+                # aborted after the response was in
+                self._drop_client(state, client)
+                return r
+            latency = time.time() - start
+            # uses count requests, a pipeline goes back to the balancer
+            # as often as single requests do
+            uses += count
+            if slot is not None and uses < self._affinity \
+                    and not state.breaker.failures:
+                state.update_latency(latency / count)
+                slot.append((state, client, uses))
+                if self._waiters:
+                    with self._cond:
+                        self._cond.notify()
                 return r
-            except Queue.Empty:
+
+            with self._cond:
+                self._endpoint_set.checkin(state, client, latency, count)
+                self._cond.notify()
+            return r
+
+    def _slot(self):
+        slot = getattr(self._local, 'slot', None)
+        if slot is None:
+            slot = self._local.slot = []
+            with self._cond:
+                self._slots.append((threading.current_thread(), slot))
+        return slot
+
+    def _claim(self, parked, count):
+        # a parked client is used only when its endpoint could be checked
+        # out, the rate limit tokens are taken as a checkout does
+        state, _, uses = parked
+        if uses >= self._affinity or not state.breaker.allow() \
+                or state.breaker.backing_off():
+            return False
+        return state.bucket is None or state.bucket.try_acquire(count)
+
+    def _unpark(self, slot, count=1):
+        try:
+            parked = slot.pop()
+        except IndexError:
+            return None
+        if self._claim(parked, count):
+            return parked
+        with self._cond:
+            self._endpoint_set.putback(parked[0], parked[1])
+            self._cond.notify()
+        return None
+
+    def _steal(self, count=1):
+        # must hold self._cond
+        slots = []
+        for thread, slot in self._slots:
+            while slot:
                 try:
-                    self._create_client()
-                except ResourceLimit:
-                    continue
-            except (RetryLimitExceeded, socket.error) as e:
-                self._logger.warning(
-                    'Not available, {} {}'.format(client.endpoint, e))
-                self._release_client(client)
-            except Exception as e:
-                self._logger.error(
-                    'Unexpected error, {} {}'.format(client.endpoint, e))
-                self._release_client(client)
+                    parked = slot.pop()
+                except IndexError:
+                    break
+                if self._claim(parked, count):
+                    return parked
+                self._endpoint_set.putback(parked[0], parked[1])
+            if slot or thread.is_alive():
+                slots.append((thread, slot))
+        self._slots = slots
+        return None
+
+    def _checkout(self, exclude=None, count=1):
+        with self._cond:
+            state, client = self._endpoint_set.checkout(
+                self._create_client, exclude, count)
+            if client is not None:
+                return state, client, 0
+            if exclude is not None:
+                raise ResourceLimit('No spare client')
+            parked = self._steal(count)
+            if parked is not None:
+                return parked
+            self._waiters += 1
+            try:
+                self._cond.wait(self._endpoint_set.wait_time(count=count))
+            finally:
+                self._waiters -= 1
+        return None
 
-    def _release_client(self, client):
+    def _drop_client(self, state, client):
+        with self._cond:
+            try:
+                self._endpoint_set.drop(state, client)
+            finally:
+                self._cond.notify()
+
+    def _discard_client(self, state, client):
+        with self._cond:
+            try:
+                if self._endpoint_set.discard(state, client):
+                    self._on_eject(state)
+            finally:
+                self._cond.notify()
+
+    def _on_eject(self, state):
+        self._logger.warning('Eject {} after {} failures'.format(
+            state.endpoint, state.breaker.failures))
+        if self._prober is None and not (self._closing or self._closed):
+            self._prober = threading.Thread(target=self._loop_probe)
+            self._prober.daemon = True
+            self._prober.start()
+
+    def _loop_probe(self):
+        # runs while any endpoint is ejected
+        while not self._probe_stop.wait(self._probe_interval / 2.0):
+            with self._cond:
+                if not self._endpoint_set.ejected():
+                    self._prober = None
+                    return
+                states = self._endpoint_set.probe_due()
+            for state in states:
+                ok = self._probe(state)
+                with self._cond:
+                    self._endpoint_set.on_probe(state, ok)
+                    self._cond.notify_all()
+                if ok:
+                    self._logger.info('Readmit {}'.format(state.endpoint))
+
+    def _probe(self, state):
+        kwargs = dict(self._kwargs, retry_max=0, metrics=None)
+        client = SyncClient(state.address, state.port, **kwargs)
         try:
-            if client:
-                client.close()
+            client.execute(probe_protocal())
+            return True
+        except Exception as e:
+            self._logger.debug('Probe error {} {}'.format(state.endpoint, e))
+            return False
         finally:
-            self._clients_count -= 1
+            client.close()
 
     def available(self):
         if self._closing or self._closed:
@@ -230,13 +818,24 @@ class SyncClientPool(object):
                 return
 
             self._closing = True
-            with self._create_lock:
-                while self._clients_count > 0:
-                    client = None
-                    try:
-                        client = self._clients.get(timeout=0.1)
-                    except Queue.Empty:
-                        pass
-                    self._release_client(client)
-                self._closed = True
+            self._probe_stop.set()
+            if self._scheduler is not None:
+                self._scheduler.stop()
+            self._workers.stop()
+            with self._cond:
+                while self._endpoint_set.clients_count > 0:
+                    for _, slot in self._slots:
+                        while slot:
+                            try:
+                                state, client, _ = slot.pop()
+                            except IndexError:
+                                break
+                            self._endpoint_set.putback(state, client)
+                    for state, client in list(self._endpoint_set.pop_idle()):
+                        self._endpoint_set.release(state, client)
+                    if self._endpoint_set.clients_count > 0:
+                        self._cond.wait(0.1)
+            for shard in self._shards:
+                shard.close()
+            self._closed = True
             self._closing = False
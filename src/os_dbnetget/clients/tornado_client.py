@@ -1,20 +1,29 @@
 import datetime
 import functools
 import logging
-import random
 import socket
+import time
+from collections import deque
 from datetime import timedelta
+from itertools import islice
 
-from tornado import gen, queues
+from tornado import gen
 from tornado.iostream import StreamClosedError
-from tornado.locks import Lock
+from tornado.locks import Condition, Event, Lock
 from tornado.tcpclient import TCPClient
 from tornado.util import TimeoutError
 
-from os_dbnetget.clients.client import RETRY_NETWORK_ERRNO, Client
+from os_dbnetget.clients.backoff import Backoff
+from os_dbnetget.clients.balancing import EndpointSet
+from os_dbnetget.clients.breaker import probe_protocal
+from os_dbnetget.clients.limiter import create_bucket
+from os_dbnetget.clients.metrics import Metrics
+from os_dbnetget.clients.client import (RECV_BUFFER_SIZE, RETRY_NETWORK_ERRNO,
+                                       Client, Flight, copy_proto,
+                                       dedup_protos, fill_proto, proto_key,
+                                       warm_up_report)
 from os_dbnetget.exceptions import (ResourceLimit, RetryLimitExceeded,
-                                    ServerClosed, Unavailable)
-from os_dbnetget.utils import split_endpoint
+                                    Unavailable)
 
 socket.setdefaulttimeout(10)
 
@@ -32,9 +41,15 @@ class TornadoClient(Client):
         assert 0 <= self._retry_max <= 120, 'retry_max must be [0, 120]'
         self._retry_interval = kwargs.get('retry_interval', 5)
         assert self._retry_interval >= 0, 'retry_interval must be non-negative'
+        self._backoff = Backoff(self._retry_interval,
+                                max(self._retry_interval,
+                                    kwargs.get('retry_max_interval', 60)))
+        self._pipeline_depth = kwargs.get('pipeline_depth', 16)
+        assert 1 <= self._pipeline_depth <= 1024, 'pipeline_depth must be [1, 1024]'
         self._retry_count = -1
         self._need_reconnect = True
         self._stream = None
+        self._buffer = memoryview(bytearray(RECV_BUFFER_SIZE))
         self._closed = False
         self._logger = logging.getLogger(self.__class__.__name__)
 
@@ -44,10 +59,13 @@ class TornadoClient(Client):
             self.__ensure_not_closed()
             self.__close_stream()
             try:
+                start = time.time()
                 self._stream = yield TCPClient().connect(self._address, self._port,
                                                          timeout=self._connect_timeout)
+                self._metrics.record_connect(time.time() - start)
                 break
             except (StreamClosedError, TimeoutError) as e:
+                self._record_error(e)
                 raise_e = False
                 if self._retry_max <= 0:
                     raise_e = True
@@ -65,10 +83,12 @@ class TornadoClient(Client):
 
                 self._retry_count += 1
                 if self._retry_count < self._retry_max:
-                    self._logger.debug('Connect retry {}:{} in {}s, {}/{}'.format(
-                        self._address, self._port, self._retry_interval,
+                    self._metrics.incr('retries')
+                    delay = self._backoff.delay(self._retry_count)
+                    self._logger.debug('Connect retry {}:{} in {:.3f}s, {}/{}'.format(
+                        self._address, self._port, delay,
                         self._retry_count + 1, self._retry_max))
-                    yield gen.sleep(self._retry_interval)
+                    yield gen.sleep(delay)
 
         self.__ensure_not_closed()
         if self._retry_count >= self._retry_max:
@@ -79,18 +99,72 @@ class TornadoClient(Client):
     @gen.coroutine
     def _execute(self, qdb_proto):
         self.__ensure_not_closed()
+        start = time.time()
+        bytes_out = 0
         for data in qdb_proto.upstream():
             yield self._stream.write(data)
+            bytes_out += len(data)
+        end = time.time()
+        bytes_in, first_byte = yield self._recv_response(qdb_proto)
+        self._metrics.record_request(end - start, first_byte - end,
+                                     time.time() - start, bytes_out, bytes_in)
+        raise gen.Return(qdb_proto)
+
+    @gen.coroutine
+    def _execute_pipeline(self, pending, depth):
+        self.__ensure_not_closed()
+        sent = 0
+        sent_at = deque()
+        while pending:
+            limit = min(depth, len(pending))
+            if sent < limit:
+                start = time.time()
+                requests = [b''.join(qdb_proto.upstream())
+                            for qdb_proto in islice(pending, sent, limit)]
+                yield self._stream.write(b''.join(requests))
+                end = time.time()
+                sent_at.extend([(start, end, len(r)) for r in requests])
+                sent = limit
+            start, end, bytes_out = sent_at.popleft()
+            bytes_in, first_byte = yield self._recv_response(pending[0])
+            self._metrics.record_request(end - start, first_byte - end,
+                                         time.time() - start, bytes_out, bytes_in)
+            pending.popleft()
+            sent -= 1
+
+    @gen.coroutine
+    def _recv_response(self, qdb_proto):
         downstream = qdb_proto.downstream()
         read_size = next(downstream)
+        bytes_in = 0
+        first_byte = None
         while read_size > 0:
-            data = yield gen.with_timeout(
-                datetime.timedelta(seconds=self._recv_timeout),
-                self._stream.read_bytes(read_size),
-                quiet_exceptions=(StreamClosedError,),
-            )
+            if read_size > RECV_BUFFER_SIZE:
+                if read_size > len(self._buffer):
+                    self._buffer = memoryview(bytearray(read_size))
+                yield self._with_recv_timeout(
+                    self._stream.read_into(self._buffer[:read_size]))
+                data = self._buffer[:read_size].tobytes()
+            else:
+                data = yield self._with_recv_timeout(
+                    self._stream.read_bytes(read_size))
+            if first_byte is None:
+                first_byte = time.time()
+            bytes_in += read_size
             read_size = downstream.send(data)
-        raise gen.Return(qdb_proto)
+        raise gen.Return((bytes_in, first_byte))
+
+    def _with_recv_timeout(self, future):
+        return gen.with_timeout(
+            datetime.timedelta(seconds=self._recv_timeout),
+            future,
+            quiet_exceptions=(StreamClosedError,),
+        )
+
+    @gen.coroutine
+    def connect(self):
+        if self._stream is None:
+            yield self._reconnect()
 
     @gen.coroutine
     def execute(self, qdb_proto):
@@ -103,6 +177,32 @@ class TornadoClient(Client):
             except (TimeoutError, StreamClosedError) as e:
                 self._logger.warning('Network error {}:{} {}'.format(
                     self._address, self._port, e))
+                self._record_error(e)
+                self._metrics.incr('reconnects')
+                yield self._reconnect()
+                self._need_reconnect = False
+
+    @gen.coroutine
+    def execute_pipeline(self, qdb_protos, depth=None):
+        qdb_protos = list(qdb_protos)
+        yield self.execute_pending(deque(qdb_protos), depth)
+        raise gen.Return(qdb_protos)
+
+    @gen.coroutine
+    def execute_pending(self, pending, depth=None):
+        if depth is None:
+            depth = self._pipeline_depth
+        assert depth >= 1, 'depth must be positive'
+        if self._stream is None and pending:
+            yield self._reconnect()
+        while pending:
+            try:
+                yield self._execute_pipeline(pending, depth)
+            except (TimeoutError, StreamClosedError) as e:
+                self._logger.warning('Network error {}:{} {}, {} pending'.format(
+                    self._address, self._port, e, len(pending)))
+                self._record_error(e)
+                self._metrics.incr('reconnects')
                 yield self._reconnect()
                 self._need_reconnect = False
 
@@ -110,6 +210,9 @@ class TornadoClient(Client):
         if self._closed:
             raise Unavailable('Client already closed')
 
+    def _record_error(self, e):
+        self._metrics.incr('timeouts' if isinstance(e, TimeoutError) else 'errors')
+
     def __ensure_need_reconnect(self):
         self.__ensure_not_closed()
         if not self._need_reconnect:
@@ -130,47 +233,114 @@ class TornadoClient(Client):
 
 class TornadoClientPool(object):
 
-    def __init__(self, endpoints, max_concurrency=1, **kwargs):
+    def __init__(self, endpoints, max_concurrency=1, cache=None, coalesce=False,
+                 router=None, balancer=None, max_qps=None,
+                 max_qps_per_endpoint=None, qps_burst=1.0,
+                 breaker_threshold=3, probe_interval=1.0, hedger=None,
+                 min_concurrency=1, idle_timeout=60, **kwargs):
         self._endpoints = endpoints
-        self._candidates = dict.fromkeys(self._endpoints, max_concurrency)
-        self._kwargs = kwargs
-        self._clients = queues.Queue()
-        self._create_lock = Lock()
+        if kwargs.get('metrics', None) is None:
+            kwargs['metrics'] = Metrics()
+        self._metrics = kwargs['metrics']
+        self._router = router
+        self._shards = []
+        if router is not None:
+            self._shards = [TornadoClientPool(shard, max_concurrency,
+                                              balancer=balancer,
+                                              max_qps_per_endpoint=max_qps_per_endpoint,
+                                              qps_burst=qps_burst,
+                                              breaker_threshold=breaker_threshold,
+                                              probe_interval=probe_interval,
+                                              min_concurrency=min_concurrency,
+                                              idle_timeout=idle_timeout, **kwargs)
+                            for shard in router.shards]
+        self._endpoint_set = EndpointSet(
+            endpoints if router is None else (), max_concurrency, balancer,
+            breaker_threshold, probe_interval, kwargs.get('retry_interval', 5),
+            kwargs.get('retry_max_interval', 60), min_concurrency, idle_timeout)
+        self._probe_interval = probe_interval
+        self._prober = None
+        self._bucket = create_bucket(max_qps, qps_burst)
+        for state in self._endpoint_set.states:
+            state.bucket = create_bucket(max_qps_per_endpoint, qps_burst)
+        self._cache = cache
+        self._hedger = hedger
+        self._coalesce = coalesce
+        self._flights = {}
+        self.coalesced = 0
+        self._max_clients = len(self._endpoints) * max_concurrency
+        # pooled clients reconnect without sleeping, the pool backs the
+        # endpoint off and sends requests to the others meanwhile, or waits
+        # for the first one due when every endpoint is backing off
+        self._kwargs = dict(kwargs, retry_interval=0)
+        self._cond = Condition()
         self._close_lock = Lock()
-        self._clients_count = 0
         self._closed = False
         self._closing = False
-        self._started = False
         self._logger = logging.getLogger(self.__class__.__name__)
 
-    @gen.coroutine
-    def _create_client(self):
-        with (yield self._create_lock.acquire()):
-            self.__ensure_not_closed()
-            self.__ensure_not_closing()
-
-            while len(self._candidates) > 0:
-                if self._clients.qsize() > 0:
-                    return
-                endpoint = random.sample(self._candidates.keys(), 1)[0]
-                if self._candidates[endpoint] <= 0:
-                    self._candidates.pop(endpoint)
-                    continue
-
-                address, port = split_endpoint(endpoint)
-                client = TornadoClient(address, port, **self._kwargs)
-                self._candidates[endpoint] -= 1
-                if self._candidates[endpoint] <= 0:
-                    self._candidates.pop(endpoint)
-                yield self._clients.put(client)
-                self._clients_count += 1
-                self._logger.debug('Create a new client {}'.format(endpoint))
-                return
-
-            raise ResourceLimit('No more available endpoint')
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def stats(self):
+        stats = {
+            'endpoints': self._metrics.stats(),
+            'coalesced': self.coalesced,
+            'queue_wait': self._metrics.queue_wait(),
+            'connections': self.connections(),
+        }
+        if self._cache is not None:
+            stats['cache'] = {
+                'hits': self._cache.hits,
+                'negative_hits': self._cache.negative_hits,
+                'misses': self._cache.misses,
+                'size': len(self._cache),
+                'memory': self._cache.memory,
+            }
+        if self._hedger is not None:
+            stats['hedge'] = self._hedger.stats()
+        return stats
+
+    def _create_client(self, address, port):
+        client = TornadoClient(address, port, **self._kwargs)
+        self._logger.debug('Create a new client {}'.format(client.endpoint))
+        return client
+
+    def connections(self):
+        return self._endpoint_set.clients_count + \
+            sum([shard.connections() for shard in self._shards])
 
     def _exhausted(self):
-        return self._clients_count <= 0 and len(self._candidates) <= 0
+        return self._endpoint_set.exhausted()
+
+    def _fill(self):
+        clients = [(self, state, client) for state, client
+                   in self._endpoint_set.fill(self._create_client)]
+        for shard in self._shards:
+            clients.extend(shard._fill())
+        return clients
+
+    @gen.coroutine
+    def warm_up(self):
+        # connects all the clients concurrently before the first request
+        start = time.time()
+        failed = {}
+        results = yield [pool._warm_up_client(state, client, failed)
+                         for pool, state, client in self._fill()]
+        raise gen.Return(warm_up_report(start, sum(results), failed))
+
+    @gen.coroutine
+    def _warm_up_client(self, state, client, failed):
+        try:
+            yield client.connect()
+        except Exception as e:
+            failed[state.endpoint] = e
+            self._discard_client(state, client)
+            raise gen.Return(False)
+        self._endpoint_set.checkin(state, client)
+        self._cond.notify()
+        raise gen.Return(True)
 
     def __ensure_not_closing(self):
         if self._closing:
@@ -180,58 +350,253 @@ class TornadoClientPool(object):
         if self._closed:
             raise Unavailable('Closed')
 
-    def __ensure_not_exhuasted(self):
-        if self._exhausted():
-            raise ResourceLimit('No more available client')
+    @gen.coroutine
+    def execute(self, qdb_proto, used=None):
+        # the states of the endpoints sent to are appended to `used`,
+        # nothing for cached and coalesced responses
+        if self._cache is not None and self._cache.get(qdb_proto):
+            raise gen.Return(qdb_proto)
+        if not self._coalesce:
+            r = yield self._execute_one(qdb_proto, used)
+            raise gen.Return(r)
+
+        key = proto_key(qdb_proto)
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            yield flight.waiter.wait()
+            if flight.error is not None:
+                raise flight.error
+            raise gen.Return(fill_proto(qdb_proto, flight.value))
+
+        flight = self._flights[key] = Flight(Event())
+        try:
+            r = yield self._execute_one(qdb_proto, used)
+            flight.value = r.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._flights.pop(key, None)
+            flight.waiter.set()
+        raise gen.Return(r)
+
+    def _route(self, qdb_proto):
+        if self._router is None:
+            return self
+        return self._shards[self._router.route(qdb_proto.key)]
+
+    def _group_by_route(self, qdb_protos):
+        if self._router is None:
+            return [(self, qdb_protos)]
+        groups = {}
+        for qdb_proto in qdb_protos:
+            groups.setdefault(self._router.route(qdb_proto.key), []).append(qdb_proto)
+        return [(self._shards[idx], protos) for idx, protos in groups.items()]
 
     @gen.coroutine
-    def execute(self, qdb_proto):
-        while True:
-            self.__ensure_not_closed()
-            self.__ensure_not_closing()
-            self.__ensure_not_exhuasted()
-            if not self._started:
-                try:
-                    yield self._create_client()
-                except:
-                    continue
-                finally:
-                    self._started = True
+    def _throttle(self, bucket, count=1):
+        delay = bucket.reserve(count)
+        if delay > 0:
+            yield gen.sleep(delay)
+
+    @gen.coroutine
+    def _execute_one(self, qdb_proto, used=None):
+        if self._bucket is not None:
+            yield self._throttle(self._bucket)
+        pool = self._route(qdb_proto)
+        if self._hedger is None:
+            r = yield pool._execute(lambda client: client.execute(qdb_proto),
+                                    used=used)
+        else:
+            r = yield self._hedged_execute(pool, qdb_proto, used)
+        if self._cache is not None:
+            self._cache.set(r)
+        raise gen.Return(r)
+
+    @gen.coroutine
+    def _hedged_execute(self, pool, qdb_proto, used=None):
+        hedger = self._hedger
+        protos = [copy_proto(qdb_proto), copy_proto(qdb_proto)]
+        if used is None:
+            used = []
+        start = time.time()
+        attempts = [pool._execute(lambda client: client.execute(protos[0]),
+                                  used=used)]
+        delay = hedger.delay()
+        if delay is not None:
+            try:
+                yield gen.with_timeout(timedelta(seconds=delay), attempts[0],
+                                       quiet_exceptions=(Exception,))
+            except TimeoutError:
+                if used and hedger.acquire():
+                    attempts.append(self._send_hedge(pool, protos[1], used[-1]))
+            except Exception:
+                pass
+        # the loser is left to finish, its exception is not interesting
+        for attempt in attempts:
+            attempt.add_done_callback(lambda f: f.exception())
+        error = None
+        waiter = gen.WaitIterator(*attempts)
+        while not waiter.done():
             try:
-                client = yield self._clients.get(timeout=timedelta(seconds=1))
-            except TimeoutError as e:
-                try:
-                    yield self._create_client()
-                except ResourceLimit:
-                    pass
+                yield waiter.next()
+            except Exception as e:
+                if error is None:
+                    error = e
                 continue
+            winner = waiter.current_index
+            hedger.record(time.time() - start, winner == 1)
+            raise gen.Return(fill_proto(qdb_proto, protos[winner].value))
+        raise error
+
+    @gen.coroutine
+    def _send_hedge(self, pool, qdb_proto, exclude):
+        used = []
+        try:
+            if self._bucket is not None:
+                yield self._throttle(self._bucket)
+            r = yield pool._execute(lambda client: client.execute(qdb_proto),
+                                    exclude=exclude, used=used)
+        except Exception:
+            # nothing was sent, the hedge is not counted
+            if not used:
+                self._hedger.refund()
+            raise
+        raise gen.Return(r)
 
+    @gen.coroutine
+    def execute_many(self, qdb_protos, batch_size=128, callback=None):
+        assert batch_size >= 1, 'batch_size must be positive'
+        qdb_protos = list(qdb_protos)
+        misses = qdb_protos
+        if self._cache is not None:
+            misses = []
+            for p in qdb_protos:
+                if not self._cache.get(p):
+                    misses.append(p)
+                elif callback is not None:
+                    callback(p)
+        duplicates = ()
+        if self._coalesce:
+            misses, duplicates = dedup_protos(misses)
+            self.coalesced += len(duplicates)
+        batches = deque([(pool, protos[i:i + batch_size])
+                         for pool, protos in self._group_by_route(misses)
+                         for i in range(0, len(protos), batch_size)])
+
+        @gen.coroutine
+        def _loop_execute():
+            while batches:
+                pool, batch = batches.popleft()
+                if self._bucket is not None:
+                    yield self._throttle(self._bucket, len(batch))
+                # a retry on another client resends only the unanswered
+                pending = deque(batch)
+                yield pool._execute(lambda client: client.execute_pending(pending),
+                                    len(batch))
+                for r in batch:
+                    if self._cache is not None:
+                        self._cache.set(r)
+                    if callback is not None:
+                        callback(r)
+
+        yield gen.multi([_loop_execute()
+                         for _ in range(0, min(len(batches), self._max_clients))])
+        for first, r in duplicates:
+            fill_proto(r, first.value)
+            if callback is not None:
+                callback(r)
+        raise gen.Return(qdb_protos)
+
+    @gen.coroutine
+    def _execute(self, func, count=1, exclude=None, used=None):
+        wait_start = None
+        while True:
+            if self._closed or self._closing:
+                self.__ensure_not_closed()
+                self.__ensure_not_closing()
+
+            state, client = self._endpoint_set.checkout(self._create_client,
+                                                        exclude, count)
+            if client is None:
+                if exclude is not None:
+                    raise ResourceLimit('No spare client')
+                if wait_start is None:
+                    wait_start = time.time()
+                wait = self._endpoint_set.wait_time(count=count)
+                yield self._cond.wait(timeout=timedelta(seconds=wait))
+                continue
+            if wait_start is not None:
+                self._metrics.record_queue_wait(time.time() - wait_start)
+                wait_start = None
+            if used is not None:
+                used.append(state)
+
+            start = time.time()
             try:
-                r = yield client.execute(qdb_proto)
-                yield self._clients.put(client)
+                r = yield func(client)
             except (RetryLimitExceeded, StreamClosedError,
                     TimeoutError, socket.gaierror) as e:
                 self._logger.warning(
                     'Not available, {} {}'.format(client.endpoint, e))
-                self._release_client(client)
+                self._discard_client(state, client)
                 continue
 
             except Exception as e:
                 self._logger.error(
                     'Unexpected error, {} {}'.format(client.endpoint, e))
-                self._release_client(client)
+                self._discard_client(state, client)
                 continue
-            finally:
-                self._clients.task_done()
 
+            self._endpoint_set.checkin(state, client, time.time() - start, count)
+            self._cond.notify()
             raise gen.Return(r)
 
-    def _release_client(self, client):
+    def _discard_client(self, state, client):
+        try:
+            if self._endpoint_set.discard(state, client):
+                self._on_eject(state)
+        finally:
+            self._cond.notify()
+
+    def _on_eject(self, state):
+        self._logger.warning('Eject {} after {} failures'.format(
+            state.endpoint, state.breaker.failures))
+        if self._prober is None and not (self._closing or self._closed):
+            self._prober = self._loop_probe()
+
+    @gen.coroutine
+    def _loop_probe(self):
+        # runs while any endpoint is ejected
+        while not (self._closing or self._closed):
+            yield gen.sleep(self._probe_interval / 2.0)
+            if not self._endpoint_set.ejected():
+                break
+            states = self._endpoint_set.probe_due()
+            if not states:
+                continue
+            results = yield [self._probe(state) for state in states]
+            for state, ok in zip(states, results):
+                self._endpoint_set.on_probe(state, ok)
+                if ok:
+                    self._logger.info('Readmit {}'.format(state.endpoint))
+            self._cond.notify_all()
+        self._prober = None
+
+    @gen.coroutine
+    def _probe(self, state):
+        kwargs = dict(self._kwargs, retry_max=0, metrics=None)
+        client = TornadoClient(state.address, state.port, **kwargs)
+        ok = True
         try:
-            if client:
-                client.close()
+            yield client.execute(probe_protocal())
+        except Exception as e:
+            self._logger.debug('Probe error {} {}'.format(state.endpoint, e))
+            ok = False
         finally:
-            self._clients_count -= 1
+            client.close()
+        raise gen.Return(ok)
 
     @gen.coroutine
     def close(self):
@@ -240,16 +605,13 @@ class TornadoClientPool(object):
                 return
 
             self._closing = True
-            with (yield self._create_lock.acquire()):
-                while self._clients_count > 0:
-                    try:
-                        client = yield self._clients.get(timeout=timedelta(seconds=0.1))
-                    except TimeoutError:
-                        continue
-
-                    try:
-                        self._release_client(client)
-                    finally:
-                        self._clients.task_done()
-                self._closed = True
+            while self._endpoint_set.clients_count > 0:
+                for state, client in list(self._endpoint_set.pop_idle()):
+                    self._endpoint_set.release(state, client)
+                if self._endpoint_set.clients_count > 0:
+                    yield self._cond.wait(timeout=timedelta(seconds=0.1))
+            yield [shard.close() for shard in self._shards]
+            if self._prober is not None:
+                yield self._prober
+            self._closed = True
             self._closing = False
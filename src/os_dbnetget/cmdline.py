@@ -12,7 +12,8 @@ from logging.config import dictConfig
 import os_dbnetget
 from os_dbnetget.commands import Command
 from os_dbnetget.exceptions import UsageError
-from os_dbnetget.utils import iter_classes, CustomArgumentParser
+from os_dbnetget.utils import (BatchStreamHandler, CustomArgumentParser,
+                               iter_classes, queue_logging, stop_queue_logging)
 
 _LOG_LEVELS = ['NOTSET', 'DEBUG', 'INFO', 'WARN', 'ERROR', 'FATAL']
 
@@ -28,15 +29,20 @@ def _config_logging(log_level):
     if log_level == 'NOTSET':
         handler = logging.NullHandler()
     else:
-        handler = logging.StreamHandler()
+        handler = BatchStreamHandler()
 
     formatter = logging.Formatter(
         fmt='[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S',
     )
-    logging.root.setLevel(logging.NOTSET)
-    handler.setFormatter(formatter)
-    handler.setLevel(log_level)
+    # records below the level are dropped before they are created
+    if log_level == 'NOTSET':
+        logging.root.setLevel(logging.CRITICAL + 1)
+    else:
+        logging.root.setLevel(log_level)
+        handler.setFormatter(formatter)
+        handler.setLevel(log_level)
+        handler = queue_logging(handler)
     logging.root.addHandler(handler)
 
 
@@ -181,6 +187,8 @@ def execute(argv=None):
     except UsageError as e:
         print('Error: %s' % str(e))
         sys.exit(2)
+    finally:
+        stop_queue_logging()
 
 
 if __name__ == '__main__':
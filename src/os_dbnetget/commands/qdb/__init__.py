@@ -1,13 +1,47 @@
 import argparse
+import logging
+from functools import partial
 
 from os_dbnetget.commands import Command
-from os_dbnetget.utils import binary_stdin
+from os_dbnetget.commands.qdb.compression import open_input
+from os_dbnetget.commands.qdb.processor import Processor
+from os_dbnetget.commands.qdb.progress import Progress
+from os_dbnetget.utils import (BatchStreamHandler, LRUCache, binary_stdin,
+                               check_range, queue_logging)
 from os_dbnetget.exceptions import UsageError
 from os_docid import docid
 
+_INVALID_KEY = object()
+
+key_cache = LRUCache(100000)
+
 
 def qdb_key(url_or_docid):
-    return docid(url_or_docid).bytes[16:]
+    q_key = key_cache.get(url_or_docid)
+    if q_key is None:
+        try:
+            q_key = docid(url_or_docid).bytes[16:]
+        except NotImplementedError:
+            q_key = _INVALID_KEY
+        key_cache.set(url_or_docid, q_key)
+    if q_key is _INVALID_KEY:
+        raise NotImplementedError
+    return q_key
+
+
+def qdb_keys(lines):
+    keys = {}
+    q_keys = []
+    for line in lines:
+        q_key = keys.get(line, _INVALID_KEY)
+        if q_key is _INVALID_KEY:
+            try:
+                q_key = qdb_key(line)
+            except NotImplementedError:
+                q_key = None
+            keys[line] = q_key
+        q_keys.append(q_key)
+    return q_keys
 
 
 class QDB(Command):
@@ -15,11 +49,14 @@ class QDB(Command):
     def __init__(self, config=None):
         super(QDB, self).__init__(config)
         self._runner = None
+        self.config.progress = Progress()
+        self._logger = logging.getLogger(self.__class__.__name__)
 
     def add_arguments(self, parser):
         super(QDB, self).add_arguments(parser)
         parser.add_argument('-i', '--inputs',
-                            help='input files to be processed (default: stdin)',
+                            help='input files to be processed, gzip, bz2, xz, \
+                            zstd and lz4 files are decompressed (default: stdin)',
                             nargs='+',
                             type=argparse.FileType('rb'),
                             default=[binary_stdin],
@@ -33,30 +70,77 @@ class QDB(Command):
                             )
 
         parser.add_argument('-L', '--endpoints-list-file',
-                            help='qdb endpoints(host:ip) list file, one endpoint per line, \
+                            help='qdb endpoints(host:ip) list file, one shard per line, \
+                            comma-separated replicas of a shard in one line, \
                             can be overridden by \'-E\' argument',
                             nargs='?',
                             type=argparse.FileType('rb'),
                             dest='endpoints_list',
                             )
+
+        parser.add_argument('--key-cache-size',
+                            help='qdb key cache size, 0 to disable (0-10000000 default: 100000)',
+                            type=partial(check_range, int, 0, 10000000),
+                            default=100000,
+                            dest='key_cache_size',
+                            )
+
+        parser.add_argument('--output-buffer-size',
+                            help='output buffer size in KB, 0 to write every record (0-1048576 default: 1024)',
+                            type=partial(check_range, int, 0, 1048576),
+                            default=1024,
+                            dest='output_buffer_size',
+                            )
+
+        parser.add_argument('--output-flush-interval',
+                            help='max seconds between output flushes (0-3600 default: 1.0)',
+                            type=partial(check_range, float, 0, 3600),
+                            default=1.0,
+                            dest='output_flush_interval',
+                            )
+
+        parser.add_argument('--status-file',
+                            help='write per-key status to this file instead of the log',
+                            nargs='?',
+                            dest='status_file',
+                            )
         self._runner.add_arguments(parser)
 
     def process_arguments(self, args):
         super(QDB, self).process_arguments(args)
         if not (args.endpoints or args.endpoints_list):
             raise UsageError('No endpoints, add \'-E\' or \'-L\' argument')
-        endpoints = None
+        shards = None
         if args.endpoints:
-            endpoints = tuple([e.strip()
-                               for e in args.endpoints.split(',') if e.strip()])
+            shards = [(e.strip(),)
+                      for e in args.endpoints.split(',') if e.strip()]
         else:
-            endpoints = tuple([e.strip()
-                               for e in args.endpoints_list if e.strip()])
+            shards = [tuple([e.strip() for e in line.split(b',') if e.strip()])
+                      for line in args.endpoints_list if line.strip()]
+        endpoints = tuple([e for shard in shards for e in shard])
         if not endpoints:
             raise UsageError('No endpoints, check your arguments')
 
+        args.inputs = [open_input(f) for f in args.inputs]
+        self.config.shards = tuple(shards)
         self.config.endpoints = endpoints
+        key_cache.resize(args.key_cache_size)
+        if args.status_file:
+            self._config_status_logging(args.status_file)
         self._runner.process_arguments(args)
 
+    def _config_status_logging(self, status_file):
+        handler = BatchStreamHandler(open(status_file, 'a'))
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler.setLevel(logging.INFO)
+        logger = logging.getLogger(Processor.__name__)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(queue_logging(handler))
+
     def run(self, args):
-        self._runner.run(args)
+        try:
+            self._runner.run(args)
+        finally:
+            self._logger.debug('Key cache hits {}, misses {}'.format(
+                key_cache.hits, key_cache.misses))
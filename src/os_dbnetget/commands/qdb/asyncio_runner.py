@@ -0,0 +1,124 @@
+import asyncio
+from functools import partial
+
+from os_qdb_protocal import create_protocal
+
+from os_dbnetget.clients.asyncio_client import AsyncioClientPool
+from os_dbnetget.commands.qdb import qdb_key
+from os_dbnetget.commands.qdb.default_runner import DefaultRunner
+from os_dbnetget.commands.qdb.inputs import iter_lines
+from os_dbnetget.utils import check_range
+
+
+class AsyncioRunner(DefaultRunner):
+    HEDGING = True
+
+    def __init__(self, config):
+        super(AsyncioRunner, self).__init__(config)
+        self._loop = None
+        self._queue = None
+
+    def add_arguments(self, parser):
+        super(AsyncioRunner, self).add_arguments(parser)
+        parser.add_argument('--concurrency',
+                            help='concurrency (1-10000 default: 10)',
+                            type=partial(check_range, int, 1, 10000),
+                            default=10,
+                            dest='concurrency',
+                            )
+        try:
+            import uvloop
+            parser.add_argument('--loop',
+                                help='event loop (default: asyncio)',
+                                choices=('asyncio', 'uvloop'),
+                                default='asyncio',
+                                dest='loop',
+                                )
+        except:
+            pass
+
+    def process_arguments(self, args):
+        self.config.inputs = args.inputs
+        self.config.concurrency = args.concurrency
+        if getattr(args, 'loop', 'asyncio') == 'uvloop':
+            import uvloop
+            self._loop = uvloop.new_event_loop()
+        else:
+            self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._client = AsyncioClientPool(self.config.endpoints,
+                                         **self._client_kwargs(args))
+        self._queue = asyncio.Queue(maxsize=args.concurrency * 3)
+
+    def _default_connections(self, args):
+        return args.concurrency
+
+    async def _loop_read(self):
+        for line in iter_lines(self.config.inputs):
+            if self._stop:
+                break
+            self.config.progress.lines += 1
+            await self._queue.put(line)
+        for _ in range(0, self.config.concurrency):
+            await self._queue.put(None)
+
+    async def _process(self, data):
+        try:
+            q_key = qdb_key(data)
+        except NotImplementedError:
+            self.config.processor.process(data, None)
+            return
+
+        proto = create_protocal(self.config.cmd, q_key)
+        p = await self._client.execute(proto)
+        self.config.processor.process(data, p)
+
+    async def _run(self, args):
+        try:
+            if args.warm_up:
+                self._log_warm_up(await self._client.warm_up())
+            reader = asyncio.ensure_future(self._loop_read())
+            await asyncio.gather(*[self._loop_process(args)
+                                   for _ in range(0, self.config.concurrency)])
+            reader.cancel()
+        except Exception as e:
+            self._logger.error('Error {}'.format(e))
+        finally:
+            await self._close()
+
+    async def _loop_process(self, args):
+        while True:
+            if self._stop and self._queue.qsize() <= 0:
+                break
+            try:
+                data = await asyncio.wait_for(self._queue.get(), 0.1)
+            except asyncio.TimeoutError:
+                continue
+            try:
+                if data is None:
+                    break
+                await self._process(data)
+            finally:
+                self._queue.task_done()
+
+    async def _close(self):
+        try:
+            await self._client.close()
+        except:
+            pass
+
+    def _queue_depth(self):
+        return self._queue.qsize()
+
+    def _on_stop(self, signum, frame):
+        self._stop = True
+
+    def run(self, args):
+        self._register_signal()
+        self._start_progress(args)
+        self._start_metrics(args)
+        try:
+            self._loop.run_until_complete(self._run(args))
+        finally:
+            self._loop.close()
+            self._log_stats()
@@ -0,0 +1,229 @@
+import bz2
+import gzip
+import threading
+from collections import namedtuple
+
+from os_dbnetget.commands.qdb.inputs import regular_fd
+from os_dbnetget.utils import Queue
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _zstd_reader(f):
+    # appended outputs are a series of frames
+    return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+
+
+def _zstd_writer(path, mode):
+    return zstandard.ZstdCompressor().stream_writer(open(path, mode))
+
+
+# reader wraps a binary file, writer opens a path, appending to a
+# compressed file adds a stream all the formats read on
+Compression = namedtuple('Compression', 'name magic extensions reader writer')
+
+COMPRESSIONS = [
+    Compression('gzip', b'\x1f\x8b', ('.gz',),
+                lambda f: gzip.GzipFile(fileobj=f, mode='rb'), gzip.open),
+    Compression('bz2', b'BZh', ('.bz2',), bz2.BZ2File, bz2.BZ2File),
+]
+if lzma is not None:
+    COMPRESSIONS.append(Compression('xz', b'\xfd7zXZ\x00', ('.xz', '.lzma'),
+                                    lzma.LZMAFile, lzma.LZMAFile))
+if zstandard is not None:
+    COMPRESSIONS.append(Compression('zstd', b'\x28\xb5\x2f\xfd', ('.zst', '.zstd'),
+                                    _zstd_reader, _zstd_writer))
+if lz4 is not None:
+    COMPRESSIONS.append(Compression('lz4', b'\x04\x22\x4d\x18', ('.lz4',),
+                                    lz4.frame.LZ4FrameFile, lz4.frame.LZ4FrameFile))
+
+
+def detect_compression(f):
+    # the magic of a buffered binary file, it is not consumed
+    peek = getattr(f, 'peek', None)
+    if peek is None:
+        return None
+    head = peek(8)
+    for c in COMPRESSIONS:
+        if head.startswith(c.magic):
+            return c
+    return None
+
+
+def _open_input(f):
+    c = detect_compression(f)
+    if c is None:
+        return f
+    return ThreadedReader(c.reader(f), name=getattr(f, 'name', None))
+
+
+def open_input(f):
+    # peeking at a pipe blocks until the writer sends something, it is
+    # left to the first read
+    if regular_fd(f) is None and hasattr(f, 'peek'):
+        return LazyReader(f)
+    return _open_input(f)
+
+
+class LazyReader(object):
+
+    def __init__(self, f):
+        self.name = getattr(f, 'name', None)
+        self._raw = f
+        self._reader = None
+
+    def _open(self):
+        if self._reader is None:
+            self._reader = _open_input(self._raw)
+        return self._reader
+
+    def read1(self, size=-1):
+        return self._open().read1(size)
+
+    def read(self, size=-1):
+        return self._open().read(size)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+        else:
+            self._raw.close()
+
+
+def open_output(path, mode='ab'):
+    for c in COMPRESSIONS:
+        if path.endswith(c.extensions):
+            return ThreadedWriter(c.writer(path, mode))
+    return open(path, mode)
+
+
+class ThreadedReader(object):
+    # decompresses ahead in a background thread, most decompressors
+    # release the GIL while they work
+
+    def __init__(self, raw, chunk_size=CHUNK_SIZE, depth=4, name=None):
+        assert chunk_size > 0, 'chunk_size must be positive'
+        self.name = name
+        self._raw = raw
+        self._chunk_size = chunk_size
+        self._queue = Queue.Queue(depth)
+        self._buffer = b''
+        self._eof = False
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._closed:
+                data = self._raw.read(self._chunk_size)
+                self._queue.put(data)
+                if not data:
+                    return
+        except Exception as e:
+            self._error = e
+            self._queue.put(b'')
+
+    def read1(self, size=-1):
+        if not self._buffer and not self._eof:
+            self._buffer = self._queue.get()
+            if not self._buffer:
+                self._eof = True
+                if self._error is not None:
+                    raise self._error
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(self.read1, b''))
+        chunks = []
+        while size > 0:
+            data = self.read1(size)
+            if not data:
+                break
+            chunks.append(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def close(self):
+        self._closed = True
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.01)
+            except Queue.Empty:
+                pass
+        self._raw.close()
+
+
+_FLUSH = object()
+
+
+class ThreadedWriter(object):
+    # compresses and writes in a background thread, errors are raised by
+    # the next call
+
+    def __init__(self, raw, depth=16):
+        self._raw = raw
+        self._queue = Queue.Queue(depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if item is _FLUSH:
+                    self._raw.flush()
+                elif self._error is None:
+                    self._raw.write(item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, data):
+        self._check()
+        self._queue.put(data)
+
+    def flush(self):
+        self._queue.put(_FLUSH)
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        try:
+            if self._thread.is_alive():
+                self.flush()
+        finally:
+            if self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+            self._raw.close()
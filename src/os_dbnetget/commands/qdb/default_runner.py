@@ -1,23 +1,35 @@
 import logging
 import signal
 from functools import partial
-from itertools import chain
 
 from os_qdb_protocal import create_protocal
 
+from os_dbnetget.clients.balancing import BALANCERS
+from os_dbnetget.clients.cache import ResponseCache
+from os_dbnetget.clients.hedging import Hedger
+from os_dbnetget.clients.metrics import MetricsReporter, PrometheusExporter
+from os_dbnetget.clients.routing import ROUTERS, ConsistentHashRouter
 from os_dbnetget.clients.sync_client import SyncClientPool
 from os_dbnetget.commands import Command
-from os_dbnetget.commands.qdb import qdb_key
+from os_dbnetget.commands.qdb import qdb_keys
+from os_dbnetget.commands.qdb.inputs import iter_batches
+from os_dbnetget.commands.qdb.progress import ProgressReporter
+from os_dbnetget.exceptions import UsageError
 from os_dbnetget.utils import check_range
 
 
 class DefaultRunner(Command):
+    # engines sending single requests can hedge them
+    HEDGING = False
 
     def __init__(self, config):
         self.config = config
         self._client = None
+        self._reporter = None
+        self._progress_reporter = None
         self._logger = logging.getLogger(self.__class__.__name__)
         self._stop = False
+        self._batch_size = 128
 
     def add_arguments(self, parser):
 
@@ -28,23 +40,245 @@ class DefaultRunner(Command):
                             dest='client_retry_max',
                             )
         parser.add_argument('--client-retry-interval',
-                            help='client retry interval seconds (0-60 default: 5)',
+                            help='client retry interval seconds, doubled with jitter on \
+                            consecutive failures (0-60 default: 5)',
                             type=partial(check_range, float, 0, 60),
                             default=5,
                             dest='client_retry_interval',
                             )
+        parser.add_argument('--client-retry-max-interval',
+                            help='client retry interval upper bound seconds (0-3600 default: 60)',
+                            type=partial(check_range, float, 0, 3600),
+                            default=60,
+                            dest='client_retry_max_interval',
+                            )
         parser.add_argument('--client-timeout',
                             help='client timeout seconds (1-60 default: 10)',
                             type=partial(check_range, float, 1, 60),
                             default=10,
                             dest='client_timeout',
                             )
+        parser.add_argument('--cache-size',
+                            help='response cache size, 0 to disable (0-10000000 default: 0)',
+                            type=partial(check_range, int, 0, 10000000),
+                            default=0,
+                            dest='cache_size',
+                            )
+        parser.add_argument('--cache-ttl',
+                            help='response cache ttl seconds (1-86400 default: 300)',
+                            type=partial(check_range, float, 1, 86400),
+                            default=300,
+                            dest='cache_ttl',
+                            )
+        parser.add_argument('--cache-negative-ttl',
+                            help='test not exist response cache ttl seconds, 0 to disable (0-86400 default: 60)',
+                            type=partial(check_range, float, 0, 86400),
+                            default=60,
+                            dest='cache_negative_ttl',
+                            )
+        parser.add_argument('--cache-memory',
+                            help='response cache memory budget MB (1-102400 default: 256)',
+                            type=partial(check_range, float, 1, 102400),
+                            default=256,
+                            dest='cache_memory',
+                            )
+        parser.add_argument('--routing',
+                            help='route keys to endpoints, \'random\' for any endpoint, \
+                            \'consistent-hash\' for a hash ring of shards, \
+                            \'shard-map\' for key hash modulo shards (default: random)',
+                            choices=('random',) + tuple(sorted(ROUTERS.keys())),
+                            default='random',
+                            dest='routing',
+                            )
+        parser.add_argument('--virtual-nodes',
+                            help='virtual nodes per shard of consistent-hash routing (1-1000 default: 160)',
+                            type=partial(check_range, int, 1, 1000),
+                            default=160,
+                            dest='virtual_nodes',
+                            )
+        parser.add_argument('--balancer',
+                            help='load balancing policy across endpoints, \
+                            \'least-outstanding\' and \'p2c\'(power of two choices) \
+                            prefer fast and idle endpoints (default: random)',
+                            choices=tuple(sorted(BALANCERS.keys())),
+                            default='random',
+                            dest='balancer',
+                            )
+        parser.add_argument('--no-coalesce',
+                            help='do not share one request between duplicate in-flight keys',
+                            action='store_false',
+                            dest='coalesce',
+                            )
+
+        parser.add_argument('--max-connections',
+                            help='max connections of each endpoint, more are opened while \
+                            requests wait for one (1-1000 default: 1, the concurrency \
+                            or thread num of the tornado, asyncio and m3 engines)',
+                            type=partial(check_range, int, 1, 1000),
+                            dest='max_connections',
+                            )
+        parser.add_argument('--min-connections',
+                            help='connections of each endpoint kept open when idle (0-1000 default: 1)',
+                            type=partial(check_range, int, 0, 1000),
+                            default=1,
+                            dest='min_connections',
+                            )
+        parser.add_argument('--idle-timeout',
+                            help='seconds a connection above --min-connections can stay unused, \
+                            0 to keep them all (0-86400 default: 60)',
+                            type=partial(check_range, float, 0, 86400),
+                            default=60,
+                            dest='idle_timeout',
+                            )
+        parser.add_argument('--warm-up',
+                            help='connect all the clients before the first request',
+                            action='store_true',
+                            dest='warm_up',
+                            )
+
+        parser.add_argument('--breaker-threshold',
+                            help='consecutive failures to eject an endpoint (1-100 default: 3)',
+                            type=partial(check_range, int, 1, 100),
+                            default=3,
+                            dest='breaker_threshold',
+                            )
+        parser.add_argument('--probe-interval',
+                            help='seconds between health probes of ejected endpoints (0.1-600 default: 1)',
+                            type=partial(check_range, float, 0.1, 600),
+                            default=1,
+                            dest='probe_interval',
+                            )
+        parser.add_argument('--max-qps',
+                            help='max requests per second of all endpoints, 0 for unlimited (0-10000000 default: 0)',
+                            type=partial(check_range, float, 0, 10000000),
+                            default=0,
+                            dest='max_qps',
+                            )
+        parser.add_argument('--max-qps-per-endpoint',
+                            help='max requests per second of each endpoint, 0 for unlimited (0-10000000 default: 0)',
+                            type=partial(check_range, float, 0, 10000000),
+                            default=0,
+                            dest='max_qps_per_endpoint',
+                            )
+        parser.add_argument('--qps-burst',
+                            help='seconds of max qps allowed to burst (0-60 default: 1)',
+                            type=partial(check_range, float, 0, 60),
+                            default=1,
+                            dest='qps_burst',
+                            )
+
+        if self.HEDGING:
+            parser.add_argument('--hedge',
+                                help='send a slow request again to another endpoint, the first reply wins',
+                                action='store_true',
+                                dest='hedge',
+                                )
+            parser.add_argument('--hedge-delay',
+                                help='hedge requests not finished in this many seconds, \
+                                0 for the --hedge-percentile latency (0-60 default: 0)',
+                                type=partial(check_range, float, 0, 60),
+                                default=0,
+                                dest='hedge_delay',
+                                )
+            parser.add_argument('--hedge-percentile',
+                                help='latency percentile of the last 1000 requests to hedge after (50-99.9 default: 95)',
+                                type=partial(check_range, float, 50, 99.9),
+                                default=95,
+                                dest='hedge_percentile',
+                                )
+            parser.add_argument('--hedge-budget',
+                                help='max hedged requests in percent of all requests (0.1-100 default: 5)',
+                                type=partial(check_range, float, 0.1, 100),
+                                default=5,
+                                dest='hedge_budget',
+                                )
+
+        parser.add_argument('--metrics-interval',
+                            help='seconds between client metrics dumps, 0 to disable (0-86400 default: 0)',
+                            type=partial(check_range, float, 0, 86400),
+                            default=0,
+                            dest='metrics_interval',
+                            )
+
+        parser.add_argument('--metrics-file',
+                            help='write client metrics to this prometheus text file instead of the log',
+                            nargs='?',
+                            dest='metrics_file',
+                            )
+
+        parser.add_argument('--progress-interval',
+                            help='seconds between progress reports to stderr, 0 to disable, \
+                            only the final one with --progress-file (0-86400 default: 0)',
+                            type=partial(check_range, float, 0, 86400),
+                            default=0,
+                            dest='progress_interval',
+                            )
+
+        parser.add_argument('--progress-file',
+                            help='append progress reports to this file as json lines (default: stderr)',
+                            nargs='?',
+                            dest='progress_file',
+                            )
+
+    def _client_kwargs(self, args):
+        cache = None
+        if args.cache_size > 0:
+            cache = ResponseCache(maxsize=args.cache_size,
+                                  ttl=args.cache_ttl,
+                                  negative_ttl=args.cache_negative_ttl,
+                                  max_memory=int(args.cache_memory * 1024 * 1024))
+        router = None
+        if args.routing == 'consistent-hash':
+            router = ConsistentHashRouter(self.config.shards,
+                                          vnodes=args.virtual_nodes)
+        elif args.routing != 'random':
+            router = ROUTERS[args.routing](self.config.shards)
+        max_connections = args.max_connections
+        min_connections = args.min_connections
+        if max_connections is None:
+            max_connections = self._default_connections(args)
+            min_connections = min(min_connections, max_connections)
+        elif min_connections > max_connections:
+            raise UsageError('--min-connections is greater than --max-connections')
+        hedger = None
+        if self.HEDGING and args.hedge:
+            hedger = Hedger(delay=args.hedge_delay or None,
+                            percentile=args.hedge_percentile,
+                            budget=args.hedge_budget)
+        return dict(timeout=args.client_timeout,
+                    retry_max=args.client_retry_max,
+                    retry_interval=args.client_retry_interval,
+                    retry_max_interval=args.client_retry_max_interval,
+                    cache=cache,
+                    coalesce=args.coalesce,
+                    router=router,
+                    balancer=BALANCERS[args.balancer](),
+                    max_qps=args.max_qps,
+                    max_qps_per_endpoint=args.max_qps_per_endpoint,
+                    qps_burst=args.qps_burst,
+                    breaker_threshold=args.breaker_threshold,
+                    probe_interval=args.probe_interval,
+                    hedger=hedger,
+                    max_concurrency=max_connections,
+                    min_concurrency=min_connections,
+                    idle_timeout=args.idle_timeout or None)
+
+    def _default_connections(self, args):
+        return 1
 
     def process_arguments(self, args):
         self._client = SyncClientPool(self.config.endpoints,
-                                      timeout=args.client_timeout,
-                                      retry_max=args.client_retry_max,
-                                      retry_interval=args.client_retry_interval)
+                                      **self._client_kwargs(args))
+
+    def _warm_up(self, args):
+        if args.warm_up and self._client is not None:
+            self._log_warm_up(self._client.warm_up())
+
+    def _log_warm_up(self, report):
+        self._logger.info('Warm up {} clients in {:.3f}s'.format(
+            report['connected'], report['elapsed']))
+        for endpoint, error in sorted(report['failed'].items()):
+            self._logger.warning('Warm up failed {} {}'.format(endpoint, error))
 
     def _close(self):
         self._stop = True
@@ -62,24 +296,82 @@ class DefaultRunner(Command):
             signal.signal(sig, self._on_stop)
 
     def _run(self, args):
-        for line in chain.from_iterable(args.inputs):
+        for batch in iter_batches(args.inputs, self._batch_size):
             if self._stop:
                 break
-            data = line.strip()
-            try:
-                q_key = qdb_key(data)
-            except NotImplementedError:
-                self.config.processor.process(data, None)
-                continue
-            proto = create_protocal(self.config.cmd, q_key)
-            p = self._client.execute(proto)
-            self.config.processor.process(data, p)
+            self.config.progress.lines += len(batch)
+            self._process_batch(batch)
+
+    def _process_batch(self, batch):
+        protos = [create_protocal(self.config.cmd, q_key)
+                  if q_key is not None else None
+                  for q_key in qdb_keys(batch)]
+        results = self._client.execute_many(
+            [p for p in protos if p is not None], self._batch_size)
+        for data, proto in zip(batch, protos):
+            if proto is not None:
+                proto = next(results)
+            self.config.processor.process(data, proto)
+
+    def _metrics_file(self, args):
+        return args.metrics_file
+
+    def _start_metrics(self, args):
+        metrics_file = self._metrics_file(args)
+        if self._client is None or \
+                (args.metrics_interval <= 0 and not metrics_file):
+            return
+        exporter = None
+        if metrics_file:
+            exporter = PrometheusExporter(metrics_file)
+        self._reporter = MetricsReporter(self._client.stats,
+                                         args.metrics_interval or None,
+                                         exporter)
+        self._reporter.start()
+
+    def _queue_depth(self):
+        return 0
+
+    def _concurrency(self):
+        return None
+
+    def _start_progress(self, args):
+        if args.progress_interval <= 0 and not args.progress_file:
+            return
+        self._progress_reporter = ProgressReporter(self.config.progress,
+                                                   args.progress_interval or None,
+                                                   self._queue_depth,
+                                                   args.progress_file,
+                                                   self._concurrency)
+        self._progress_reporter.start()
+
+    def _log_stats(self):
+        if self._progress_reporter is not None:
+            self._progress_reporter.stop()
+        if self._reporter is not None:
+            self._reporter.stop()
+        if self._client is not None:
+            self._logger.debug('Coalesced {} requests'.format(
+                self._client.coalesced))
+            stats = self._client.stats()
+            queue_wait = stats['queue_wait']
+            if queue_wait['count'] > 0:
+                self._logger.debug('Waited for a connection {count} times, '
+                                   'mean {mean:.6f}s, p99 {p99:.6f}s'.format(**queue_wait))
+            hedge = stats.get('hedge')
+            if hedge is not None:
+                self._logger.debug('Hedged {sent} of {requests} requests, '
+                                   '{won} won'.format(**hedge))
 
     def run(self, args):
         self._register_signal()
+        self._start_progress(args)
+        self._start_metrics(args)
         try:
+            self._warm_up(args)
             self._run(args)
         except Exception as e:
             self._logger.error('Error {}'.format(e))
         finally:
             self._close()
+            self._log_stats()
@@ -1,5 +1,7 @@
 from os_dbnetget.utils import binary_stdout
 from os_dbnetget.commands.qdb import QDB
+from os_dbnetget.commands.qdb.compression import open_output
+from os_dbnetget.commands.qdb.output import OutputWriter
 from os_dbnetget.commands.qdb.get.processor import Processor
 
 
@@ -22,18 +24,21 @@ class Get(QDB):
             output = binary_stdout
         else:
             if not hasattr(args, 'output_type'):
-                output = open(args.output, 'ab')
+                output = open_output(args.output, 'ab')
             elif args.output_type == 'single':
-                output = open(args.output, 'ab')
+                output = open_output(args.output, 'ab')
             elif args.output_type == 'rotate':
                 from os_rotatefile import open_file
                 output = open_file(args.output, 'w')
-        self.config.output = output
+        self.config.output = OutputWriter(output,
+                                          args.output_buffer_size * 1024,
+                                          args.output_flush_interval)
 
     def add_arguments(self, parser):
         super(Get, self).add_arguments(parser)
         parser.add_argument('-o', '--output',
-                            help='output file (default: stdout)',
+                            help='output file, compressed by its extension \
+                            .gz .bz2 .xz .zst or .lz4 (default: stdout)',
                             nargs='?',
                             dest='output',
                             )
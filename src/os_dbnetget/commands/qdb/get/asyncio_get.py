@@ -0,0 +1,10 @@
+from os_dbnetget.commands.qdb.asyncio_runner import AsyncioRunner
+from os_dbnetget.commands.qdb.get import Get as GetCommand
+
+
+class Get(GetCommand):
+    ENGINE_NAME = 'asyncio'
+
+    def __init__(self, config=None):
+        super(Get, self).__init__(config)
+        self._runner = AsyncioRunner(self.config)
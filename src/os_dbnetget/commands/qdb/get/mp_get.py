@@ -0,0 +1,10 @@
+from os_dbnetget.commands.qdb.get import Get as GetCommand
+from os_dbnetget.commands.qdb.mp_runner import MPRunner
+
+
+class Get(GetCommand):
+    ENGINE_NAME = 'mp'
+
+    def __init__(self, config=None):
+        super(Get, self).__init__(config)
+        self._runner = MPRunner(self.config)
@@ -1,4 +1,3 @@
-import logging
 from os_dbnetget.commands.qdb.processor import Processor as BaseProcessor
 
 
@@ -11,6 +10,6 @@ class Processor(BaseProcessor):
         if status != 'E':
             if proto.value:
                 status = 'Y'
-                self.config.output.write(proto.value)
-                self.config.output.write(b'\n')
-        self._logger.info('%s\t%s' % (data, status))
+                self.config.output.writelines((proto.value, b'\n'))
+        self.config.progress.record(status)
+        self._log_status(data, status)
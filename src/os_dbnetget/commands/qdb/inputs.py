@@ -0,0 +1,116 @@
+import mmap
+import os
+import stat
+from itertools import chain
+
+# bytes split into lines at a time
+CHUNK_SIZE = 4 * 1024 * 1024
+WHITESPACE = (b' ', b'\t', b'\r', b'\x0b', b'\x0c')
+
+
+def split_lines(data):
+    # one split per chunk, lines are only stripped one by one when the
+    # chunk has whitespace other than newlines
+    lines = data.split(b'\n')
+    for c in WHITESPACE:
+        if c in data:
+            return [line.strip() for line in lines]
+    return lines
+
+
+def regular_fd(f):
+    try:
+        fd = f.fileno()
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            return fd
+    except Exception:
+        pass
+    return None
+
+
+def read_chunks(f, start=0, end=None, chunk_size=CHUNK_SIZE):
+    # yields lists of stripped lines, a line belongs to the range its
+    # first byte is in, so adjacent ranges read every line exactly once
+    assert chunk_size > 0, 'chunk_size must be positive'
+    fd = regular_fd(f)
+    if fd is None:
+        assert start == 0 and end is None, 'only regular files can be read by range'
+        return _read_stream(f, chunk_size)
+    return _read_mmap(fd, start, end, chunk_size)
+
+
+def _read_stream(f, chunk_size):
+    # read1 returns what is available, a slow pipe is not waited for
+    read = getattr(f, 'read1', f.read)
+    rest = b''
+    while True:
+        data = read(chunk_size)
+        if not data:
+            break
+        cut = data.rfind(b'\n')
+        if cut < 0:
+            rest += data
+            continue
+        yield split_lines(rest + data[:cut])
+        rest = data[cut + 1:]
+    if rest:
+        yield split_lines(rest)
+
+
+def _read_mmap(fd, start, end, chunk_size):
+    size = os.fstat(fd).st_size
+    end = size if end is None else min(end, size)
+    if start >= end:
+        return
+    mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    try:
+        pos = start
+        if pos > 0:
+            # the line crossing start belongs to the previous range
+            pos = mm.find(b'\n', pos - 1) + 1
+            if pos <= 0:
+                return
+        while pos < end:
+            cut = mm.find(b'\n', min(pos + chunk_size, end) - 1)
+            if cut < 0:
+                cut = size
+            lines = split_lines(mm[pos:cut])
+            pos = cut + 1
+            yield lines
+    finally:
+        mm.close()
+
+
+def iter_lines(inputs, chunk_size=CHUNK_SIZE):
+    return chain.from_iterable(chain.from_iterable(
+        read_chunks(f, chunk_size=chunk_size) for f in inputs))
+
+
+def split_batches(chunks, batch_size):
+    # a batch never waits for the next chunk, the lines a slow stream has
+    # delivered go out at once
+    assert batch_size > 0, 'batch_size must be positive'
+    for lines in chunks:
+        for i in range(0, len(lines), batch_size):
+            yield lines[i:i + batch_size]
+
+
+def iter_batches(inputs, batch_size, chunk_size=CHUNK_SIZE):
+    return split_batches(chain.from_iterable(
+        read_chunks(f, chunk_size=chunk_size) for f in inputs), batch_size)
+
+
+def split_ranges(inputs, parts):
+    # (file, start, end) ranges of the inputs for each of parts readers,
+    # None when an input is not a regular file. Reading by range does not
+    # move the file position, forked workers can share the files
+    assert parts > 0, 'parts must be positive'
+    ranges = [[] for _ in range(parts)]
+    for f in inputs:
+        fd = regular_fd(f)
+        if fd is None:
+            return None
+        size = os.fstat(fd).st_size
+        for i in range(parts):
+            ranges[i].append((f, size * i // parts, size * (i + 1) // parts))
+    return ranges
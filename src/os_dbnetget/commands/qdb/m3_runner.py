@@ -1,6 +1,5 @@
 import logging
 from functools import partial
-from itertools import chain
 
 from os_m3_engine.core.backend import Backend
 from os_m3_engine.core.frontend import Frontend
@@ -11,13 +10,14 @@ from os_qdb_protocal import create_protocal
 from os_dbnetget.clients.sync_client import SyncClientPool
 from os_dbnetget.commands.qdb import qdb_key
 from os_dbnetget.commands.qdb.default_runner import DefaultRunner
+from os_dbnetget.commands.qdb.inputs import iter_lines
 from os_dbnetget.utils import Config, check_range
 
 
 class InputsFrontend(Frontend):
     def produce(self):
-        for line in chain.from_iterable(self.config.inputs):
-            line = line.strip()
+        for line in iter_lines(self.config.inputs):
+            self.config.progress.lines += 1
             yield line
 
 
@@ -42,6 +42,7 @@ class StoreBackend(Backend):
 
 
 class M3Runner(DefaultRunner):
+    HEDGING = True
 
     def __init__(self, config):
         super(M3Runner, self).__init__(config)
@@ -68,6 +69,9 @@ class M3Runner(DefaultRunner):
                             dest='thread_num',
                             )
 
+    def _default_connections(self, args):
+        return args.thread_num
+
     def process_arguments(self, args):
         super(M3Runner, self).process_arguments(args)
         self.config.inputs = args.inputs
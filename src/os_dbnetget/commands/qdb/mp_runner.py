@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import threading
+from functools import partial
+from io import BytesIO
+
+from os_dbnetget.clients.sync_client import SyncClientPool
+from os_dbnetget.commands.qdb.default_runner import DefaultRunner
+from os_dbnetget.commands.qdb.inputs import (iter_batches, read_chunks,
+                                             split_batches, split_ranges)
+from os_dbnetget.commands.qdb.progress import Progress
+from os_dbnetget.utils import (Queue, binary_stdin, check_range,
+                               stop_queue_logging)
+
+# workers inherit the runner with its open inputs and pool settings, they
+# must be forked whatever the platform default start method is
+if not hasattr(os, 'fork'):
+    raise ImportError('The mp engine needs os.fork')
+try:
+    _mp = multiprocessing.get_context('fork')
+except AttributeError:
+    # python 2 always forks
+    _mp = multiprocessing
+
+
+class MPRunner(DefaultRunner):
+
+    def __init__(self, config):
+        super(MPRunner, self).__init__(config)
+        self._workers = []
+        self._worker_index = None
+        self._tasks = None
+
+    def add_arguments(self, parser):
+        super(MPRunner, self).add_arguments(parser)
+        parser.add_argument('--process-num',
+                            help='worker process num (1-256 default: cpu count {})'.format(
+                                multiprocessing.cpu_count()),
+                            type=partial(check_range, int, 1, 256),
+                            default=multiprocessing.cpu_count(),
+                            dest='process_num',
+                            )
+
+    def process_arguments(self, args):
+        self.config.process_num = args.process_num
+
+    def _client_kwargs(self, args):
+        kwargs = super(MPRunner, self)._client_kwargs(args)
+        # every worker has its own pool, share the rate limits among them
+        for key in ('max_qps', 'max_qps_per_endpoint'):
+            if kwargs[key]:
+                kwargs[key] = float(kwargs[key]) / self.config.process_num
+        return kwargs
+
+    def _metrics_file(self, args):
+        if not args.metrics_file:
+            return None
+        root, ext = os.path.splitext(args.metrics_file)
+        return '{}-{}{}'.format(root, self._worker_index, ext)
+
+    def _read_ranges(self, ranges):
+        for f, start, end in ranges:
+            for batch in split_batches(read_chunks(f, start, end), self._batch_size):
+                yield batch
+
+    def _work(self, index, args, tasks, results, ranges=None):
+        self._worker_index = index
+        # progress is reported by the parent process
+        self._progress_reporter = None
+        output = self.config.output
+        self.config.output = BytesIO()
+        try:
+            self._client = SyncClientPool(self.config.endpoints,
+                                          **self._client_kwargs(args))
+            self._start_metrics(args)
+            self._warm_up(args)
+            # workers read their own byte ranges of regular files
+            if ranges is not None:
+                batches = self._read_ranges(ranges)
+            else:
+                batches = iter(tasks.get, None)
+            for batch in batches:
+                if self._stop:
+                    break
+                self.config.progress = Progress()
+                self._process_batch(batch)
+                results.put((self.config.output.getvalue(),
+                             self.config.progress.counts(),
+                             len(batch) if ranges is not None else 0))
+                self.config.output.seek(0)
+                self.config.output.truncate()
+        except Exception as e:
+            self._logger.error('Error {}'.format(e))
+        finally:
+            self._close()
+            self._log_stats()
+            stop_queue_logging()
+            self.config.output = output
+            results.put(None)
+
+    def _alive(self):
+        return any([w.is_alive() for w in self._workers])
+
+    def _put(self, tasks, item):
+        while self._alive():
+            try:
+                tasks.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def _write(self, results):
+        finished = 0
+        while finished < len(self._workers):
+            try:
+                data = results.get(timeout=1)
+            except Queue.Empty:
+                if not self._alive():
+                    break
+                continue
+            if data is None:
+                finished += 1
+                continue
+            output, counts, lines = data
+            self.config.progress.lines += lines
+            self.config.progress.add(counts)
+            if output:
+                self.config.output.write(output)
+
+    def _feed(self, args, tasks):
+        try:
+            for batch in iter_batches(args.inputs, self._batch_size):
+                if self._stop or not self._put(tasks, batch):
+                    break
+                self.config.progress.lines += len(batch)
+        finally:
+            for _ in self._workers:
+                if not self._put(tasks, None):
+                    break
+
+    def _run(self, args):
+        process_num = self.config.process_num
+        tasks = self._tasks = _mp.Queue(maxsize=process_num * 2)
+        results = _mp.Queue(maxsize=process_num * 4)
+        # stdin is closed in the workers, it is read here even from a file
+        ranges = None
+        if binary_stdin not in args.inputs:
+            ranges = split_ranges(args.inputs, process_num)
+        self._workers = [_mp.Process(
+            target=self._work,
+            args=(i, args, tasks, results, ranges and ranges[i]))
+            for i in range(0, process_num)]
+        for w in self._workers:
+            w.daemon = True
+            w.start()
+        writer = threading.Thread(target=self._write, args=(results,))
+        writer.daemon = True
+        writer.start()
+
+        try:
+            if ranges is None:
+                self._feed(args, tasks)
+        finally:
+            writer.join()
+            for w in self._workers:
+                w.join()
+
+    def _queue_depth(self):
+        try:
+            return self._tasks.qsize() * self._batch_size
+        except (AttributeError, NotImplementedError):
+            return 0
@@ -0,0 +1,82 @@
+import io
+import os
+import threading
+import time
+
+# max iovec count of one writev call, posix guarantees at least 16, linux 1024
+IOV_MAX = 1024
+
+
+def writev(fd, chunks):
+    chunks = list(chunks)
+    idx = 0
+    while idx < len(chunks):
+        written = os.writev(fd, chunks[idx:idx + IOV_MAX])
+        while written > 0:
+            size = len(chunks[idx])
+            if written >= size:
+                written -= size
+                idx += 1
+            else:
+                chunks[idx] = memoryview(chunks[idx])[written:]
+                written = 0
+
+
+class OutputWriter(object):
+
+    def __init__(self, raw, buffer_size=1024 * 1024, flush_interval=1.0):
+        assert buffer_size >= 0, 'buffer_size must be non-negative'
+        assert flush_interval >= 0, 'flush_interval must be non-negative'
+        self._raw = raw
+        self._buffer_size = buffer_size
+        self._flush_interval = flush_interval
+        self._chunks = []
+        self._size = 0
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        self._fd = self._fileno(raw)
+
+    def _fileno(self, raw):
+        # only plain files, wrappers like os_rotatefile may switch files
+        if not hasattr(os, 'writev') or \
+                not isinstance(raw, (io.BufferedWriter, io.FileIO)):
+            return None
+        try:
+            return raw.fileno()
+        except Exception:
+            return None
+
+    def write(self, data):
+        self.writelines((data,))
+
+    def writelines(self, chunks):
+        with self._lock:
+            for chunk in chunks:
+                self._chunks.append(chunk)
+                self._size += len(chunk)
+            if self._size >= self._buffer_size or \
+                    time.time() - self._last_flush >= self._flush_interval:
+                self._flush()
+
+    def _flush(self):
+        chunks, self._chunks, self._size = self._chunks, [], 0
+        self._last_flush = time.time()
+        if not chunks:
+            return
+        if self._fd is not None:
+            # data may already be buffered in the raw file object
+            self._raw.flush()
+            writev(self._fd, chunks)
+        else:
+            self._raw.write(b''.join(chunks))
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+            self._raw.flush()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._raw.close()
@@ -8,3 +8,8 @@ class Processor(object):
 
     def process(self, data, proto):
         pass
+
+    def _log_status(self, data, status):
+        # data is the input line as bytes, decoded only when it is logged
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info('%s\t%s', data.decode('utf-8', 'replace'), status)
@@ -0,0 +1,116 @@
+import json
+import sys
+import threading
+import time
+
+
+class Progress(object):
+
+    def __init__(self):
+        self.lines = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def processed(self):
+        return self.hits + self.misses + self.errors
+
+    def record(self, status):
+        if status == 'Y':
+            self.hits += 1
+        elif status == 'N':
+            self.misses += 1
+        else:
+            self.errors += 1
+
+    def counts(self):
+        return (self.hits, self.misses, self.errors)
+
+    def add(self, counts):
+        hits, misses, errors = counts
+        self.hits += hits
+        self.misses += misses
+        self.errors += errors
+
+
+class ProgressReporter(object):
+
+    def __init__(self, progress, interval=None, queue_depth=None, stats_file=None,
+                 concurrency=None):
+        assert interval is None or interval > 0, 'interval must be positive'
+        self._progress = progress
+        self._interval = interval
+        self._queue_depth = queue_depth
+        self._stats_file = stats_file
+        self._concurrency = concurrency
+        self._start = None
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = False
+
+    def snapshot(self):
+        now = time.time()
+        progress = self._progress
+        lines, processed = progress.lines, progress.processed
+        last_time, last_processed = self._last
+        self._last = (now, processed)
+        queue = self._queue_depth() if self._queue_depth is not None else 0
+        elapsed = now - self._start
+        s = {
+            'elapsed': elapsed,
+            'lines': lines,
+            'processed': processed,
+            'keys_per_sec': (processed - last_processed) / max(now - last_time, 1e-6),
+            'avg_keys_per_sec': processed / max(elapsed, 1e-6),
+            'hits': progress.hits,
+            'misses': progress.misses,
+            'errors': progress.errors,
+            'queue': queue,
+            'inflight': max(lines - processed - queue, 0),
+        }
+        concurrency = self._concurrency() if self._concurrency is not None else None
+        if concurrency is not None:
+            s['concurrency'] = concurrency
+        return s
+
+    def report(self):
+        s = self.snapshot()
+        if self._stats_file is not None:
+            with open(self._stats_file, 'a') as f:
+                f.write(json.dumps(s, sort_keys=True) + '\n')
+            return
+        line = '[progress] {elapsed:.1f}s lines {lines} processed {processed} ' \
+            'keys/s {keys_per_sec:.1f} (avg {avg_keys_per_sec:.1f}) ' \
+            'hit {hits} miss {misses} error {errors} ' \
+            'queue {queue} inflight {inflight}'.format(**s)
+        if 'concurrency' in s:
+            line += ' concurrency {}'.format(s['concurrency'])
+        sys.stderr.write(line + '\n')
+        sys.stderr.flush()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.report()
+
+    def start(self):
+        # without an interval only the final report is made
+        self._start = time.time()
+        self._last = (self._start, self._progress.processed)
+        self._started = True
+        if self._interval is None:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.report()
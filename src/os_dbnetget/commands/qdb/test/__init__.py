@@ -1,5 +1,7 @@
 from os_dbnetget.utils import binary_stdout
 from os_dbnetget.commands.qdb import QDB
+from os_dbnetget.commands.qdb.compression import open_output
+from os_dbnetget.commands.qdb.output import OutputWriter
 from os_dbnetget.commands.qdb.test.processor import Processor
 
 
@@ -20,13 +22,16 @@ class Test(QDB):
         if args.output is None:
             output = binary_stdout
         else:
-            output = open(args.output, 'wb')
-        self.config.output = output
+            output = open_output(args.output, 'wb')
+        self.config.output = OutputWriter(output,
+                                          args.output_buffer_size * 1024,
+                                          args.output_flush_interval)
 
     def add_arguments(self, parser):
         super(Test, self).add_arguments(parser)
         parser.add_argument('-o', '--output',
-                            help='output file (default: stdout)',
+                            help='output file, compressed by its extension \
+                            .gz .bz2 .xz .zst or .lz4 (default: stdout)',
                             nargs='?',
                             dest='output',
                             )
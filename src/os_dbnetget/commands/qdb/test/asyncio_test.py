@@ -0,0 +1,10 @@
+from os_dbnetget.commands.qdb.asyncio_runner import AsyncioRunner
+from os_dbnetget.commands.qdb.test import Test as TestCommand
+
+
+class Test(TestCommand):
+    ENGINE_NAME = 'asyncio'
+
+    def __init__(self, config=None):
+        super(Test, self).__init__(config)
+        self._runner = AsyncioRunner(self.config)
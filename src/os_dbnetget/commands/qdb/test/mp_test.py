@@ -0,0 +1,10 @@
+from os_dbnetget.commands.qdb.mp_runner import MPRunner
+from os_dbnetget.commands.qdb.test import Test as TestCommand
+
+
+class Test(TestCommand):
+    ENGINE_NAME = 'mp'
+
+    def __init__(self, config=None):
+        super(Test, self).__init__(config)
+        self._runner = MPRunner(self.config)
@@ -1,5 +1,3 @@
-from io import BytesIO
-
 from os_dbnetget.commands.qdb.processor import Processor as BaseProcessor
 
 
@@ -19,11 +17,6 @@ class Processor(BaseProcessor):
                 status = 'U'
             else:
                 status = str(proto.value)
-        b = BytesIO()
-        b.write(status.encode())
-        b.write(b'\t')
-        b.write(data)
-        b.write(b'\n')
-        b.seek(0)
-        self.config.output.write(b.read())
-        self._logger.info('%s\t%s' % (data, status))
+        self.config.output.writelines((status.encode(), b'\t', data, b'\n'))
+        self.config.progress.record(status)
+        self._log_status(data, status)
@@ -1,22 +1,29 @@
+import time
 from datetime import timedelta
 from functools import partial
-from itertools import chain
 
 from os_qdb_protocal import create_protocal
-from tornado import gen, queues
+from tornado import gen, locks, queues
 from tornado.ioloop import IOLoop
 from tornado.util import TimeoutError
 
+from os_dbnetget.clients.limiter import AIMDLimiter
 from os_dbnetget.clients.tornado_client import TornadoClientPool
 from os_dbnetget.commands.qdb import qdb_key
 from os_dbnetget.commands.qdb.default_runner import DefaultRunner
+from os_dbnetget.commands.qdb.inputs import iter_lines
+from os_dbnetget.exceptions import UsageError
 from os_dbnetget.utils import check_range
 
 
 class TornadoRunner(DefaultRunner):
+    HEDGING = True
 
     def __init__(self, config):
         super(TornadoRunner, self).__init__(config)
+        self._limiter = None
+        self._active = 0
+        self._slots = None
 
     def add_arguments(self, parser):
         super(TornadoRunner, self).add_arguments(parser)
@@ -26,22 +33,57 @@ class TornadoRunner(DefaultRunner):
                             default=10,
                             dest='concurrency',
                             )
+        parser.add_argument('--adaptive-concurrency',
+                            help='adjust concurrency by latency and timeouts (AIMD), \
+                            start from --concurrency',
+                            action='store_true',
+                            dest='adaptive_concurrency',
+                            )
+        parser.add_argument('--concurrency-min',
+                            help='adaptive concurrency lower bound (1-200 default: 1)',
+                            type=partial(check_range, int, 1, 200),
+                            default=1,
+                            dest='concurrency_min',
+                            )
+        parser.add_argument('--concurrency-max',
+                            help='adaptive concurrency upper bound, as many coroutines \
+                            run and as many connections of each endpoint can open \
+                            (1-200 default: 200)',
+                            type=partial(check_range, int, 1, 200),
+                            default=200,
+                            dest='concurrency_max',
+                            )
 
     def process_arguments(self, args):
         self.config.inputs = args.inputs
         self.config.concurrency = args.concurrency
+        if args.adaptive_concurrency:
+            if args.concurrency_min > args.concurrency_max:
+                raise UsageError('--concurrency-min is greater than --concurrency-max')
+            if not args.concurrency_min <= args.concurrency <= args.concurrency_max:
+                raise UsageError('--concurrency is not between '
+                                 '--concurrency-min and --concurrency-max')
+            self._limiter = AIMDLimiter(args.concurrency,
+                                        min_limit=args.concurrency_min,
+                                        max_limit=args.concurrency_max)
+            self._slots = locks.Condition()
+            # coroutines and connections are sized for the highest limit,
+            # capped at 200 as --concurrency is. clients open on demand,
+            # as many as the limit keeps in flight unless --warm-up
+            self.config.concurrency = args.concurrency_max
         self._client = TornadoClientPool(self.config.endpoints,
-                                         timeout=args.client_timeout,
-                                         retry_max=args.client_retry_max,
-                                         retry_interval=args.client_retry_interval)
-        self._queue = queues.Queue(maxsize=args.concurrency * 3)
+                                         **self._client_kwargs(args))
+        self._queue = queues.Queue(maxsize=self.config.concurrency * 3)
+
+    def _default_connections(self, args):
+        return self.config.concurrency
 
     @gen.coroutine
     def _loop_read(self):
-        for line in chain.from_iterable(self.config.inputs):
+        for line in iter_lines(self.config.inputs):
             if self._stop:
                 break
-            line = line.strip()
+            self.config.progress.lines += 1
             yield self._queue.put(line)
         yield gen.multi([self._queue.put(None) for _ in range(0, self.config.concurrency)])
 
@@ -54,12 +96,40 @@ class TornadoRunner(DefaultRunner):
             return
 
         proto = create_protocal(self.config.cmd, q_key)
-        p = yield self._client.execute(proto)
+        if self._limiter is None:
+            p = yield self._client.execute(proto)
+        else:
+            p = yield self._limited_execute(proto)
         self.config.processor.process(data, p)
 
+    @gen.coroutine
+    def _limited_execute(self, proto):
+        while self._active >= self._limiter.limit:
+            yield self._slots.wait()
+        self._active += 1
+        # only this request's outcome is sampled, a timeout retried on
+        # another client shows up in its latency, a failed request is a drop.
+        # the latency is compared with the last endpoint's own, cached and
+        # coalesced responses reached none and are not sampled
+        dropped = True
+        used = []
+        start = time.time()
+        try:
+            p = yield self._client.execute(proto, used)
+            dropped = False
+        finally:
+            self._active -= 1
+            if dropped or used:
+                self._limiter.on_sample(time.time() - start, dropped,
+                                        used[-1].endpoint if used else None)
+            self._slots.notify(max(self._limiter.limit - self._active, 1))
+        raise gen.Return(p)
+
     @gen.coroutine
     def _run(self, args):
         try:
+            if args.warm_up:
+                self._log_warm_up((yield self._client.warm_up()))
             IOLoop.current().spawn_callback(self._loop_read)
             yield gen.multi([self._loop_process(args) for _ in range(0, self.config.concurrency)])
         except Exception as e:
@@ -90,9 +160,29 @@ class TornadoRunner(DefaultRunner):
         except:
             pass
 
+    def _queue_depth(self):
+        return self._queue.qsize()
+
+    def _concurrency(self):
+        if self._limiter is not None:
+            return self._limiter.limit
+        return self.config.concurrency
+
+    def _log_stats(self):
+        super(TornadoRunner, self)._log_stats()
+        if self._limiter is not None:
+            self._logger.debug(
+                'Adaptive concurrency limit {}, increased {} times, decreased {} times'.format(
+                    self._limiter.limit, self._limiter.increases, self._limiter.decreases))
+
     def _on_stop(self, signum, frame):
         self._stop = True
 
     def run(self, args):
         self._register_signal()
-        IOLoop.current().run_sync(partial(self._run, args))
+        self._start_progress(args)
+        self._start_metrics(args)
+        try:
+            IOLoop.current().run_sync(partial(self._run, args))
+        finally:
+            self._log_stats()
@@ -1,6 +1,10 @@
 import inspect
+import logging
+import os
 import sys
+import threading
 from argparse import ArgumentError, ArgumentParser
+from collections import OrderedDict
 from importlib import import_module
 from pkgutil import iter_modules
 
@@ -14,17 +18,133 @@ else:
     import Queue
     if sys.platform == "win32":
         # set sys.stdin to binary mode
-        import os
         import msvcrt
         msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
     binary_stdin = sys.stdin
     binary_stdout = sys.stdout
 
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    QueueHandler = QueueListener = None
+
 
 class Config(object):
     pass
 
 
+class BatchStreamHandler(logging.StreamHandler):
+    # flushing is left to the queue listener, once per drained batch
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
+if QueueHandler is not None:
+    class LazyQueueHandler(QueueHandler):
+        # records are formatted by the listener thread, not the caller
+        def prepare(self, record):
+            return record
+
+    class BatchQueueListener(QueueListener):
+        def handle(self, record):
+            super(BatchQueueListener, self).handle(record)
+            if self.queue.empty():
+                self.flush()
+
+        def flush(self):
+            for handler in self.handlers:
+                handler.flush()
+
+        def stop(self):
+            super(BatchQueueListener, self).stop()
+            self.flush()
+
+
+_queue_logging = []
+
+
+def queue_logging(handler):
+    if QueueHandler is None:
+        return handler
+    q = Queue.Queue()
+    queue_handler = LazyQueueHandler(q)
+    queue_handler.setLevel(handler.level)
+    listener = BatchQueueListener(q, handler, respect_handler_level=True)
+    listener.start()
+    _queue_logging.append((queue_handler, listener))
+    return queue_handler
+
+
+def stop_queue_logging():
+    while _queue_logging:
+        _, listener = _queue_logging.pop()
+        listener.stop()
+
+
+def _restart_queue_logging():
+    # the listener threads do not survive fork
+    for queue_handler, listener in _queue_logging:
+        queue_handler.queue = listener.queue = Queue.Queue()
+        listener._thread = None
+        listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_queue_logging)
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024):
+        assert maxsize >= 0, 'maxsize must be non-negative'
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def resize(self, maxsize):
+        assert maxsize >= 0, 'maxsize must be non-negative'
+        with self._lock:
+            self._maxsize = maxsize
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
 def walk_modules(module_path, skip_fail=True):
 
     mods = []
@@ -15,10 +15,11 @@ def load_func(func_path):
 
 
 class QDBServer(TCPServer):
-    def __init__(self, expected_code, output_func):
+    def __init__(self, expected_code, output_func, delay=0):
         super(QDBServer, self).__init__()
         self._expected_code = expected_code
         self._output_func = output_func
+        self._delay = delay
 
     @gen.coroutine
     def handle_stream(self, stream, address):
@@ -31,6 +32,8 @@ class QDBServer(TCPServer):
                 if cmd != self._expected_code:
                     stream.close()
                     break
+                if self._delay > 0:
+                    yield gen.sleep(self._delay)
                 yield stream.write(self._output_func())
             except StreamClosedError:
                 print('Closed {}'.format(address))
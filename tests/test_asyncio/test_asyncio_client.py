@@ -0,0 +1,179 @@
+import asyncio
+import socket
+import struct
+
+import pytest
+from os_qdb_protocal import create_protocal
+
+from os_dbnetget.clients.asyncio_client import AsyncioClient, AsyncioClientPool
+from os_dbnetget.clients.balancing import LeastOutstandingBalancer
+from os_dbnetget.clients.hedging import Hedger
+from os_dbnetget.commands.qdb import qdb_key
+from os_dbnetget.exceptions import ResourceLimit, RetryLimitExceeded
+
+from ..utils import unused_port
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        # server handlers of just closed connections are cancelled before
+        # the loop is closed, all_tasks is a Task method before 3.7
+        all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+        tasks = [t for t in all_tasks(loop) if not t.done()]
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+
+
+def hello_world():
+    data = b'hello world!'
+    return struct.pack('>ii%ds' % len(data), 0, len(data), data)
+
+
+def not_in_qdb():
+    return struct.pack('>i', 1)
+
+
+async def start_server(expected_code, output_func, delay=0):
+    async def handle(reader, writer):
+        while True:
+            try:
+                data = await reader.readexactly(1+4+16+4)
+            except asyncio.IncompleteReadError:
+                break
+            cmd, _, _, _ = struct.unpack('>bi16si', data)
+            if cmd != expected_code:
+                break
+            if delay > 0:
+                await asyncio.sleep(delay)
+            writer.write(output_func())
+        writer.close()
+
+    server = await asyncio.start_server(handle, 'localhost', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_client_with_wrong_endpoint():
+    c = AsyncioClient('notexisthostname.com', unused_port())
+    with pytest.raises(socket.gaierror):
+        run(c.execute(None))
+
+
+def test_client_connect_fail():
+    c = AsyncioClient('localhost', unused_port(),
+                      retry_max=1, retry_interval=0)
+    with pytest.raises(RetryLimitExceeded):
+        run(c.execute(None))
+
+
+def test_client_pool_try_out():
+    async def _test():
+        endpoints = ['localhost:{}'.format(unused_port()) for _ in range(2)]
+        pool = AsyncioClientPool(endpoints, retry_max=1, retry_interval=0)
+        try:
+            await pool.execute(None)
+        finally:
+            await pool.close()
+
+    with pytest.raises(ResourceLimit):
+        run(_test())
+
+
+@pytest.mark.parametrize('expected_code, output_func, proto_type, expected_value', [
+    (1, hello_world, 'get', b'hello world!'),
+    (12, not_in_qdb, 'test', False),
+])
+def test_pool_execute(expected_code, output_func, proto_type, expected_value):
+    async def _test():
+        server, port = await start_server(expected_code, output_func)
+        pool = AsyncioClientPool(['localhost:{}'.format(port)], retry_max=0)
+        try:
+            p = await pool.execute(create_protocal(proto_type, qdb_key('xxx')))
+            assert p.value == expected_value
+
+            protos = [create_protocal(proto_type, qdb_key('key{}'.format(i)))
+                      for i in range(100)]
+            r = await pool.execute_many(protos, batch_size=16)
+            assert [p.value for p in r] == [expected_value] * 100
+        finally:
+            await pool.close()
+            server.close()
+            await server.wait_closed()
+            await asyncio.sleep(0.1)
+
+    run(_test())
+
+
+def test_pool_hedge():
+    async def _test():
+        slow, slow_port = await start_server(1, hello_world, delay=0.5)
+        fast, fast_port = await start_server(1, hello_world)
+        hedger = Hedger(delay=0.05, budget=100)
+        # the slow endpoint is chosen first
+        pool = AsyncioClientPool(['localhost:{}'.format(slow_port),
+                                  'localhost:{}'.format(fast_port)],
+                                 retry_max=0, hedger=hedger,
+                                 balancer=LeastOutstandingBalancer())
+        try:
+            start = asyncio.get_event_loop().time()
+            p = await pool.execute(create_protocal('get', qdb_key('xxx')))
+            assert p.value == b'hello world!'
+            assert asyncio.get_event_loop().time() - start < 0.4
+            assert pool.stats()['hedge']['sent'] == 1
+            assert pool.stats()['hedge']['won'] == 1
+        finally:
+            await pool.close()
+            for server in (slow, fast):
+                server.close()
+                await server.wait_closed()
+
+    run(_test())
+
+
+def test_pool_warm_up():
+    async def _test():
+        server, port = await start_server(1, hello_world)
+        dead = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        dead.bind(('localhost', 0))
+        dead_endpoint = 'localhost:{}'.format(dead.getsockname()[1])
+        pool = AsyncioClientPool([dead_endpoint, 'localhost:{}'.format(port)],
+                                 max_concurrency=3, retry_max=0)
+        try:
+            report = await pool.warm_up()
+            assert report['connected'] == 3
+            assert list(report['failed'].keys()) == [dead_endpoint]
+            p = await pool.execute(create_protocal('get', qdb_key('xxx')))
+            assert p.value == b'hello world!'
+        finally:
+            await pool.close()
+            dead.close()
+            server.close()
+            await server.wait_closed()
+
+    run(_test())
+
+
+def test_pool_close_prober():
+    async def _test():
+        dead = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        dead.bind(('localhost', 0))
+        pool = AsyncioClientPool(['localhost:{}'.format(dead.getsockname()[1])],
+                                 retry_max=0, retry_interval=0,
+                                 breaker_threshold=1, probe_interval=10)
+        try:
+            with pytest.raises(ResourceLimit):
+                await pool.execute(create_protocal('get', qdb_key('xxx')))
+            prober = pool._prober
+            assert prober is not None
+        finally:
+            await pool.close()
+            dead.close()
+        assert prober.done()
+        assert pool._prober is None
+
+    run(_test())
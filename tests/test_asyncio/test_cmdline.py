@@ -0,0 +1,12 @@
+from ..cmd_runner import call
+
+
+def test_command_help():
+    data = [
+        ('get --engine asyncio -h', b'engine: [asyncio]'),
+        ('get --engine asyncio -h', b'--concurrency'),
+        ('test --engine asyncio -h', b'engine: [asyncio]')
+    ]
+    for c, expect in data:
+        stdout, _ = call(c)
+        assert expect in stdout
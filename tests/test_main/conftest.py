@@ -0,0 +1,10 @@
+import pytest
+
+from ..utils import start_pipeline_server, stop_pipeline_server
+
+
+@pytest.fixture
+def pipeline_server():
+    server = start_pipeline_server()
+    yield server
+    stop_pipeline_server(server)
@@ -0,0 +1,194 @@
+import pytest
+from os_dbnetget.clients import balancing, breaker, limiter
+from os_dbnetget.clients.backoff import Backoff
+from os_dbnetget.clients.balancing import (EndpointSet,
+                                           LeastOutstandingBalancer,
+                                           PowerOfTwoBalancer)
+from os_dbnetget.clients.breaker import CLOSED, HALF_OPEN, OPEN
+from os_dbnetget.clients.limiter import TokenBucket
+from os_dbnetget.exceptions import ResourceLimit
+
+
+class FakeClient(object):
+    def __init__(self, address, port):
+        self.endpoint = '{}:{}'.format(address, port)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_endpoint_set_checkout():
+    es = EndpointSet(['a:1', 'b:1'], max_concurrency=2, breaker_threshold=2)
+    checked = [es.checkout(FakeClient) for _ in range(4)]
+    assert es.clients_count == 4
+    assert es.checkout(FakeClient) == (None, None)
+
+    state, client = checked[0]
+    es.checkin(state, client, 0.1)
+    assert es.checkout(FakeClient) == (state, client)
+
+    for state, client in checked:
+        assert es.discard(state, client) == (state.breaker.failures == 2)
+        assert client.closed
+    assert es.exhausted()
+    with pytest.raises(ResourceLimit):
+        es.checkout(FakeClient)
+
+
+def test_least_outstanding_balancer():
+    es = EndpointSet(['a:1', 'b:1', 'c:1'], max_concurrency=3,
+                     balancer=LeastOutstandingBalancer())
+    checked = [es.checkout(FakeClient) for _ in range(3)]
+    assert set([s.endpoint for s, _ in checked]) == set(['a:1', 'b:1', 'c:1'])
+    for state, client in checked:
+        es.checkin(state, client, 0.5 if state.endpoint == 'b:1' else 0.01)
+    state, _ = es.checkout(FakeClient)
+    assert state.endpoint != 'b:1'
+
+
+def test_power_of_two_balancer():
+    es = EndpointSet(['a:1', 'b:1'], balancer=PowerOfTwoBalancer())
+    checked = [es.checkout(FakeClient) for _ in range(2)]
+    for state, client in checked:
+        es.checkin(state, client, 1.0 if state.endpoint == 'a:1' else 0.01)
+    for _ in range(10):
+        state, client = es.checkout(FakeClient)
+        assert state.endpoint == 'b:1'
+        es.checkin(state, client, 0.01)
+
+
+@pytest.mark.parametrize('balancer', [LeastOutstandingBalancer, PowerOfTwoBalancer])
+def test_balancer_single_caller(balancer):
+    # one caller always finds an idle client, endpoints without one are
+    # still chosen and get a new client
+    es = EndpointSet(['slow:1', 'fast:1'], max_concurrency=2, balancer=balancer())
+    counts = {'slow:1': 0, 'fast:1': 0}
+    for _ in range(20):
+        state, client = es.checkout(FakeClient)
+        counts[state.endpoint] += 1
+        es.checkin(state, client, 0.005 if state.endpoint == 'slow:1' else 0.0001)
+    assert counts['slow:1'] <= 1
+    assert es.clients_count == counts['slow:1'] + 1
+
+
+def test_endpoint_set_breaker(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(breaker, '_now', lambda: now[0])
+    es = EndpointSet(['a:1', 'b:1'], max_concurrency=2, breaker_threshold=2,
+                     probe_interval=1.0)
+    a = es.states[0]
+    checked = [es.checkout(FakeClient) for _ in range(4)]
+    a_clients = [c for state, c in checked if state is a]
+    for state, client in checked:
+        if state is not a:
+            es.checkin(state, client)
+    # capacity of a discarded client is not lost
+    assert not es.discard(a, a_clients[0])
+    assert a.candidates == 1
+    assert es.discard(a, a_clients[1])
+    assert a.breaker.state == OPEN
+    assert a.clients_count == 0 and a.candidates == 2
+    for _ in range(10):
+        state, client = es.checkout(FakeClient)
+        assert state.endpoint == 'b:1'
+        es.checkin(state, client)
+
+    assert es.probe_due() == []
+    now[0] += 1
+    assert es.probe_due() == [a]
+    assert a.breaker.state == HALF_OPEN
+    es.on_probe(a, False)
+    assert a.breaker.state == OPEN
+    # probes back off exponentially
+    now[0] += 2
+    assert es.probe_due() == [a]
+    es.on_probe(a, True)
+    assert a.breaker.state == CLOSED
+    assert a.breaker.trips == 1
+
+
+def test_backoff():
+    backoff = Backoff(1, 10, random_func=lambda: 1.0)
+    assert [backoff.delay(i) for i in range(6)] == [1, 2, 4, 8, 10, 10]
+    backoff = Backoff(1, 10, random_func=lambda: 0.0)
+    assert [backoff.delay(i) for i in range(6)] == [0.5, 1, 2, 4, 5, 5]
+    assert Backoff(0).delay(3) == 0
+
+
+def test_endpoint_set_backoff(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(breaker, '_now', lambda: now[0])
+    monkeypatch.setattr(balancing, '_now', lambda: now[0])
+    es = EndpointSet(['a:1', 'b:1'], max_concurrency=2, retry_interval=1.0)
+    a, b = es.states
+    checked = [es.checkout(FakeClient) for _ in range(4)]
+    for state, client in checked:
+        if state is a:
+            es.discard(state, client)
+        else:
+            es.checkin(state, client)
+    # a failed endpoint backs off, requests go to the others
+    assert a.breaker.allow() and a.breaker.backing_off()
+    for _ in range(10):
+        state, client = es.checkout(FakeClient)
+        assert state is b
+        es.checkin(state, client)
+
+    state, client = es.checkout(FakeClient)
+    es.discard(state, client)
+    assert b.breaker.retry_at < a.breaker.retry_at
+    # every endpoint backs off, checkouts wait for the one due first
+    assert es.checkout(FakeClient) == (None, None)
+    assert es.wait_time(limit=10) == pytest.approx(b.breaker.retry_at - now[0])
+    assert es.wait_time() <= 1
+    now[0] = b.breaker.retry_at
+    state, client = es.checkout(FakeClient)
+    assert state is b
+    es.checkin(state, client)
+    assert not b.breaker.backing_off()
+
+    now[0] += 10
+    assert not a.breaker.backing_off()
+
+
+def test_endpoint_set_shrink():
+    es = EndpointSet(['a:1'], max_concurrency=4, min_concurrency=1,
+                     idle_timeout=10)
+    state = es.states[0]
+    now = balancing._now() + 100
+    checked = [es.checkout(FakeClient) for _ in range(4)]
+    for s, client in checked:
+        es.checkin(s, client)
+    # the clients were just created
+    assert es.shrink(now) == 0
+    for _ in range(5):
+        es.checkin(*es.checkout(FakeClient))
+    # only one was needed through the last idle_timeout
+    assert es.shrink(now + 5) == 0
+    assert es.shrink(now + 10) == 3
+    assert state.clients_count == 1 and state.candidates == 3
+    assert [c for _, c in checked if c.closed] == [c for _, c in checked[:3]]
+    assert es.shrink(now + 20) == 0
+
+
+def test_endpoint_set_rate_limit(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(balancing, '_now', lambda: now[0])
+    monkeypatch.setattr(limiter, '_now', lambda: now[0])
+    es = EndpointSet(['a:1', 'b:1'], max_concurrency=2)
+    a, b = es.states
+    a.bucket = TokenBucket(10, burst=1)
+    b.bucket = TokenBucket(5, burst=1)
+    # tokens are taken at checkout, an endpoint without tokens is skipped
+    state, client = es.checkout(FakeClient)
+    es.checkin(state, client)
+    other, client = es.checkout(FakeClient)
+    assert other is not state
+    es.checkin(other, client)
+    # every endpoint is out of tokens, nothing is checked out
+    assert es.checkout(FakeClient) == (None, None)
+    assert es.wait_time() == pytest.approx(0.1)
+    now[0] += 0.11
+    state, client = es.checkout(FakeClient)
+    assert state is a
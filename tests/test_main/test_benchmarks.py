@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+from os_dbnetget.clients.sync_client import SyncClient
+from os_dbnetget.commands.qdb import qdb_key
+from os_qdb_protocal import create_protocal
+
+from benchmarks.limiter import measure
+from benchmarks.qdb_server import BenchServer
+
+
+@pytest.fixture
+def bench_server():
+    server = BenchServer(('localhost', 0), payload_size=10, seed=1)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_bench_server(bench_server):
+    port = bench_server.server_address[1]
+    client = SyncClient('localhost', port)
+    keys = [qdb_key('http://www.a.com/{}'.format(i)) for i in range(200)]
+    try:
+        r = client.execute(create_protocal('get', keys[0]))
+        assert r.value == b'x' * 10
+        bench_server.miss_rate = 0.5
+        bench_server.error_rate = 0.2
+        values = [p.value for p in client.execute_pipeline(
+            [create_protocal('test', key) for key in keys])]
+        assert set(values) == set([True, False, 5])
+    finally:
+        client.close()
+
+
+def test_limiter_bench():
+    timings = measure(100)
+    assert set(timings) == set(['reserve', 'try_acquire', 'checkout',
+                                'checkout_limited'])
+    assert all([t > 0 for t in timings.values()])
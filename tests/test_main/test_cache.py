@@ -0,0 +1,63 @@
+import time
+
+from os_dbnetget.clients.cache import ENTRY_OVERHEAD, ResponseCache
+from os_dbnetget.clients.client import fill_proto
+from os_dbnetget.commands.qdb import qdb_key
+from os_qdb_protocal import create_protocal
+
+
+def proto(cmd, url, value=None):
+    return fill_proto(create_protocal(cmd, qdb_key(url)), value)
+
+
+def test_response_cache():
+    cache = ResponseCache(maxsize=2)
+    cache.set(proto('get', 'http://a.com/', b'a'))
+    cache.set(proto('test', 'http://a.com/', True))
+    p = proto('get', 'http://a.com/')
+    assert cache.get(p)
+    assert p.value == b'a'
+    p = proto('test', 'http://a.com/')
+    assert cache.get(p)
+    assert p.value is True
+
+    cache.set(proto('get', 'http://b.com/', b'b'))
+    assert len(cache) == 2
+    assert not cache.get(proto('get', 'http://a.com/'))
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_response_cache_negative_and_errors():
+    cache = ResponseCache(negative_ttl=0)
+    cache.set(proto('test', 'http://a.com/', False))
+    assert len(cache) == 0
+
+    # a get miss can not be told from a server error, test can be unknown
+    cache = ResponseCache()
+    cache.set(proto('get', 'http://a.com/', None))
+    cache.set(proto('test', 'http://a.com/', None))
+    cache.set(proto('test', 'http://b.com/', -3))
+    assert len(cache) == 0
+
+    cache = ResponseCache()
+    cache.set(proto('test', 'http://a.com/', False))
+    p = proto('test', 'http://a.com/', True)
+    assert cache.get(p)
+    assert p.value is False
+    assert cache.negative_hits == 1
+
+
+def test_response_cache_ttl_and_memory():
+    cache = ResponseCache(ttl=0.01)
+    cache.set(proto('get', 'http://a.com/', b'a'))
+    time.sleep(0.02)
+    assert not cache.get(proto('get', 'http://a.com/'))
+    assert cache.memory == 0
+
+    cache = ResponseCache(max_memory=(ENTRY_OVERHEAD + 16 + 100) * 2)
+    for url in ('http://a.com/', 'http://b.com/', 'http://c.com/'):
+        cache.set(proto('get', url, b'x' * 100))
+    assert len(cache) == 2
+    assert cache.memory <= (ENTRY_OVERHEAD + 16 + 100) * 2
+    cache.set(proto('get', 'http://d.com/', b'x' * 1000))
+    assert len(cache) == 2
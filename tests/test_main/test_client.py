@@ -0,0 +1,41 @@
+import struct
+
+from os_dbnetget.clients.client import fill_proto
+from os_dbnetget.commands.qdb import qdb_key
+from os_qdb_protocal import create_protocal
+
+
+def feed(qdb_proto, data):
+    # run the downstream parser the way the clients do
+    parser = qdb_proto.downstream()
+    size = next(parser)
+    while size >= 0:
+        chunk, data = data[:size], data[size:]
+        size = parser.send(chunk)
+    return qdb_proto
+
+
+def response(exist, value=None):
+    data = struct.pack('>i', exist)
+    if value is not None:
+        data += struct.pack('>i', len(value)) + value
+    return data
+
+
+def test_protocal_value():
+    key = qdb_key('http://a.com/')
+    assert feed(create_protocal('get', key), response(0, b'abc')).value == b'abc'
+    # a get leaves the same None for a miss and for an error
+    assert feed(create_protocal('get', key), response(1)).value is None
+    assert feed(create_protocal('get', key), response(-1)).value is None
+    assert feed(create_protocal('test', key), response(0)).value is True
+    assert feed(create_protocal('test', key), response(1)).value is False
+    assert feed(create_protocal('test', key), response(2)).value is None
+    assert feed(create_protocal('test', key), response(-1) + struct.pack('>i', 3)).value == 3
+
+
+def test_fill_proto():
+    p = create_protocal('get', qdb_key('http://a.com/'))
+    assert '_value' in p.__slots__
+    assert fill_proto(p, b'abc') is p
+    assert p.value == b'abc'
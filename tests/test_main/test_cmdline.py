@@ -27,3 +27,41 @@ def test_command_help():
 def test_not_exist_cmd():
     _, stderr = call('not_exist_cmd')
     assert b'invalid choice' in stderr
+
+
+def test_mp_engine_help():
+    data = [
+        ('get --engine mp -h', b'engine: [mp]'),
+        ('get --engine mp -h', b'--process-num'),
+        ('test --engine mp -h', b'engine: [mp]')
+    ]
+    for c, expect in data:
+        stdout, _ = call(c)
+        assert expect in stdout
+
+
+def test_mp_engine(tmpdir, pipeline_server):
+    port = pipeline_server.server_address[1]
+    input_file = tmpdir.join('input.txt')
+    input_file.write('\n'.join(['http://www.a.com/{}'.format(i)
+                                for i in range(300)] + ['bad']))
+    cmdline = 'test --engine mp --process-num 2 -E localhost:{} -i {}'.format(
+        port, input_file.strpath)
+    stdout, _ = call(cmdline)
+    lines = stdout.splitlines()
+    assert len(lines) == 301
+    assert len(set([l.split(b'\t')[1] for l in lines])) == 301
+    assert b'E\tbad' in lines
+
+
+def test_mp_engine_forks():
+    from os_dbnetget.commands.qdb import mp_runner
+    if hasattr(mp_runner._mp, 'get_start_method'):
+        assert mp_runner._mp.get_start_method() == 'fork'
+
+
+def test_connections_range():
+    cmdline = 'test -E localhost:{} --min-connections 5 --max-connections 2'.format(
+        unused_port())
+    stdout, _ = call(cmdline)
+    assert b'--min-connections is greater than --max-connections' in stdout
@@ -0,0 +1,84 @@
+import gzip
+import os
+import threading
+from io import BytesIO
+
+import pytest
+from os_dbnetget.commands.qdb.compression import (COMPRESSIONS, LazyReader,
+                                                  ThreadedReader, ThreadedWriter,
+                                                  open_input, open_output)
+from os_dbnetget.commands.qdb.inputs import iter_lines
+
+LINES = [str(i).encode() for i in range(10000)]
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS, ids=lambda c: c.name)
+def test_compressed_round_trip(tmpdir, compression):
+    path = tmpdir.join('data' + compression.extensions[0]).strpath
+    # appended writes are read back as one file
+    for lines in (LINES[:5000], LINES[5000:]):
+        output = open_output(path)
+        assert isinstance(output, ThreadedWriter)
+        output.write(b'\n'.join(lines) + b'\n')
+        output.close()
+    with open(path, 'rb') as f:
+        assert f.read(len(compression.magic)) == compression.magic
+        f.seek(0)
+        f = open_input(f)
+        assert isinstance(f, ThreadedReader)
+        assert list(iter_lines([f])) == LINES
+        f.close()
+
+
+def test_plain_input_output(tmpdir):
+    path = tmpdir.join('data.txt').strpath
+    output = open_output(path)
+    assert not isinstance(output, ThreadedWriter)
+    output.write(b'a\nb\n')
+    output.close()
+    with open(path, 'rb') as f:
+        assert open_input(f) is f
+        assert list(iter_lines([f])) == [b'a', b'b']
+
+
+def test_pipe_input():
+    r, w = os.pipe()
+    f = os.fdopen(r, 'rb')
+    # nothing is read before the first read
+    reader = open_input(f)
+    assert isinstance(reader, LazyReader)
+
+    def write():
+        with os.fdopen(w, 'wb') as fw:
+            fw.write(gzip.compress(b'\n'.join(LINES)))
+
+    t = threading.Thread(target=write)
+    t.start()
+    assert list(iter_lines([reader])) == LINES
+    t.join()
+    reader.close()
+
+
+def test_threaded_reader():
+    data = b''.join(LINES)
+    raw = gzip.GzipFile(fileobj=BytesIO(gzip.compress(data)))
+    reader = ThreadedReader(raw, chunk_size=7)
+    assert reader.read(5) == data[:5]
+    assert reader.read1(100) == data[5:7]
+    assert reader.read() == data[7:]
+    assert reader.read() == b''
+
+
+def test_threaded_writer_error():
+    class BrokenFile(BytesIO):
+        def write(self, data):
+            raise IOError('disk full')
+
+    writer = ThreadedWriter(BrokenFile())
+    writer.write(b'x')
+    with pytest.raises(IOError):
+        writer.flush()
+    with pytest.raises(IOError):
+        writer.write(b'y')
+    with pytest.raises(IOError):
+        writer.close()
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from os_dbnetget.clients.hedging import Hedger, Race, Scheduler
+
+
+def test_hedger_budget():
+    hedger = Hedger(delay=0.1, budget=10, burst=2)
+    assert hedger.delay() == 0.1
+    assert hedger.acquire()
+    assert hedger.acquire()
+    assert not hedger.acquire()
+    for _ in range(10):
+        hedger.record(0.01)
+    assert hedger.acquire()
+    assert not hedger.acquire()
+    # saved up hedges are capped by the burst
+    for _ in range(100):
+        hedger.record(0.01)
+    assert hedger.acquire()
+    assert hedger.acquire()
+    assert not hedger.acquire()
+    hedger.record(0.2, won=True)
+    assert hedger.stats() == {'delay': 0.1, 'requests': 111, 'sent': 5, 'won': 1}
+    hedger.refund()
+    assert hedger.sent == 4
+    assert hedger.acquire()
+
+
+def test_hedger_observed_delay():
+    hedger = Hedger(percentile=90, window=100)
+    assert hedger.delay() is None
+    for i in range(99):
+        hedger.record(0.001 * (i + 1))
+    assert hedger.delay() is None
+    hedger.record(0.1)
+    assert abs(hedger.delay() - 0.09) < 0.002
+    for _ in range(100):
+        hedger.record(0.001)
+    assert hedger.delay() == 0.001
+
+
+def test_race():
+    event = threading.Event()
+
+    def slow():
+        event.wait()
+        return 'slow'
+
+    def fail():
+        raise ValueError('fail')
+
+    race = Race()
+    race.start(0, slow)
+    assert not race.wait(0.05)
+    race.start(1, fail)
+    race.start(2, lambda: 'fast')
+    assert race.wait(1)
+    assert race.winner == 2 and race.value == 'fast'
+    event.set()
+
+    race = Race()
+    race.start(0, fail)
+    start = time.time()
+    assert race.wait()
+    assert time.time() - start < 1
+    assert race.winner is None
+    assert isinstance(race.error, ValueError)
+
+
+def test_race_inline():
+    won = []
+    race = Race(won.append)
+    race.start(1, lambda: 'thread')
+    assert race.wait(1)
+    race.run(0, lambda: 'inline')
+    assert race.winner == 1 and race.value == 'thread'
+    assert won == [1]
+
+
+def test_scheduler():
+    scheduler = Scheduler()
+    called = []
+    event = threading.Event()
+    scheduler.call_later(0.05, lambda: called.append(2) or event.set())
+    scheduler.call_later(0.01, lambda: called.append(1))
+    entry = scheduler.call_later(0.02, lambda: called.append(3))
+    scheduler.cancel(entry)
+    assert event.wait(1)
+    assert called == [1, 2]
+    scheduler.stop()
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from io import BytesIO
+from itertools import chain
+
+import pytest
+from os_dbnetget.commands.qdb.inputs import (iter_batches, iter_lines,
+                                             read_chunks, split_lines,
+                                             split_ranges)
+
+DATA = b'a\nbb\n\n  ccc \r\nd\ne' * 7
+
+
+def expected_lines(data):
+    return [line.strip() for line in BytesIO(data)]
+
+
+def test_split_lines():
+    assert split_lines(b'a\nb\n') == [b'a', b'b', b'']
+    assert split_lines(b'a \nb\r') == [b'a', b'b']
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 16, 1024])
+def test_read_chunks_stream(chunk_size):
+    lines = chain.from_iterable(read_chunks(BytesIO(DATA), chunk_size=chunk_size))
+    assert list(lines) == expected_lines(DATA)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 16, 1024])
+def test_read_chunks_mmap(tmpdir, chunk_size):
+    f = tmpdir.join('input.txt')
+    f.write(DATA + b'\n', 'wb')
+    with open(f.strpath, 'rb') as fp:
+        lines = chain.from_iterable(read_chunks(fp, chunk_size=chunk_size))
+        assert list(lines) == expected_lines(DATA + b'\n')
+
+
+@pytest.mark.parametrize('parts', [1, 2, 3, 7, 100])
+def test_split_ranges(tmpdir, parts):
+    f = tmpdir.join('input.txt')
+    f.write(DATA, 'wb')
+    with open(f.strpath, 'rb') as fp:
+        ranges = split_ranges([fp], parts)
+        assert len(ranges) == parts
+        lines = []
+        for part in ranges:
+            for input_file, start, end in part:
+                for chunk in read_chunks(input_file, start, end, chunk_size=5):
+                    lines.extend(chunk)
+    assert lines == expected_lines(DATA)
+
+
+def test_split_ranges_stream(tmpdir):
+    f = tmpdir.join('empty.txt')
+    f.write(b'', 'wb')
+    with open(f.strpath, 'rb') as fp:
+        assert list(iter_lines([fp, BytesIO(b'x\n')])) == [b'x']
+        assert split_ranges([fp, BytesIO()], 2) is None
+
+
+def test_iter_batches():
+    data = DATA + b'\n'
+    batches = list(iter_batches([BytesIO(data)], 4))
+    assert all([len(b) == 4 for b in batches[:-1]])
+    assert list(chain.from_iterable(batches)) == expected_lines(data)
+
+
+def test_iter_batches_slow_stream():
+    r, w = os.pipe()
+    os.write(w, b'a\nb\nc\n')
+    closer = threading.Timer(1, os.close, (w,))
+    closer.start()
+    with os.fdopen(r, 'rb') as f:
+        start = time.time()
+        batches = iter_batches([f], 128)
+        # the lines in are sent without waiting for a full batch
+        assert next(batches) == [b'a', b'b', b'c']
+        assert time.time() - start < 0.5
+        assert list(batches) == []
+    closer.join()
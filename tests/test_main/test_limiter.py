@@ -0,0 +1,127 @@
+import threading
+
+import pytest
+from os_dbnetget.clients import limiter as limiter_module
+from os_dbnetget.clients.limiter import AIMDLimiter, TokenBucket, create_bucket
+
+
+def test_aimd_increase():
+    limiter = AIMDLimiter(2, min_limit=1, max_limit=4)
+    for _ in range(100):
+        limiter.on_sample(0.001)
+    assert limiter.limit == 4
+    assert limiter.increases == 2
+    assert limiter.baseline() == 0.001
+
+
+def test_aimd_decrease_on_timeout():
+    limiter = AIMDLimiter(100, min_limit=10, max_limit=200, backoff=0.5)
+    limiter.on_sample(0.001)
+    limiter.on_sample(0.001, dropped=True)
+    assert limiter.limit == 50
+    limiter._last_decrease = 0
+    limiter.on_sample(0.001, dropped=True)
+    assert limiter.limit == 25
+    limiter._last_decrease = 0
+    limiter.on_sample(0.001, dropped=True)
+    limiter._last_decrease = 0
+    limiter.on_sample(0.001, dropped=True)
+    assert limiter.limit == 10
+    assert limiter.decreases == 4
+
+
+def test_aimd_decrease_on_latency():
+    limiter = AIMDLimiter(10, backoff=0.5, tolerance=2.0)
+    limiter.on_sample(0.01)
+    limiter.on_sample(0.015)
+    assert limiter.limit == 10
+    limiter.on_sample(0.05)
+    assert limiter.limit == 5
+    # at most one decrease per round trip
+    limiter.on_sample(0.05)
+    assert limiter.limit == 5
+
+
+def test_aimd_baseline_window():
+    limiter = AIMDLimiter(10, window=3)
+    for latency in (0.001, 0.002, 0.002):
+        limiter.on_sample(latency)
+    assert limiter.baseline() == 0.001
+    for latency in (0.003, 0.003, 0.003):
+        limiter.on_sample(latency)
+    assert limiter.baseline() == 0.003
+
+
+def test_aimd_endpoint_baselines():
+    # a slow endpoint is compared with its own baseline, not the fast one's
+    limiter = AIMDLimiter(10, max_limit=50)
+    for _ in range(200):
+        limiter.on_sample(0.0001, key='fast:1')
+        limiter.on_sample(0.005, key='slow:1')
+    assert limiter.decreases == 0
+    assert limiter.limit > 10
+    assert limiter.baseline('fast:1') == 0.0001
+    assert limiter.baseline('slow:1') == 0.005
+    limiter.on_sample(0.02, key='slow:1')
+    assert limiter.decreases == 1
+
+
+def test_token_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(limiter_module, '_now', lambda: now[0])
+    bucket = TokenBucket(10, burst=5)
+    for _ in range(5):
+        assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1)
+    assert bucket.reserve(2) == pytest.approx(0.3)
+    now[0] += 0.3
+    assert bucket.reserve() == pytest.approx(0.1)
+    # idle time refills no more than the burst
+    now[0] += 60
+    assert bucket.delay(5) == 0
+    assert bucket.reserve(5) == 0
+    assert bucket.delay() == pytest.approx(0.1)
+    assert bucket.reserve() == pytest.approx(0.1)
+    # more than a burst is due once the bucket is full
+    now[0] += 60
+    assert bucket.delay(50) == 0
+
+
+def test_token_bucket_try_acquire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(limiter_module, '_now', lambda: now[0])
+    bucket = TokenBucket(10, burst=2)
+    assert bucket.try_acquire(2)
+    assert not bucket.try_acquire()
+    now[0] += 0.11
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    # more than a burst is taken from a full bucket and paid back later
+    now[0] += 60
+    assert bucket.try_acquire(5)
+    assert bucket.delay() == pytest.approx(0.4)
+
+    # threads racing for the tokens take no more than there are
+    now[0] += 60
+    taken = []
+
+    def run():
+        for _ in range(100):
+            if bucket.try_acquire():
+                taken.append(1)
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(taken) == 2
+
+
+def test_create_bucket():
+    assert create_bucket(None) is None
+    assert create_bucket(0) is None
+    bucket = create_bucket(100, 0.5)
+    assert bucket.rate == 100
+    assert bucket.burst == 50
+    assert create_bucket(10, 0).burst == 1
@@ -0,0 +1,82 @@
+from os_dbnetget.clients.metrics import (Histogram, Metrics, MetricsReporter,
+                                         PrometheusExporter)
+from os_dbnetget.clients.sync_client import SyncClient, SyncClientPool
+from os_dbnetget.commands.qdb import qdb_key
+from os_qdb_protocal import create_protocal
+
+
+def test_histogram():
+    h = Histogram()
+    assert h.percentile(50) is None
+    for i in range(1, 1001):
+        h.record(i / 1000.0)
+    assert h.count == 1000
+    assert h.min == 1000
+    assert h.max == 1000000
+    for p in (50, 90, 99):
+        assert abs(h.percentile(p) - p / 100.0) < p / 100.0 * 0.02
+
+    other = Histogram()
+    other.record(2)
+    h.merge(other)
+    assert h.count == 1001
+    assert h.percentile(100) == 2.0
+
+
+def test_client_stats(pipeline_server):
+    port = pipeline_server.server_address[1]
+    client = SyncClient('localhost', port)
+    try:
+        client.execute(create_protocal('get', qdb_key('key')))
+        client.execute_pipeline([create_protocal('get', qdb_key('key{}'.format(i)))
+                                 for i in range(10)])
+        stats = client.stats()
+        assert stats['requests'] == 11
+        assert stats['connects'] == 1
+        assert stats['bytes_out'] == 11 * 25
+        assert stats['bytes_in'] == 11 * (8 + 16)
+        for name in ('send', 'ttfb', 'total'):
+            assert stats[name]['count'] == 11
+        assert stats['total']['p99'] >= stats['ttfb']['p50']
+    finally:
+        client.close()
+
+
+def test_client_reconnect_stats(pipeline_server):
+    port = pipeline_server.server_address[1]
+    pipeline_server.close_after = 2
+    client = SyncClient('localhost', port, retry_interval=0)
+    try:
+        client.execute_pipeline([create_protocal('get', qdb_key('key{}'.format(i)))
+                                 for i in range(5)])
+        stats = client.stats()
+        assert stats['reconnects'] == 1
+        assert stats['errors'] == 1
+        assert stats['connects'] == 2
+        assert stats['requests'] == 5
+    finally:
+        client.close()
+
+
+def test_pool_stats_and_exporter(pipeline_server, tmpdir):
+    port = pipeline_server.server_address[1]
+    endpoint = 'localhost:{}'.format(port)
+    metrics = Metrics()
+    pool = SyncClientPool([endpoint], max_concurrency=2, metrics=metrics)
+    try:
+        protos = [create_protocal('get', qdb_key('key{}'.format(i)))
+                  for i in range(20)]
+        list(pool.execute_many(protos, 8))
+    finally:
+        pool.close()
+    stats = pool.stats()
+    assert stats['endpoints'] == metrics.stats()
+    assert stats['endpoints'][endpoint]['requests'] == 20
+
+    f = tmpdir.join('metrics.prom')
+    reporter = MetricsReporter(pool.stats, exporter=PrometheusExporter(f.strpath))
+    reporter.start()
+    reporter.stop()
+    lines = f.read().splitlines()
+    assert 'os_dbnetget_requests_total{{endpoint="{}"}} 20'.format(endpoint) in lines
+    assert 'os_dbnetget_total_seconds_count{{endpoint="{}"}} 20'.format(endpoint) in lines
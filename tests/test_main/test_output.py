@@ -0,0 +1,50 @@
+from io import BytesIO
+
+from os_dbnetget.commands.qdb.output import OutputWriter, writev
+
+
+def test_output_writer_buffer():
+    raw = BytesIO()
+    writer = OutputWriter(raw, buffer_size=8, flush_interval=3600)
+    writer.writelines((b'abc', b'\n'))
+    assert raw.getvalue() == b''
+    writer.writelines((b'defgh', b'\n'))
+    assert raw.getvalue() == b'abc\ndefgh\n'
+    writer.write(b'x')
+    assert raw.getvalue() == b'abc\ndefgh\n'
+    writer.flush()
+    assert raw.getvalue() == b'abc\ndefgh\nx'
+
+
+def test_output_writer_interval():
+    raw = BytesIO()
+    writer = OutputWriter(raw, buffer_size=1024, flush_interval=0)
+    writer.write(b'abc')
+    assert raw.getvalue() == b'abc'
+
+
+def test_output_writer_writev(tmpdir):
+    f = tmpdir.join('output.txt')
+    raw = open(f.strpath, 'ab')
+    writer = OutputWriter(raw, buffer_size=1024 * 1024, flush_interval=3600)
+    raw.write(b'head\n')
+    lines = [(str(i).encode(), b'\n') for i in range(3000)]
+    for line in lines:
+        writer.writelines(line)
+    writer.close()
+    expected = b'head\n' + b''.join([b''.join(line) for line in lines])
+    assert f.read('rb') == expected
+
+
+def test_writev_partial(monkeypatch, tmpdir):
+    import os
+    real_writev = os.writev
+
+    def short_writev(fd, chunks):
+        return real_writev(fd, [bytes(chunks[0])[:2]])
+
+    monkeypatch.setattr(os, 'writev', short_writev)
+    f = tmpdir.join('output.txt')
+    with open(f.strpath, 'wb') as raw:
+        writev(raw.fileno(), [b'abc', b'defg', b'h'])
+    assert f.read('rb') == b'abcdefgh'
@@ -0,0 +1,60 @@
+import json
+
+from os_dbnetget.commands.qdb.progress import Progress, ProgressReporter
+
+
+def test_progress():
+    progress = Progress()
+    for status in ('Y', 'Y', 'N', 'E', 'U', '-3'):
+        progress.record(status)
+    assert progress.counts() == (2, 1, 3)
+    assert progress.processed == 6
+    progress.add((1, 2, 3))
+    assert progress.counts() == (3, 3, 6)
+
+
+def test_progress_reporter(tmpdir):
+    f = tmpdir.join('progress.json')
+    progress = Progress()
+    reporter = ProgressReporter(progress, 3600, lambda: 5, f.strpath)
+    reporter.start()
+    progress.lines = 20
+    for _ in range(10):
+        progress.record('Y')
+    progress.record('N')
+    reporter.stop()
+    reporter.stop()
+    lines = f.read().splitlines()
+    assert len(lines) == 1
+    s = json.loads(lines[0])
+    assert s['lines'] == 20
+    assert s['processed'] == 11
+    assert s['hits'] == 10
+    assert s['misses'] == 1
+    assert s['queue'] == 5
+    assert s['inflight'] == 4
+    assert s['keys_per_sec'] > 0
+
+
+def test_progress_reporter_stderr(capsys):
+    progress = Progress()
+    reporter = ProgressReporter(progress, 3600)
+    reporter.start()
+    progress.lines = 1
+    progress.record('E')
+    reporter.stop()
+    _, err = capsys.readouterr()
+    assert err.startswith('[progress]')
+    assert 'error 1' in err
+
+
+def test_progress_reporter_final_only(tmpdir):
+    f = tmpdir.join('progress.json')
+    progress = Progress()
+    reporter = ProgressReporter(progress, None, stats_file=f.strpath)
+    reporter.stop()
+    assert not f.check()
+    reporter.start()
+    progress.record('Y')
+    reporter.stop()
+    assert json.loads(f.read())['processed'] == 1
@@ -0,0 +1,61 @@
+import logging
+
+import pytest
+from os_qdb_protocal import create_protocal
+
+from os_dbnetget.clients.client import fill_proto
+from os_dbnetget.commands.qdb import key_cache, qdb_key, qdb_keys
+from os_dbnetget.commands.qdb.get import processor as get_processor
+from os_dbnetget.commands.qdb.progress import Progress
+from os_dbnetget.commands.qdb.test import processor as test_processor
+
+
+def test_qdb_key_cache():
+    key_cache.clear()
+    k = qdb_key(b'http://www.google.com/')
+    assert len(k) == 16
+    assert qdb_key(b'http://www.google.com/') == k
+    assert (key_cache.hits, key_cache.misses) == (1, 1)
+
+    with pytest.raises(NotImplementedError):
+        qdb_key(b'bad')
+    with pytest.raises(NotImplementedError):
+        qdb_key(b'bad')
+    assert (key_cache.hits, key_cache.misses) == (2, 2)
+
+
+def test_qdb_keys():
+    lines = [b'http://www.google.com/', b'bad',
+             b'http://www.google.com/', b'http://www.bing.com/']
+    keys = qdb_keys(lines)
+    assert keys[0] == keys[2] == qdb_key(lines[0])
+    assert keys[1] is None
+    assert keys[3] == qdb_key(lines[3])
+
+
+class Output(object):
+    def __init__(self):
+        self.data = []
+
+    def writelines(self, lines):
+        self.data.extend(lines)
+
+
+class Config(object):
+    def __init__(self):
+        self.output = Output()
+        self.progress = Progress()
+
+
+@pytest.mark.parametrize('module, proto_type, value, status', [
+    (get_processor, 'get', b'value', 'Y'),
+    (test_processor, 'test', False, 'N'),
+])
+def test_processor_status_log(caplog, module, proto_type, value, status):
+    line = u'http://www.google.com/\u4e2d'.encode('utf-8')
+    proto = fill_proto(create_protocal(proto_type, qdb_key(line)), value)
+    processor = module.Processor(Config())
+    with caplog.at_level(logging.INFO):
+        processor.process(line, proto)
+    assert [r.getMessage() for r in caplog.records] == \
+        [u'http://www.google.com/\u4e2d\t{}'.format(status)]
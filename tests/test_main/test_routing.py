@@ -0,0 +1,48 @@
+from collections import Counter
+
+import pytest
+from os_dbnetget.clients.routing import (ConsistentHashRouter, Router,
+                                         ShardMapRouter)
+from os_dbnetget.commands.qdb import qdb_key
+
+
+def keys(n):
+    return [qdb_key('http://www.example.com/{}'.format(i)) for i in range(n)]
+
+
+def test_router_shards():
+    with pytest.raises(AssertionError):
+        Router([])
+    with pytest.raises(AssertionError):
+        Router([('a:1',), ()])
+    r = Router([['a:1'], ('b:1', 'c:1')])
+    assert r.shards == (('a:1',), ('b:1', 'c:1'))
+
+
+def test_shard_map_router():
+    r = ShardMapRouter([('a:1',), ('b:1',), ('c:1',)])
+    counter = Counter([r.route(k) for k in keys(3000)])
+    assert set(counter.keys()) == set([0, 1, 2])
+    assert min(counter.values()) > 800
+
+
+def test_consistent_hash_router():
+    shards = [('a:1',), ('b:1',), ('c:1',), ('d:1',)]
+    r = ConsistentHashRouter(shards)
+    ks = keys(4000)
+    routes = [r.route(k) for k in ks]
+    assert [r.route(k) for k in ks] == routes
+    assert min(Counter(routes).values()) > 600
+
+    r2 = ConsistentHashRouter(shards[:3])
+    moved = sum([1 for k, idx in zip(ks, routes)
+                 if idx < 3 and r2.route(k) != idx])
+    assert moved == 0
+
+
+def test_consistent_hash_router_bytes_shards():
+    shards = [('a:1', 'b:1'), ('c:1',), ('d:1',)]
+    r = ConsistentHashRouter(shards)
+    rb = ConsistentHashRouter([tuple([e.encode() for e in s]) for s in shards])
+    ks = keys(1000)
+    assert [rb.route(k) for k in ks] == [r.route(k) for k in ks]
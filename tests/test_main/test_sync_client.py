@@ -1,8 +1,19 @@
 import socket
+import threading
+import time
 
 import pytest
+from os_dbnetget.clients.balancing import LeastOutstandingBalancer
+from os_dbnetget.clients.breaker import CLOSED, OPEN
+from os_dbnetget.clients.cache import ResponseCache
+from os_dbnetget.clients.hedging import Hedger
+from os_dbnetget.clients.routing import ShardMapRouter
 from os_dbnetget.clients.sync_client import SyncClient, SyncClientPool
+from os_dbnetget.commands.qdb import qdb_key
 from os_dbnetget.exceptions import RetryLimitExceeded, ResourceLimit
+from os_qdb_protocal import create_protocal
+
+from ..utils import start_pipeline_server, stop_pipeline_server, unused_port
 
 
 def test_sync_client_with_wrong_endpoint():
@@ -44,3 +55,435 @@ def test_client_pool_try_out():
     pool = SyncClientPool(endpoints, retry_max=1, retry_interval=0)
     with pytest.raises(ResourceLimit):
         pool.execute(None)
+
+
+def test_sync_client_pipeline(pipeline_server):
+    port = pipeline_server.server_address[1]
+    keys = [qdb_key('key{}'.format(i)) for i in range(100)]
+
+    c = SyncClient('localhost', port, pipeline_depth=8)
+    protos = c.execute_pipeline([create_protocal('get', k) for k in keys])
+    assert [p.value for p in protos] == keys
+
+    pipeline_server.close_after = 30
+    protos = c.execute_pipeline([create_protocal('get', k) for k in keys],
+                                depth=10)
+    assert [p.value for p in protos] == keys
+    c.close()
+
+
+def test_client_pool_execute_many(pipeline_server):
+    port = pipeline_server.server_address[1]
+    keys = [qdb_key('key{}'.format(i)) for i in range(300)]
+
+    pool = SyncClientPool(['localhost:{}'.format(port)], max_concurrency=2)
+    protos = pool.execute_many([create_protocal('get', k) for k in keys],
+                               batch_size=64)
+    assert [p.value for p in protos] == keys
+    pool.close()
+
+
+def test_client_pool_execute_many_resend(pipeline_server):
+    # every connection is closed after 20 requests, a client gives up
+    # after its second one and the pool sends the rest on another
+    port = pipeline_server.server_address[1]
+    pipeline_server.close_every = 20
+    keys = [qdb_key('key{}'.format(i)) for i in range(100)]
+    pool = SyncClientPool(['localhost:{}'.format(port)], retry_interval=0,
+                          breaker_threshold=10, pipeline_depth=4)
+    try:
+        protos = list(pool.execute_many([create_protocal('get', k) for k in keys],
+                                        batch_size=100))
+        assert [p.value for p in protos] == keys
+        # answered requests are not sent again, only those whose response
+        # was not read before a connection failed, resending the whole
+        # batch would add the 40 answered before the first client gave up
+        assert pipeline_server.requests < 140
+    finally:
+        pool.close()
+
+
+def test_client_pool_execute_many_parts():
+    servers = [start_pipeline_server() for _ in range(2)]
+    for server in servers:
+        server.delay = 0.01
+    endpoints = ['localhost:{}'.format(s.server_address[1]) for s in servers]
+    keys = [qdb_key('key{}'.format(i)) for i in range(64)]
+    pool = SyncClientPool(endpoints)
+    try:
+        start = time.time()
+        protos = list(pool.execute_many([create_protocal('get', k) for k in keys],
+                                        batch_size=64))
+        assert [p.value for p in protos] == keys
+        # a part on each endpoint at the same time
+        assert [s.requests for s in servers] == [32, 32]
+        assert time.time() - start < 0.6
+    finally:
+        pool.close()
+        for server in servers:
+            stop_pipeline_server(server)
+
+
+def test_sync_client_large_value(pipeline_server):
+    port = pipeline_server.server_address[1]
+    pipeline_server.value_repeat = 10000
+    keys = [qdb_key('key{}'.format(i)) for i in range(5)]
+
+    c = SyncClient('localhost', port)
+    for k in keys:
+        p = c.execute(create_protocal('get', k))
+        assert p.value == k * 10000
+        assert type(p.value) is bytes
+    c.close()
+
+
+def test_client_pool_cache(pipeline_server):
+    port = pipeline_server.server_address[1]
+    keys = [qdb_key('key{}'.format(i)) for i in range(10)]
+    cache = ResponseCache()
+
+    pool = SyncClientPool(['localhost:{}'.format(port)], cache=cache)
+    for _ in range(2):
+        p = pool.execute(create_protocal('get', keys[0]))
+        assert p.value == keys[0]
+    protos = pool.execute_many([create_protocal('get', k) for k in keys])
+    assert [p.value for p in protos] == keys
+    assert cache.hits == 2
+    assert len(cache) == 10
+    pool.close()
+
+
+def test_client_pool_coalesce(pipeline_server):
+    port = pipeline_server.server_address[1]
+    pipeline_server.delay = 0.3
+    key = qdb_key('key')
+    pool = SyncClientPool(['localhost:{}'.format(port)], coalesce=True)
+    results = []
+
+    def execute():
+        results.append(pool.execute(create_protocal('get', key)))
+
+    threads = [threading.Thread(target=execute) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [p.value for p in results] == [key] * 5
+    assert pipeline_server.requests + pool.coalesced == 5
+    assert pool.coalesced > 0
+
+    pipeline_server.delay = 0
+    requests = pipeline_server.requests
+    keys = [qdb_key('key{}'.format(i % 3)) for i in range(10)]
+    protos = pool.execute_many([create_protocal('get', k) for k in keys])
+    assert [p.value for p in protos] == keys
+    assert pipeline_server.requests - requests == 3
+    pool.close()
+
+
+def test_client_pool_coalesce_threads(pipeline_server):
+    port = pipeline_server.server_address[1]
+    keys = [qdb_key('key{}'.format(i % 3)) for i in range(10)]
+    pool = SyncClientPool(['localhost:{}'.format(port)], max_concurrency=4,
+                          coalesce=True)
+
+    def execute():
+        for _ in range(20):
+            list(pool.execute_many([create_protocal('get', k) for k in keys]))
+
+    threads = [threading.Thread(target=execute) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # every batch of 10 keys has 7 duplicates, no count is lost
+    assert pool.coalesced == 8 * 20 * 7
+    pool.close()
+
+
+def test_client_pool_router(pipeline_server):
+    port = pipeline_server.server_address[1]
+    shards = [('localhost:{}'.format(port),), ('localhost:{}'.format(unused_port()),)]
+    router = ShardMapRouter(shards)
+    keys = [qdb_key('key{}'.format(i)) for i in range(20)]
+    alive = [k for k in keys if router.route(k) == 0]
+    dead = [k for k in keys if router.route(k) == 1]
+
+    pool = SyncClientPool([e for s in shards for e in s], router=router,
+                          retry_max=0, retry_interval=0)
+    protos = pool.execute_many([create_protocal('get', k) for k in alive])
+    assert [p.value for p in protos] == alive
+    assert pipeline_server.requests == len(alive)
+    with pytest.raises(ResourceLimit):
+        pool.execute(create_protocal('get', dead[0]))
+    protos = pool.execute_many([create_protocal('get', k) for k in alive])
+    assert [p.value for p in protos] == alive
+    pool.close()
+
+
+def test_client_pool_max_qps(pipeline_server):
+    port = pipeline_server.server_address[1]
+    keys = [qdb_key('key{}'.format(i)) for i in range(30)]
+
+    pool = SyncClientPool(['localhost:{}'.format(port)], max_qps=100,
+                          qps_burst=0.1)
+    start = time.time()
+    for k in keys[:10]:
+        pool.execute(create_protocal('get', k))
+    protos = list(pool.execute_many([create_protocal('get', k) for k in keys[10:]],
+                                    batch_size=5))
+    assert [p.value for p in protos] == keys[10:]
+    # 10 burst tokens, the other 20 requests wait 0.2s
+    assert time.time() - start >= 0.18
+    pool.close()
+
+    pool = SyncClientPool(['localhost:{}'.format(port)], max_qps_per_endpoint=100,
+                          qps_burst=0.1)
+    start = time.time()
+    for k in keys:
+        pool.execute(create_protocal('get', k))
+    assert time.time() - start >= 0.18
+    pool.close()
+
+
+def test_client_pool_rate_limit_wait(pipeline_server):
+    port = pipeline_server.server_address[1]
+    key = qdb_key('xxx')
+    pool = SyncClientPool(['localhost:{}'.format(port)], max_qps_per_endpoint=5,
+                          qps_burst=0.2, affinity=0)
+    state = pool._endpoint_set.states[0]
+    try:
+        pool.execute(create_protocal('get', key))
+        start = time.time()
+        t = threading.Thread(target=pool.execute, args=(create_protocal('get', key),))
+        t.start()
+        time.sleep(0.05)
+        # a throttled caller does not hold a client while it waits
+        assert state.outstanding == 0 and len(state.idle) == 1
+        t.join()
+        assert time.time() - start >= 0.15
+    finally:
+        pool.close()
+
+
+def test_client_pool_breaker():
+    # a bound but not listening port refuses connections
+    dead = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    dead.bind(('localhost', 0))
+    port = dead.getsockname()[1]
+    key = qdb_key('xxx')
+
+    pool = SyncClientPool(['localhost:{}'.format(port)], retry_max=0,
+                          retry_interval=0, breaker_threshold=2,
+                          probe_interval=0.1)
+    state = pool._endpoint_set.states[0]
+    with pytest.raises(ResourceLimit):
+        pool.execute(create_protocal('get', key))
+    assert state.breaker.state == OPEN
+    assert state.breaker.failures == 2
+    assert state.candidates == 1
+    # fail fast while the endpoint is ejected
+    with pytest.raises(ResourceLimit):
+        pool.execute(create_protocal('get', key))
+    assert state.breaker.failures == 2
+
+    dead.close()
+    server = start_pipeline_server(port)
+    try:
+        deadline = time.time() + 5
+        while state.breaker.state != CLOSED and time.time() < deadline:
+            time.sleep(0.05)
+        assert state.breaker.state == CLOSED
+        assert pool.execute(create_protocal('get', key)).value == key
+        assert server.requests == 2
+    finally:
+        pool.close()
+        stop_pipeline_server(server)
+
+
+def test_client_pool_backoff(pipeline_server):
+    port = pipeline_server.server_address[1]
+    dead = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    dead.bind(('localhost', 0))
+    keys = [qdb_key('key{}'.format(i)) for i in range(20)]
+
+    # the dead endpoint is chosen first
+    pool = SyncClientPool(['localhost:{}'.format(dead.getsockname()[1]),
+                           'localhost:{}'.format(port)],
+                          retry_max=3, retry_interval=10,
+                          balancer=LeastOutstandingBalancer())
+    start = time.time()
+    try:
+        for k in keys:
+            assert pool.execute(create_protocal('get', k)).value == k
+        # no retry sleep on the request path, the endpoint backs off instead
+        assert time.time() - start < 5
+        state = pool._endpoint_set.states[0]
+        assert state.breaker.failures == 1
+        assert state.breaker.backing_off()
+    finally:
+        pool.close()
+        dead.close()
+
+
+def test_client_pool_backoff_wait():
+    dead = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    dead.bind(('localhost', 0))
+    port = dead.getsockname()[1]
+    key = qdb_key('xxx')
+    servers = []
+
+    def restart():
+        time.sleep(0.25)
+        dead.close()
+        servers.append(start_pipeline_server(port))
+
+    # the only endpoint is retried after its backoff, not ejected at once
+    pool = SyncClientPool(['localhost:{}'.format(port)], retry_max=0,
+                          retry_interval=0.2, breaker_threshold=3)
+    state = pool._endpoint_set.states[0]
+    t = threading.Thread(target=restart)
+    t.start()
+    start = time.time()
+    try:
+        assert pool.execute(create_protocal('get', key)).value == key
+        assert time.time() - start >= 0.25
+        assert state.breaker.state == CLOSED
+        assert state.breaker.trips == 0 and state.breaker.failures == 0
+    finally:
+        t.join()
+        pool.close()
+        for server in servers:
+            stop_pipeline_server(server)
+
+
+def test_client_pool_hedge(pipeline_server):
+    slow = start_pipeline_server()
+    slow.delay = 0.5
+    key = qdb_key('xxx')
+    hedger = Hedger(delay=0.05, budget=100)
+
+    # the slow endpoint is chosen first
+    pool = SyncClientPool(['localhost:{}'.format(slow.server_address[1]),
+                           'localhost:{}'.format(pipeline_server.server_address[1])],
+                          hedger=hedger, balancer=LeastOutstandingBalancer())
+    try:
+        start = time.time()
+        assert pool.execute(create_protocal('get', key)).value == key
+        assert time.time() - start < 0.4
+        assert hedger.sent == 1 and hedger.won == 1
+        # the loser is discarded once it finishes
+        pool.close()
+        assert slow.requests == 1
+    finally:
+        stop_pipeline_server(slow)
+
+
+def test_client_pool_hedge_inline(pipeline_server):
+    port = pipeline_server.server_address[1]
+    key = qdb_key('xxx')
+    hedger = Hedger(delay=0.01, budget=100)
+    pool = SyncClientPool(['localhost:{}'.format(port)], hedger=hedger)
+    try:
+        # no spare endpoint, the hedge is not sent and not counted
+        pipeline_server.delay = 0.1
+        assert pool.execute(create_protocal('get', key)).value == key
+        time.sleep(0.05)
+        assert hedger.sent == 0
+
+        # requests answered in time start no threads
+        pipeline_server.delay = 0
+        hedger._delay = 1
+        threads = threading.active_count()
+        for _ in range(50):
+            assert pool.execute(create_protocal('get', key)).value == key
+            assert threading.active_count() <= threads
+        assert hedger.requests == 51
+    finally:
+        pool.close()
+
+
+def test_client_pool_affinity(pipeline_server):
+    port = pipeline_server.server_address[1]
+    pool = SyncClientPool(['localhost:{}'.format(port)], max_concurrency=2,
+                          affinity=4)
+    state = pool._endpoint_set.states[0]
+    key = qdb_key('xxx')
+    try:
+        # the client stays with the thread until the fourth call
+        for i in range(3):
+            assert pool.execute(create_protocal('get', key)).value == key
+            assert state.outstanding == 1 and not state.idle
+        pool.execute(create_protocal('get', key))
+        assert state.outstanding == 0 and len(state.idle) == 1
+
+        # a pipeline uses the client once per request
+        protos = [create_protocal('get', key) for _ in range(4)]
+        assert len(list(pool.execute_many(protos))) == 4
+        assert state.outstanding == 0 and len(state.idle) == 1
+
+        # threads without a client take the parked ones
+        errors = []
+
+        def run():
+            try:
+                for i in range(50):
+                    k = qdb_key('key{}'.format(i))
+                    assert pool.execute(create_protocal('get', k)).value == k
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors
+        assert state.clients_count <= 2
+    finally:
+        pool.close()
+    assert state.clients_count == 0
+
+
+def test_client_pool_warm_up(pipeline_server):
+    port = pipeline_server.server_address[1]
+    dead = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    dead.bind(('localhost', 0))
+    dead_endpoint = 'localhost:{}'.format(dead.getsockname()[1])
+
+    pool = SyncClientPool([dead_endpoint, 'localhost:{}'.format(port)],
+                          max_concurrency=3, retry_max=0)
+    dead_state, state = pool._endpoint_set.states
+    try:
+        report = pool.warm_up()
+        assert report['connected'] == 3
+        assert list(report['failed'].keys()) == [dead_endpoint]
+        assert dead_state.breaker.state == OPEN
+        assert len(state.idle) == 3 and state.outstanding == 0
+        assert all([c._socket is not None for c in state.idle])
+    finally:
+        pool.close()
+        dead.close()
+
+
+def test_client_pool_queue_wait(pipeline_server):
+    pipeline_server.delay = 0.05
+    port = pipeline_server.server_address[1]
+    pool = SyncClientPool(['localhost:{}'.format(port)], max_concurrency=1)
+    key = qdb_key('xxx')
+
+    def run():
+        pool.execute(create_protocal('get', key))
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = pool.stats()
+        assert stats['connections'] == 1
+        assert stats['queue_wait']['count'] >= 1
+        assert stats['queue_wait']['max'] >= 0.04
+    finally:
+        pool.close()
@@ -89,3 +89,45 @@ def test_check_range():
         else:
             assert expected == utils.check_range(
                 input_type, valid_range[0], valid_range[1], input)
+
+
+def test_lru_cache():
+    cache = utils.LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    cache.resize(1)
+    assert len(cache) == 1
+    assert cache.get('c') == 3
+
+    cache.resize(0)
+    cache.set('d', 4)
+    assert cache.get('d') is None
+
+
+def test_queue_logging():
+    import logging
+    from io import StringIO
+    stream = StringIO()
+    handler = utils.BatchStreamHandler(stream)
+    handler.setLevel(logging.INFO)
+    logger = logging.getLogger('test_queue_logging')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    queue_handler = utils.queue_logging(handler)
+    logger.addHandler(queue_handler)
+    try:
+        for i in range(100):
+            logger.info('%s\t%s', i, 'Y')
+        logger.debug('not logged')
+    finally:
+        utils.stop_queue_logging()
+        logger.removeHandler(queue_handler)
+    lines = stream.getvalue().splitlines()
+    assert lines == ['{}\tY'.format(i) for i in range(100)]
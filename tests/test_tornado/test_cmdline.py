@@ -1,4 +1,5 @@
 from ..cmd_runner import call
+from ..utils import unused_port
 
 
 def test_command_help():
@@ -12,6 +13,13 @@ def test_command_help():
         assert expect in stdout
 
 
+def test_adaptive_concurrency_range():
+    cmdline = 'test --engine tornado -E localhost:{} --adaptive-concurrency ' \
+        '--concurrency 50 --concurrency-max 20'.format(unused_port())
+    stdout, _ = call(cmdline)
+    assert b'--concurrency is not between' in stdout
+
+
 def test_test_command(fake_qdb_never_exist_server_port, tmpdir):
     data = [
         ('i_am_not_in_qdb', b'N\ti_am_not_in_qdb')
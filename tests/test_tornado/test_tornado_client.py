@@ -1,11 +1,15 @@
 import socket
 import struct
+import time
 
 from os_qdb_protocal import create_protocal
 from tornado import gen
 from tornado.testing import AsyncTestCase, bind_unused_port, gen_test
 
 import pytest
+from os_dbnetget.clients.balancing import LeastOutstandingBalancer
+from os_dbnetget.clients.cache import ResponseCache
+from os_dbnetget.clients.hedging import Hedger
 from os_dbnetget.clients.tornado_client import TornadoClient, TornadoClientPool
 from os_dbnetget.commands.qdb import qdb_key
 from os_dbnetget.exceptions import ResourceLimit, RetryLimitExceeded
@@ -70,6 +74,7 @@ class TestTornadoClient(AsyncTestCase):
             proto = create_protocal(proto_type, key)
             p = yield client.execute(proto)
             assert p.value == expected_value
+            assert type(p.value) is type(expected_value)
 
         finally:
             if client is not None:
@@ -91,3 +96,169 @@ class TestTornadoClient(AsyncTestCase):
             return struct.pack('>i', 1)
 
         yield self.start(12, not_in_qdb, 'test', False)
+
+    @gen_test
+    def test_client_pipeline(self):
+        data = b'hello world!'
+
+        def hello_world():
+            l = len(data)
+            return struct.pack('>ii%ds' % l, 0, l, data)
+
+        port = self.start_server(1, hello_world)
+        client = TornadoClient('localhost', port, retry_max=0)
+        try:
+            protos = [create_protocal('get', qdb_key('key{}'.format(i)))
+                      for i in range(50)]
+            r = yield client.execute_pipeline(protos, depth=8)
+            assert [p.value for p in r] == [data] * 50
+            stats = client.stats()
+            assert stats['requests'] == 50
+            assert stats['connects'] == 1
+            assert stats['bytes_out'] == 50 * 25
+            assert stats['total']['count'] == 50
+        finally:
+            client.close()
+
+    @gen_test
+    def test_client_pool_used(self):
+        data = b'hello world!'
+
+        def hello_world():
+            l = len(data)
+            return struct.pack('>ii%ds' % l, 0, l, data)
+
+        port = self.start_server(1, hello_world)
+        pool = TornadoClientPool(['localhost:{}'.format(port)], retry_max=0,
+                                 cache=ResponseCache())
+        try:
+            used = []
+            yield pool.execute(create_protocal('get', qdb_key('xxx')), used)
+            assert [s.endpoint for s in used] == ['localhost:{}'.format(port)]
+            # a cached response reaches no endpoint
+            used = []
+            yield pool.execute(create_protocal('get', qdb_key('xxx')), used)
+            assert used == []
+        finally:
+            yield pool.close()
+
+    @gen_test
+    def test_client_pool_execute_many(self):
+        data = b'hello world!'
+
+        def hello_world():
+            l = len(data)
+            return struct.pack('>ii%ds' % l, 0, l, data)
+
+        port = self.start_server(1, hello_world)
+        pool = TornadoClientPool(['localhost:{}'.format(port)], retry_max=0)
+        completed = []
+        try:
+            protos = [create_protocal('get', qdb_key('key{}'.format(i)))
+                      for i in range(200)]
+            r = yield pool.execute_many(protos, batch_size=32,
+                                        callback=completed.append)
+            assert r == protos
+            assert [p.value for p in r] == [data] * 200
+            assert len(completed) == 200
+            stats = pool.stats()['endpoints']['localhost:{}'.format(port)]
+            assert stats['requests'] == 200
+        finally:
+            yield pool.close()
+
+    @gen_test
+    def test_get_large_value(self):
+        data = b'x' * 200000
+
+        def large_value():
+            l = len(data)
+            return struct.pack('>ii%ds' % l, 0, l, data)
+
+        yield self.start(1, large_value, 'get', data)
+
+    @gen_test
+    def test_client_pool_coalesce(self):
+        data = b'hello world!'
+
+        def hello_world():
+            l = len(data)
+            return struct.pack('>ii%ds' % l, 0, l, data)
+
+        port = self.start_server(1, hello_world)
+        pool = TornadoClientPool(['localhost:{}'.format(port)], retry_max=0,
+                                 coalesce=True)
+        try:
+            key = qdb_key('xxx')
+            r = yield [pool.execute(create_protocal('get', key)) for _ in range(5)]
+            assert [p.value for p in r] == [data] * 5
+            assert pool.coalesced == 4
+        finally:
+            yield pool.close()
+
+    @gen_test
+    def test_client_pool_max_qps(self):
+        data = b'hello world!'
+
+        def hello_world():
+            l = len(data)
+            return struct.pack('>ii%ds' % l, 0, l, data)
+
+        port = self.start_server(1, hello_world)
+        pool = TornadoClientPool(['localhost:{}'.format(port)], retry_max=0,
+                                 max_qps=100, qps_burst=0.1)
+        try:
+            start = time.time()
+            for i in range(20):
+                yield pool.execute(create_protocal('get', qdb_key('key{}'.format(i))))
+            # 10 burst tokens, the other 10 requests wait 0.1s
+            assert time.time() - start >= 0.08
+        finally:
+            yield pool.close()
+
+    @gen_test
+    def test_client_pool_hedge(self):
+        data = b'hello world!'
+
+        def hello_world():
+            l = len(data)
+            return struct.pack('>ii%ds' % l, 0, l, data)
+
+        port = self.start_server(1, hello_world)
+        sock, slow_port = bind_unused_port()
+        slow = QDBServer(1, hello_world, delay=0.5)
+        slow.add_socket(sock)
+        hedger = Hedger(delay=0.05, budget=100)
+        # the slow endpoint is chosen first
+        pool = TornadoClientPool(['localhost:{}'.format(slow_port),
+                                  'localhost:{}'.format(port)],
+                                 retry_max=0, hedger=hedger,
+                                 balancer=LeastOutstandingBalancer())
+        try:
+            start = time.time()
+            p = yield pool.execute(create_protocal('get', qdb_key('xxx')))
+            assert p.value == data
+            assert time.time() - start < 0.4
+            assert hedger.sent == 1 and hedger.won == 1
+        finally:
+            yield pool.close()
+            slow.stop()
+
+    @gen_test
+    def test_client_pool_warm_up(self):
+        def hello_world():
+            return struct.pack('>ii', 0, 0)
+
+        port = self.start_server(1, hello_world)
+        dead = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        dead.bind(('localhost', 0))
+        dead_endpoint = 'localhost:{}'.format(dead.getsockname()[1])
+        pool = TornadoClientPool([dead_endpoint, 'localhost:{}'.format(port)],
+                                 max_concurrency=3, retry_max=0)
+        try:
+            report = yield pool.warm_up()
+            assert report['connected'] == 3
+            assert list(report['failed'].keys()) == [dead_endpoint]
+            assert len(pool._endpoint_set.states[1].idle) == 3
+        finally:
+            yield pool.close()
+            dead.close()
@@ -1,8 +1,70 @@
 import socket
+import struct
+import threading
+import time
 from contextlib import closing
 
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
 
 def unused_port():
     with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
         s.bind(('', 0))
         return s.getsockname()[1]
+
+
+class PipelineHandler(socketserver.BaseRequestHandler):
+    close_after = None
+
+    def recvall(self, size):
+        data = b''
+        while len(data) < size:
+            d = self.request.recv(size - len(data))
+            if not d:
+                return None
+            data += d
+        return data
+
+    def handle(self):
+        count = 0
+        while True:
+            data = self.recvall(1+4+16+4)
+            if data is None:
+                break
+            count += 1
+            if self.server.close_after is not None and count > self.server.close_after:
+                self.server.close_after = None
+                break
+            if self.server.close_every is not None and count > self.server.close_every:
+                break
+            _, _, key, _ = struct.unpack('>bi16si', data)
+            self.server.requests += 1
+            time.sleep(self.server.delay)
+            value = key * self.server.value_repeat
+            self.request.sendall(struct.pack('>ii', 0, len(value)) + value)
+
+
+class PipelineServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start_pipeline_server(port=0):
+    server = PipelineServer(('localhost', port), PipelineHandler)
+    server.close_after = None
+    server.close_every = None
+    server.value_repeat = 1
+    server.requests = 0
+    server.delay = 0
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def stop_pipeline_server(server):
+    server.shutdown()
+    server.server_close()